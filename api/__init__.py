@@ -11,4 +11,4 @@
 __author__ = 'Douglas Morato'
 __version__ = '0.1'
 
-from configuration import BaseSource, DataSource
+from configuration import BaseSource, DataSource, DistributedIndex
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+    attributes
+
+    A compact mapping of the fields to sphinx attributes. searchd keeps the
+    attributes of every document in RAM, so instead of the safe but wide
+    types of :func:`tryton_sphinx.utils.guess_type`:
+
+    * integers become `sql_attr_uint` bitfields as wide as the range of
+      their column (with some headroom) needs, and the indexing of a source
+      fails once a value outgrew its bitfield or became negative (see
+      :func:`overflow_check`) instead of wrapping it silently
+    * foreign keys become `sql_attr_uint`: ids only grow, so they would
+      outgrow any bitfield
+    * selections become small ordinal bitfields, the ordinals being listed
+      in the config; they are no longer full text fields
+    * dates are indexed as timestamps, clamped to the range of a 32 bits
+      timestamp
+    * booleans stay `sql_attr_bool`, which sphinx packs in a bit
+
+    The memory of the attributes of every index is estimated before and
+    after the mapping.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+from trytond.model.fields import (Integer, BigInteger, Boolean, Date,
+    DateTime, Selection, Many2One)
+
+from utils import get_attributes
+from planner import format_size
+
+#: The ranges of the columns are multiplied by this so that the bitfields
+#: still hold the values once the table has grown
+HEADROOM = 2
+
+#: Sphinx stores the document ids on 64 bits
+DOCID_BYTES = 8
+
+
+class Attribute(object):
+    """How a field is indexed as an attribute.
+
+    `type`: The sphinx attribute type, eg. `sql_attr_uint`
+    `bits`: The width of a `sql_attr_uint` bitfield (None for 32 bits
+            which are not checked, 32 for 32 bits which are)
+    `expression`: The SQL expression selecting the value (None for the
+                  column itself)
+    `lookup`: For an ordinal attribute, a list of `(value, ordinal)` tuples
+    """
+
+    def __init__(self, type, bits=None, expression=None, lookup=None):
+        self.type = type
+        self.bits = bits
+        self.expression = expression
+        self.lookup = lookup
+
+
+def bit_width(maximum, headroom=HEADROOM):
+    """Returns the number of bits a bitfield needs to hold the values up to
+    `maximum` times the headroom (None if it needs 32 bits or more)
+    """
+    bits = max(1, int(maximum * headroom).bit_length())
+    return bits if bits < 32 else None
+
+
+def epoch(table, name):
+    """Returns the expression of the unix timestamp of a date column.
+    Sphinx keeps timestamps as unsigned 32 bits integers, so the dates
+    before 1970 become 1970 instead of wrapping to 2106.
+    """
+    return 'LEAST(GREATEST(CAST(EXTRACT(EPOCH FROM "%s"."%s") AS BIGINT), ' \
+        '0), %d)' % (table, name, 2 ** 32 - 1)
+
+
+def overflow_check(table, name, bits, condition=None):
+    """Returns the `sql_query_pre` statement which fails the indexing of a
+    source once a value of the column outgrew its bitfield or became
+    negative, as sphinx would store it modulo `2 ** bits`. The error names
+    the column, eg. `invalid input syntax for integer:
+    "party_party.sequence = 5000 does not fit in 12 bits, regenerate the
+    config"`.
+
+    :param condition: A condition restricting the rows checked (eg. those
+                      of a delta or of a shard)
+    """
+    return 'SELECT CAST(\'%s.%s = \' || "%s"."%s" || \' does not fit in ' \
+        '%d bits, regenerate the config\' AS INTEGER) FROM "%s" ' \
+        'WHERE ("%s"."%s" >= %d OR "%s"."%s" < 0)%s LIMIT 1' % (table, name,
+            table, name, bits, table, table, name, 2 ** bits, table, name,
+            ' AND %s' % condition if condition else '')
+
+
+def compact_attribute(model_object, name, field, value_range,
+        headroom=HEADROOM):
+    """Returns the compact :class:`Attribute` of the field or None to keep
+    the default mapping.
+
+    :param value_range: A tuple `(min, max)` of the values of the column
+                        (`(None, None)` if unknown)
+    """
+    table = model_object._table
+    if isinstance(field, (Integer, BigInteger, Many2One)):
+        low, high = value_range
+        if low is None or low < 0:
+            return None
+        bits = bit_width(high, headroom)
+        if bits is None and high * headroom >= 2 ** 32:
+            return Attribute('sql_attr_bigint')
+        if isinstance(field, Many2One):
+            return Attribute('sql_attr_uint')
+        return Attribute('sql_attr_uint', bits or 32)
+
+    if isinstance(field, Boolean):
+        return Attribute('sql_attr_bool')
+
+    if isinstance(field, (Date, DateTime)):
+        return Attribute('sql_attr_timestamp', expression=epoch(table, name))
+
+    if isinstance(field, Selection):
+        selection = field.selection
+        if not isinstance(selection, (list, tuple)) or not selection \
+                or not all(isinstance(key, basestring)
+                    for key, _ in selection):
+            # Selections computed by a method can change at any time
+            return None
+        lookup = [(key, ordinal) for ordinal, (key, _) in
+            enumerate(selection, 1)]
+        cases = ' '.join("WHEN '%s' THEN %d" % (key.replace("'", "''"),
+            ordinal) for key, ordinal in lookup)
+        return Attribute('sql_attr_uint', bit_width(len(lookup), headroom),
+            'CASE "%s"."%s" %s ELSE 0 END' % (table, name, cases), lookup)
+    return None
+
+
+def range_columns(model_object):
+    """Returns the sorted names of the `select=1` fields of the model whose
+    range decides their width
+    """
+    return sorted(name for name, field in model_object._columns.iteritems()
+        if field.select == 1
+            and isinstance(field, (Integer, BigInteger, Many2One)))
+
+
+def column_ranges(cursor, model_object):
+    """Returns a :class:`dict` of the names of the range columns of the
+    model and a tuple `(min, max)` of their values, read in a single scan
+    """
+    names = range_columns(model_object)
+    if not names:
+        return {}
+    cursor.execute('SELECT %s FROM "%s"' % (', '.join(
+        'MIN("%s"), MAX("%s")' % (name, name) for name in names),
+        model_object._table))
+    row = cursor.fetchone()
+    return dict((name, (row[2 * i], row[2 * i + 1]))
+        for i, name in enumerate(names))
+
+
+def compact_attributes(model_object, ranges, headroom=HEADROOM):
+    """Returns a :class:`dict` of the names of the `select=1` fields of the
+    model and their :class:`Attribute`, to be given to
+    :meth:`tryton_sphinx.DataSource.from_model`. Date fields are added to
+    the default attributes.
+
+    :param ranges: The ranges of the columns as returned by
+                   :func:`column_ranges`
+    """
+    attributes = dict((name, Attribute(attr_type)) for name, attr_type in
+        get_attributes(model_object).iteritems())
+    for name, field in model_object._columns.iteritems():
+        if field.select != 1:
+            continue
+        attribute = compact_attribute(model_object, name, field,
+            ranges.get(name, (None, None)), headroom)
+        if attribute is not None:
+            attributes[name] = attribute
+    return attributes
+
+
+def attribute_memory(attributes, bits, stats):
+    """Returns the estimated bytes of RAM searchd needs for the attributes
+    of an index: a row of 32 bit words per document (the bitfields sharing
+    words) and the values of its string attributes.
+
+    :param attributes: A :class:`dict` of names and attribute types
+    :param bits: A :class:`dict` of the names of the bitfields and their
+                 width
+    :param stats: The :class:`tryton_sphinx.stats.TableStats` of the table
+    """
+    words, bitfields, strings = 0, 0, 0
+    for name, attr_type in attributes.iteritems():
+        if attr_type == 'sql_attr_bool':
+            bitfields += 1
+        elif attr_type == 'sql_attr_uint' and bits.get(name):
+            bitfields += bits[name]
+        elif attr_type == 'sql_attr_bigint':
+            words += 2
+        elif attr_type in ('sql_field_string', 'sql_attr_string'):
+            # The offset of the string, and the string itself
+            words += 1
+            strings += stats.widths.get(name, 8)
+        else:
+            words += 1
+    words += -(-bitfields // 32)
+    return stats.rows * (DOCID_BYTES + 4 * words + strings)
+
+
+class MemoryEstimate(object):
+    """The estimated memory of the attributes of an index with the default
+    and with the compact mapping.
+    """
+
+    def __init__(self, name, rows, before, after):
+        self.name = name
+        self.rows = rows
+        self.before = before
+        self.after = after
+
+
+def estimate(source, default_attributes, stats):
+    """Returns the :class:`MemoryEstimate` of the compact data source
+    compared with the default attributes
+    """
+    return MemoryEstimate(source.index_name, stats.rows,
+        attribute_memory(default_attributes, {}, stats),
+        attribute_memory(source.attributes, source.bits, stats))
+
+
+def report(estimates):
+    """Returns the memory estimates as a text report
+    """
+    lines = ['%-40s %12s %10s %10s %7s' % ('index', 'documents', 'before',
+        'after', 'saved')]
+    total_before = total_after = 0
+    for item in sorted(estimates, key=lambda item: item.name):
+        total_before += item.before
+        total_after += item.after
+        lines.append('%-40s %12d %10s %10s %6d%%' % (item.name, item.rows,
+            format_size(item.before), format_size(item.after),
+            100 - 100 * item.after // item.before if item.before else 0))
+    lines.append('%-40s %12s %10s %10s' % ('total', '',
+        format_size(total_before), format_size(total_after)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+    builder
+
+    Builds the config blocks of one or several tryton databases. Every
+    database is introspected in its own process so that the pools of several
+    databases can be initialised in parallel.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import math
+import multiprocessing
+
+from configuration import BaseSource, DataSource, DistributedIndex
+from realtime import RealtimeIndex
+from xmlpipe import XmlpipeSource
+from profiles import profile_options, model_profile, autocomplete_source
+from stats import table_stats, column_stats
+from planner import plan_source
+from catalog import init_catalog, compare_builds
+from attributes import (HEADROOM, column_ranges, compact_attributes,
+    estimate)
+from storage import measure_index
+from metrics import Metrics
+from hydrate import stored_fields
+from utils import iter_sql_models, get_attributes, get_unsupported_fields
+
+
+class DatabaseBuild(object):
+    """The result of the build of a database.
+
+    `database_name`: The name of the database
+    `base_source`: The :class:`BaseSource` of the database
+    `sources`: The list of :class:`DataSource`, :class:`RealtimeIndex` or
+               :class:`DistributedIndex` to write, in the order they have to
+               appear in the config
+    `tables`: The tables which have a delta or real-time index (see the
+              `schema_sql` functions)
+    `plans`: The :class:`tryton_sphinx.planner.SourcePlan` of the data
+             sources, if they were planned
+    `estimates`: The :class:`tryton_sphinx.attributes.MemoryEstimate` of
+                 the data sources, if their attributes are compact
+    `sizes`: The :class:`tryton_sphinx.storage.IndexSize` of the indexes of
+             the data sources, if they were measured
+    `metrics`: The :class:`tryton_sphinx.metrics.Metrics` of the build
+    """
+
+    def __init__(self, database_name, base_source, sources, tables,
+            plans=None, estimates=None, sizes=None, metrics=None):
+        self.database_name = database_name
+        self.base_source = base_source
+        self.sources = sources
+        self.tables = tables
+        self.plans = plans or []
+        self.estimates = estimates or []
+        self.sizes = sizes or []
+        self.metrics = metrics or Metrics()
+
+    def write_to(self, file):
+        """Streams the config blocks of the database into the given file
+        """
+        self.base_source.write_to(file)
+        for source in self.sources:
+            source.write_to(file)
+
+    @property
+    def dist_threads(self):
+        """The number of threads searchd needs to search the largest
+        distributed index in parallel (0 if there is none)
+        """
+        return max([len(source.locals) for source in self.sources
+            if isinstance(source, DistributedIndex)] or [0])
+
+
+def init_pool(database_name):
+    """Returns the initialised `trytond.pool.Pool` of the database. The
+    classes must have been registered (`trytond.modules.register_classes`).
+    """
+    from trytond.pool import Pool
+    pool = Pool(database_name)
+    pool.init()
+    return pool
+
+
+def list_databases():
+    """Returns the names of all the tryton databases on the server
+    """
+    from trytond.backend import Database
+    database = Database().connect()
+    cursor = database.cursor()
+    try:
+        return list(Database.list(cursor))
+    finally:
+        cursor.close()
+
+
+def shard_count(stats, threshold, max_shards):
+    """Returns the number of shards a table should be split in: one shard
+    per `threshold` rows, but no more than `max_shards`.
+
+    :param stats: The :class:`tryton_sphinx.stats.TableStats` of the table
+    """
+    if not threshold or stats.min_id is None or stats.rows <= threshold:
+        return 1
+    return max(1, min(max_shards,
+        int(math.ceil(float(stats.rows) / threshold))))
+
+
+def analyse_sources(database_name, sources, shard_threshold=None,
+        max_shards=None, plan=False, storage=False):
+    """Reads the statistics of the tables of the data sources and returns a
+    tuple `(sources, plans, sizes)`.
+
+    With `plan` the ranged query step of every data source is chosen from
+    the statistics (see :mod:`tryton_sphinx.planner`). With
+    `shard_threshold` the data sources of the tables larger than
+    `shard_threshold` rows are replaced by their shards and a distributed
+    index over them. With `storage` the memory the index of every data
+    source needs is measured (see :mod:`tryton_sphinx.storage`).
+    """
+    from trytond.transaction import Transaction
+
+    result, plans, sizes, cache = [], [], [], {}
+    with Transaction().start(database_name, 0):
+        cursor = Transaction().cursor
+        for source in sources:
+            if not isinstance(source, DataSource) or source.table is None:
+                result.append(source)
+                continue
+            if source.table not in cache:
+                stats = table_stats(cursor, source.table)
+                if plan or storage:
+                    column_stats(cursor, stats)
+                cache[source.table] = stats
+            stats = cache[source.table]
+
+            if plan:
+                plans.append(plan_source(source, stats))
+
+            count = shard_count(stats, shard_threshold, max_shards)
+            shards = [source]
+            if count > 1:
+                # Fewer shards if the table has fewer ids
+                shards = source.shard(count, stats.min_id, stats.max_id)
+            if len(shards) == 1:
+                result.append(source)
+                if storage:
+                    sizes.append(measure_index(source, stats))
+                continue
+            result.extend(shards)
+            result.append(DistributedIndex(source.index_name,
+                [shard.index_name for shard in shards]))
+            if storage:
+                sizes.extend(measure_index(shard, stats, 1.0 / len(shards))
+                    for shard in shards)
+    return result, plans, sizes
+
+
+def compact_models(database_name, models, headroom=HEADROOM):
+    """Reads the ranges of the columns and the statistics of the tables of
+    the models and returns a :class:`dict` of their tables and a tuple
+    `(attribute_map, stats)`: their compact attributes (see
+    :mod:`tryton_sphinx.attributes`) and their
+    :class:`tryton_sphinx.stats.TableStats`.
+    """
+    from trytond.transaction import Transaction
+
+    result = {}
+    with Transaction().start(database_name, 0):
+        cursor = Transaction().cursor
+        for model_object in models:
+            stats = column_stats(cursor, table_stats(cursor,
+                model_object._table))
+            result[model_object._table] = (compact_attributes(model_object,
+                column_ranges(cursor, model_object), headroom), stats)
+    return result
+
+
+def build(database_name, delta=False, realtime=False, prefix='',
+        shard_threshold=None, max_shards=None, plan=False,
+        join_rec_names=False, fast=False, xmlpipe=False, batch_size=1000,
+        profiles=None, autocomplete=None, compact=False, headroom=HEADROOM,
+        storage=False, stored=None):
+    """Introspects the pool of the database and returns a
+    :class:`DatabaseBuild`. The sources are sorted by name so that the
+    output does not depend on the order of the pool.
+
+    :param database_name: The name of the database
+    :param delta: Build a main and a delta data source per model
+    :param realtime: Build a real-time index per model
+    :param prefix: A prefix for the names of all the sources and indexes
+    :param shard_threshold: Split the models with more rows than this in
+                            several id range shards searched through a
+                            distributed index. Not supported together with
+                            `delta` or `realtime`.
+    :param max_shards: The maximum number of shards of a model (Default:
+                       the number of CPUs)
+    :param plan: Choose the ranged query step of the data sources from the
+                 statistics of their tables
+    :param join_rec_names: Join the `_rec_name` of the targets of the
+                           Many2One fields as full text fields
+    :param fast: Read the models from the `ir_model` tables and the
+                 PostgreSQL catalog instead of initialising the pool (see
+                 :mod:`tryton_sphinx.catalog`)
+    :param xmlpipe: Index the models which have `select=1` Function fields
+                    from an xmlpipe2 source reading them through the model
+                    (see :mod:`tryton_sphinx.xmlpipe`)
+    :param batch_size: The number of records the xmlpipe2 sources read at
+                       once
+    :param profiles: A :class:`dict` of model names and the name of the
+                     profile of their index, overriding their
+                     `_sphinx_profile` (see :mod:`tryton_sphinx.profiles`)
+    :param autocomplete: The name of the profile of the autocomplete indexes
+                         of the models with short text fields (Default: no
+                         autocomplete index)
+    :param compact: Map the fields to the narrowest attribute types the
+                    values of their columns allow and estimate the memory
+                    saved (see :mod:`tryton_sphinx.attributes`)
+    :param headroom: The factor of growth of the values the compact
+                     bitfields leave room for
+    :param storage: Measure the memory the indexes of the data sources need
+                    to plan their storage (see :mod:`tryton_sphinx.storage`)
+    :param stored: A :class:`dict` of model names and the names of the
+                   fields to store in their index for the list views,
+                   overriding their `_sphinx_stored` (see
+                   :mod:`tryton_sphinx.hydrate`)
+    """
+    if shard_threshold and (delta or realtime):
+        raise ValueError("Sharding is not supported with delta or "
+            "real-time indexes")
+    if xmlpipe and (delta or realtime or fast):
+        raise ValueError("xmlpipe2 sources are not supported with delta or "
+            "real-time indexes or the catalog")
+    if compact and realtime:
+        raise ValueError("Compact attributes are not supported with "
+            "real-time indexes")
+
+    metrics = Metrics()
+    labels = {'database': database_name}
+    with metrics.timer('buildconf_seconds', stage='pool', **labels):
+        if fast:
+            pool = init_catalog(database_name)
+        else:
+            pool = init_pool(database_name)
+    base_source = BaseSource.from_tryton_config(database_name, prefix)
+
+    models = sorted(iter_sql_models(pool), key=lambda model: model._table)
+    compacts = {}
+    if compact:
+        with metrics.timer('buildconf_seconds', stage='compact', **labels):
+            compacts = compact_models(database_name, models, headroom)
+    sources, tables, estimates = [], [], []
+    with metrics.timer('buildconf_seconds', stage='sources', **labels):
+        for model_object in models:
+            metrics.add('buildconf_skipped_fields',
+                len(get_unsupported_fields(model_object)), **labels)
+            if realtime:
+                index = RealtimeIndex.from_model(model_object, prefix)
+                if index.attributes:
+                    sources.append(index)
+                    tables.append(index.table)
+                    metrics.add('buildconf_models', status='realtime',
+                        **labels)
+                else:
+                    metrics.add('buildconf_models',
+                        status='no_select_fields', **labels)
+                continue
+
+            if xmlpipe:
+                source = XmlpipeSource.from_model(model_object,
+                    database_name, prefix, batch_size)
+                if source.attributes != get_attributes(model_object):
+                    # Only the models with computed fields are worth the
+                    # slower xmlpipe2 source
+                    sources.append(source)
+                    metrics.add('buildconf_models', status='xmlpipe',
+                        **labels)
+                    continue
+
+            attribute_map, stats = compacts.get(model_object._table,
+                (None, None))
+            fields = stored_fields(model_object, stored)
+            if delta:
+                ds, delta_ds = DataSource.from_model_with_delta(
+                    model_object, base_source, prefix, join_rec_names,
+                    attribute_map, fields)
+            else:
+                ds, delta_ds = DataSource.from_model(
+                    model_object, base_source, prefix, join_rec_names,
+                    attribute_map, fields), None
+            if not ds.sql_query:
+                # If there are no attributes which have select=1 then there
+                # will be no sql query, so just ignore those data sources
+                metrics.add('buildconf_models', status='no_select_fields',
+                    **labels)
+                continue
+            metrics.add('buildconf_models', status='indexed', **labels)
+            if stats is not None:
+                estimates.append(estimate(ds, get_attributes(model_object),
+                    stats))
+            ds.index_options = profile_options(
+                model_profile(model_object, profiles))
+            sources.append(ds)
+            if delta_ds is not None:
+                delta_ds.index_options = ds.index_options
+                sources.append(delta_ds)
+                tables.append(model_object._table)
+            if autocomplete:
+                ac_ds = autocomplete_source(model_object, base_source,
+                    prefix, autocomplete)
+                if ac_ds is not None:
+                    sources.append(ac_ds)
+
+    plans, sizes = [], []
+    if shard_threshold or plan or storage:
+        with metrics.timer('buildconf_seconds', stage='analyse', **labels):
+            sources, plans, sizes = analyse_sources(database_name, sources,
+                shard_threshold, max_shards or multiprocessing.cpu_count(),
+                plan, storage)
+
+    for source in sources:
+        metrics.add('buildconf_sources', type=source.__class__.__name__,
+            **labels)
+
+    return DatabaseBuild(database_name, base_source, sources, tables, plans,
+        estimates, sizes, metrics)
+
+
+def verify_fast(database_name, **options):
+    """Builds the database from the pool and from the catalog and returns
+    the list of their differences (see
+    :func:`tryton_sphinx.catalog.compare_builds`)
+
+    :param options: The keyword arguments of :func:`build`
+    """
+    options.pop('fast', None)
+    return compare_builds(build(database_name, **options),
+        build(database_name, fast=True, **options))
+
+
+def _build_tenant(arguments):
+    database_name, options = arguments
+    return build(database_name, prefix=database_name + '_', **options)
+
+
+def build_many(database_names, processes=None, **options):
+    """Builds several databases in a pool of worker processes and returns a
+    list of :class:`DatabaseBuild`, sorted by database name whichever worker
+    finishes first. The names of the sources and indexes are prefixed with
+    the name of their database.
+
+    Every worker process handles a single database so that the memory of
+    its pool is released as soon as it is done.
+
+    :param database_names: The names of the databases
+    :param processes: The number of worker processes (Default: the number of
+                      CPUs)
+    :param options: The keyword arguments of :func:`build`
+    """
+    workers = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        return workers.map(_build_tenant,
+            [(name, options) for name in sorted(set(database_names))],
+            chunksize=1)
+    finally:
+        workers.close()
+        workers.join()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+    cache
+
+    A cache of search results for :class:`tryton_sphinx.client.Client`.
+
+    The results of an index only change when `indexer --rotate` swaps its
+    files, so the entries of an index are dropped as soon as the header
+    file `{{data_path}}/sphinx/<index>.sph` is replaced. Entries also
+    expire after a time to live, and the least recently used entries are
+    evicted beyond `max_entries`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+def index_generation(path):
+    """Returns the generation of the files of an index: the modification
+    time, inode and size of its header, which change whenever the index is
+    rotated. Returns None if the index has no files (eg. a real-time index
+    which was never flushed).
+
+    :param path: The `path` of the index in the sphinx config
+    """
+    try:
+        stat = os.stat(path + '.sph')
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_ino, stat.st_size)
+
+
+class ResultCache(object):
+    """A thread safe LRU cache of search results with a time to live,
+    invalidated by the rotation of the indexes.
+
+    The possible arguments are:
+
+    `data_path`: The directory under which the `sphinx` directory of the
+                 indexes is (Default: `data_path` of the tryton config)
+    `max_entries`: The maximum number of cached results (Default: 1024)
+    `ttl`: Seconds after which a result expires (Default: 60). Results of
+           real-time indexes change without rotation, so this bounds how
+           stale they can be.
+    `check_interval`: Seconds during which the generation of an index is
+                      not checked again (Default: 1)
+    """
+
+    def __init__(self, data_path=None, max_entries=1024, ttl=60,
+            check_interval=1.0):
+        if data_path is None:
+            from trytond.config import CONFIG
+            data_path = CONFIG['data_path']
+        self.directory = os.path.join(data_path, 'sphinx')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _generation(self, index, now):
+        generation, checked = self._generations.get(index, (None, None))
+        if checked is None or now - checked >= self.check_interval:
+            generation = index_generation(os.path.join(self.directory, index))
+            self._generations[index] = (generation, now)
+        return (generation, self._counters.get(index, 0))
+
+    def generations(self, indexes):
+        """Returns the current generations of the indexes, to be given to
+        :meth:`put` along with the results searched from them
+        """
+        now = time.time()
+        with self._lock:
+            return dict((index, self._generation(index, now))
+                for index in indexes)
+
+    def get(self, key):
+        """Returns the cached result of the key or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, created, generations = entry
+            if now - created > self.ttl:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            for index, generation in generations.iteritems():
+                if self._generation(index, now) != generation:
+                    self.invalidations += 1
+                    self.misses += 1
+                    return None
+            self._entries[key] = entry
+            self.hits += 1
+            return result
+
+    def put(self, key, generations, result):
+        """Caches the result of the key.
+
+        :param generations: The generations of the indexes searched, as
+                            returned by :meth:`generations` before the search
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (result, time.time(), generations)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, index=None):
+        """Drops the results of an index (or of all the indexes), eg. after
+        a rotation the file generation can not see
+        """
+        with self._lock:
+            if index is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._generations.clear()
+                return
+            self._counters[index] = self._counters.get(index, 0) + 1
+            self._generations.pop(index, None)
+
+    def stats(self):
+        """Returns a :class:`dict` of the counters of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                }
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+    catalog
+
+    Introspects the models of a tryton database from its `ir_model` and
+    `ir_model_field` tables and the PostgreSQL catalog, over a single
+    connection, instead of importing and initialising every installed
+    module with `Pool(database_name).init()`.
+
+    The catalog knows less than the pool:
+
+    * the `select` flag of a field is not stored, but `select` fields are
+      the only ones with a `<table>_<column>_index` index, so the indexed
+      columns are taken as `select=1` (`select=2` fields too)
+    * One2Many and Many2Many fields have no column, so they are not known
+      to be `select` fields and get no multi-valued attribute
+    * the tables are named after the models and the `_rec_name` of every
+      model is `name`, as they are by default
+
+    :func:`compare_builds` lists where the two introspections differ for a
+    database.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+
+from trytond.model import fields
+
+#: The fields which can be built from their `ttype` in `ir_model_field`
+FIELD_TYPES = {
+    'char': fields.Char,
+    'text': fields.Text,
+    'integer': fields.Integer,
+    'biginteger': fields.BigInteger,
+    'boolean': fields.Boolean,
+    'datetime': fields.DateTime,
+    'float': fields.Float,
+    'numeric': fields.Numeric,
+    }
+
+_INDEX_COLUMN = re.compile(r'\(\s*"?(\w+)"?\s*\)\s*$')
+
+
+class CatalogModel(object):
+    """A model read from the catalog, with the attributes of a `ModelSQL`
+    instance needed to build its data source
+    """
+    _rec_name = 'name'
+
+    def __init__(self, pool, name, table, columns):
+        self.pool = pool
+        self._name = name
+        self._table = table
+        self._columns = columns
+
+
+class CatalogPool(object):
+    """The models read from the catalog, with the interface of
+    `trytond.pool.Pool` needed to build the data sources
+    """
+
+    def __init__(self):
+        self.models = {}
+
+    def get(self, name, type='model'):
+        return self.models[name]
+
+    def object_name_list(self, type='model'):
+        return sorted(self.models)
+
+
+def make_field(name, ttype, relation, select):
+    """Returns a field of the given `ttype` or None if the data source
+    would not use it
+    """
+    if ttype == 'selection':
+        field = fields.Selection([], name)
+    elif ttype == 'many2one' and relation:
+        field = fields.Many2One(relation, name)
+    elif ttype in FIELD_TYPES:
+        field = FIELD_TYPES[ttype](name)
+    else:
+        return None
+    field.select = 1 if select else 0
+    return field
+
+
+def read_catalog(cursor):
+    """Returns a :class:`CatalogPool` of the models stored in a table
+
+    :param cursor: A cursor on the tryton database
+    """
+    cursor.execute("SELECT table_name, column_name "
+        "FROM information_schema.columns "
+        "WHERE table_schema = current_schema()")
+    columns = {}
+    for table, column in cursor.fetchall():
+        columns.setdefault(table, set()).add(column)
+
+    cursor.execute("SELECT tablename, indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema()")
+    selected = set()
+    for table, index, definition in cursor.fetchall():
+        match = _INDEX_COLUMN.search(definition)
+        if match and index == '%s_%s_index' % (table, match.group(1)):
+            selected.add((table, match.group(1)))
+
+    cursor.execute('SELECT m.model, f.name, f.ttype, f.relation '
+        'FROM ir_model_field f JOIN ir_model m ON (f.model = m.id) '
+        'ORDER BY m.model, f.name')
+    pool = CatalogPool()
+    for model, name, ttype, relation in cursor.fetchall():
+        table = model.replace('.', '_')
+        if name not in columns.get(table, ()):
+            # Not stored: a Function, One2Many or Many2Many field, or a
+            # model without table
+            continue
+        if model not in pool.models:
+            pool.models[model] = CatalogModel(pool, model, table, {})
+        field = make_field(name, ttype, relation,
+            (table, name) in selected)
+        if field is not None:
+            pool.models[model]._columns[name] = field
+    return pool
+
+
+def init_catalog(database_name):
+    """Returns the :class:`CatalogPool` of the database
+    """
+    from trytond.backend import Database
+    database = Database(database_name).connect()
+    cursor = database.cursor()
+    try:
+        return read_catalog(cursor)
+    finally:
+        cursor.close()
+
+
+def _describe(source):
+    if hasattr(source, 'locals'):
+        return {'local': source.locals}
+    return dict((name, getattr(source, name, None)) for name in (
+        'sql_query', 'sql_query_range', 'attributes', 'multi_attributes',
+        'sql_query_pre', 'sql_query_killlist'))
+
+
+def compare_builds(full, fast):
+    """Returns the list of the differences between the
+    :class:`tryton_sphinx.builder.DatabaseBuild` of the pool and the one of
+    the catalog, as sentences (empty if they are the same)
+    """
+    full_sources = dict((source.name, source) for source in full.sources)
+    fast_sources = dict((source.name, source) for source in fast.sources)
+    differences = []
+    for name in sorted(set(full_sources) | set(fast_sources)):
+        if name not in fast_sources:
+            differences.append('%s: missing from the catalog' % name)
+            continue
+        if name not in full_sources:
+            differences.append('%s: not in the pool' % name)
+            continue
+        expected = _describe(full_sources[name])
+        found = _describe(fast_sources[name])
+        for key in sorted(expected):
+            if expected[key] != found[key]:
+                differences.append('%s: %s is %r in the catalog instead of '
+                    '%r' % (name, key, found[key], expected[key]))
+    return differences
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+    client
+
+    A SphinxQL client for tryton modules: a thread safe pool of connections
+    to the `listen = 9306:mysql41` endpoint of searchd, a registry mapping
+    the generated indexes back to their data sources and tables, and
+    batching of several queries into one multi-query round trip.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import time
+import threading
+from Queue import Queue, Empty, Full
+from contextlib import contextmanager
+
+try:
+    import MySQLdb
+    from MySQLdb.constants import CLIENT
+except ImportError:
+    MySQLdb = None
+
+from configuration import DataSource, DistributedIndex
+from realtime import RealtimeIndex
+from profiles import substring_length
+from delta import delta_name
+
+#: The default maximum number of queries in one multi-query, as set by
+#: `max_batch_queries` in the searchd settings
+MAX_BATCH_QUERIES = 32
+
+_MATCH_SPECIAL = re.compile(r'([\\()|\-!@~"&/^$=<])')
+
+
+def escape_match(text):
+    """Escapes the characters which have a meaning in the sphinx extended
+    query syntax, so that the text is searched as is
+    """
+    return _MATCH_SPECIAL.sub(r'\\\1', text)
+
+
+def mysql_connect(host, port, timeout):
+    """Returns a new SphinxQL connection which accepts multi-queries.
+    Requires `MySQLdb`.
+    """
+    if MySQLdb is None:
+        raise ImportError("MySQLdb is required to talk to searchd over "
+            "SphinxQL")
+    return MySQLdb.connect(host=host, port=port, connect_timeout=timeout,
+        use_unicode=False, client_flag=CLIENT.MULTI_STATEMENTS)
+
+
+class ConnectionPool(object):
+    """A thread safe pool of SphinxQL connections.
+
+    Connections are created lazily up to `size`. A connection idle for
+    more than `idle_check` seconds is pinged before it is handed out, and
+    replaced if searchd went away. A connection which raised an error is
+    closed instead of going back to the pool.
+
+    The possible arguments are:
+
+    `host`, `port`: The SphinxQL endpoint of searchd (Default:
+                    127.0.0.1:9306)
+    `size`: The maximum number of connections (Default: 8)
+    `timeout`: Seconds to wait for a connection, from searchd or from the
+               pool when all the connections are in use (Default: 5)
+    `idle_check`: Seconds of idleness after which a connection is checked
+                  (Default: 30)
+    `connection_factory`: A callable `(host, port, timeout)` returning a new
+                          connection (Default: :func:`mysql_connect`)
+    """
+
+    def __init__(self, host='127.0.0.1', port=9306, size=8, timeout=5,
+            idle_check=30, connection_factory=None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.connection_factory = connection_factory or mysql_connect
+        self._idle = Queue(size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.connection_factory(self.host, self.port, self.timeout)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _healthy(self, connection):
+        try:
+            connection.ping()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self):
+        """Returns a healthy connection from the pool
+        """
+        try:
+            connection, last_used = self._idle.get_nowait()
+        except Empty:
+            connection = self._new_connection()
+            if connection is not None:
+                return connection
+            try:
+                connection, last_used = self._idle.get(timeout=self.timeout)
+            except Empty:
+                raise RuntimeError("No SphinxQL connection available after "
+                    "%s seconds" % self.timeout)
+        if time.time() - last_used > self.idle_check \
+                and not self._healthy(connection):
+            self._discard(connection)
+            return self.acquire()
+        return connection
+
+    def release(self, connection, broken=False):
+        """Gives the connection back to the pool, or closes it if it is
+        broken
+        """
+        if broken:
+            self._discard(connection)
+            return
+        try:
+            self._idle.put_nowait((connection, time.time()))
+        except Full:
+            self._discard(connection)
+
+    @contextmanager
+    def connection(self):
+        """A context manager which acquires a connection and releases it,
+        discarding it if an error was raised
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, broken=True)
+            raise
+        self.release(connection)
+
+    def close(self):
+        """Closes the idle connections
+        """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except Empty:
+                return
+            self._discard(connection)
+
+
+class IndexRegistry(object):
+    """Maps the generated indexes back to their data sources and tables.
+
+    A table can be searched through several indexes (a main and a delta
+    index), and the shards of a table are searched through their
+    distributed index. The autocomplete index of a table is kept apart.
+    """
+
+    def __init__(self):
+        self.source_names = {}
+        self.tables = {}
+        self.locals = {}
+        self.stored = {}
+        self.options = {}
+        self.lookups = {}
+        self.deltas = {}
+        self.autocomplete_indexes = {}
+        self._indexes = {}
+
+    @classmethod
+    def from_sources(cls, sources):
+        """Creates a registry from :class:`DataSource`,
+        :class:`RealtimeIndex` and :class:`DistributedIndex` instances (eg.
+        the `sources` of a :class:`tryton_sphinx.builder.DatabaseBuild`)
+        """
+        self = cls()
+        for source in sources:
+            self.add(source)
+        return self
+
+    def add(self, source):
+        """Registers the index of a data source, real-time index or
+        distributed index. The shards must be added before their
+        distributed index.
+        """
+        if isinstance(source, DataSource):
+            name, table = source.index_name, source.table
+            self.source_names[name] = source.name
+            self.stored[name] = source.stored
+            self.options[name] = list(source.index_options or [])
+            self.lookups[name] = source.lookups
+            parent = source.name.split(':')[1].strip() \
+                if ':' in source.name else None
+            if parent and name == delta_name(parent):
+                self.deltas[parent] = name
+        elif isinstance(source, RealtimeIndex):
+            name, table = source.name, source.table
+            self.source_names[name] = None
+        elif isinstance(source, DistributedIndex):
+            name = source.name
+            table = source.table
+            if table is None and source.locals:
+                table = self.tables.get(source.locals[0])
+            for local in source.locals:
+                if local in self._indexes.get(table, []):
+                    self._indexes[table].remove(local)
+            self.source_names[name] = None
+            self.locals[name] = list(source.locals)
+            if source.locals:
+                self.stored[name] = self.stored.get(source.locals[0], {})
+        else:
+            raise TypeError("Unknown index type %s" % type(source))
+        self.tables[name] = table
+        if getattr(source, 'autocomplete', False):
+            self.autocomplete_indexes[table] = name
+            return
+        self._indexes.setdefault(table, []).append(name)
+
+    def table(self, index_name):
+        """Returns the table the index was built from
+        """
+        return self.tables[index_name]
+
+    def source_name(self, index_name):
+        """Returns the name of the data source of the index (None for real
+        time and distributed indexes)
+        """
+        return self.source_names[index_name]
+
+    def indexes(self, table):
+        """Returns the names of the indexes to search for the table
+        """
+        return list(self._indexes.get(table, []))
+
+    def stored_columns(self, table):
+        """Returns a :class:`dict` of the names of the fields stored in all
+        the indexes searched for the table and their
+        :class:`tryton_sphinx.hydrate.StoredColumn`
+        """
+        names = self.indexes(table)
+        if not names:
+            return {}
+        columns = dict(self.stored.get(names[0], {}))
+        for name in names[1:]:
+            stored = self.stored.get(name, {})
+            for field in columns.keys():
+                if field not in stored:
+                    del columns[field]
+        return columns
+
+    def ordinal_fields(self, table):
+        """Returns the names of the selection fields compacted to ordinals
+        in any index searched for the table (see
+        :mod:`tryton_sphinx.attributes`), which are not full text fields
+        """
+        names = sum([self.local_indexes(name)
+            for name in self.indexes(table)], [])
+        return set(field for name in names
+            for field in self.lookups.get(name, {}))
+
+    def substring_indexes(self, table):
+        """Returns a tuple `(min_infix_len, main_indexes)` if the indexes
+        searched for the table find every record whose text contains a
+        word of at least `min_infix_len` characters: they are all main
+        indexes kept fresh by a delta index, or delta indexes, and their
+        star searches on infixes are exhaustive (see
+        :func:`tryton_sphinx.profiles.substring_length`). Returns None
+        otherwise.
+        """
+        names = sum([self.local_indexes(name)
+            for name in self.indexes(table)], [])
+        deltas = set(self.deltas.itervalues())
+        mains, lengths = [], []
+        for name in names:
+            length = substring_length(self.options.get(name))
+            if length is None:
+                return None
+            lengths.append(length)
+            if self.deltas.get(name) in names:
+                mains.append(name)
+            elif name not in deltas:
+                return None
+        if not mains:
+            return None
+        return max(lengths), mains
+
+    def autocomplete_index(self, table):
+        """Returns the name of the autocomplete index of the table (or None)
+        """
+        return self.autocomplete_indexes.get(table)
+
+    def local_indexes(self, index_name):
+        """Returns the names of the indexes which have files for the index:
+        the local indexes of a distributed index, the index itself otherwise
+        """
+        return list(self.locals.get(index_name, [index_name]))
+
+
+class Client(object):
+    """Runs SphinxQL queries through a :class:`ConnectionPool`.
+
+    The possible arguments are:
+
+    `pool`: A :class:`ConnectionPool`
+    `registry`: An optional :class:`IndexRegistry` to search tables by name
+    `max_batch_queries`: The maximum number of queries sent in one round
+                         trip (Default: 32, like searchd)
+    `cache`: An optional :class:`tryton_sphinx.cache.ResultCache` for the
+             results of the searches
+    """
+
+    def __init__(self, pool, registry=None,
+            max_batch_queries=MAX_BATCH_QUERIES, cache=None):
+        self.pool = pool
+        self.registry = registry
+        self.max_batch_queries = max_batch_queries
+        self.cache = cache
+
+    @staticmethod
+    def _rows(cursor):
+        if cursor.description is None:
+            return []
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _interpolate(connection, query, args):
+        if not args:
+            return query
+        return query % tuple(connection.literal(arg) for arg in args)
+
+    def _run(self, queries):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('; '.join(
+                    self._interpolate(connection, query, args)
+                    for query, args in queries))
+                results = [self._rows(cursor)]
+                while len(results) < len(queries):
+                    cursor.nextset()
+                    results.append(self._rows(cursor))
+            finally:
+                cursor.close()
+        return results
+
+    def execute_many(self, queries):
+        """Runs several `(query, args)` tuples and returns the list of their
+        results, each a list of rows as dictionaries. The queries are sent
+        `max_batch_queries` at a time, in one round trip per batch.
+
+        A batch failing because searchd went away is retried once on a new
+        connection.
+        """
+        results = []
+        for start in xrange(0, len(queries), self.max_batch_queries):
+            batch = queries[start:start + self.max_batch_queries]
+            try:
+                results.extend(self._run(batch))
+            except Exception as exception:
+                if MySQLdb is None or not isinstance(exception,
+                        MySQLdb.OperationalError):
+                    raise
+                results.extend(self._run(batch))
+        return results
+
+    def execute(self, query, args=None):
+        """Runs a single query and returns its rows as dictionaries
+        """
+        return self.execute_many([(query, args)])[0]
+
+    def index_names(self, index):
+        """Returns the list of the names of the indexes to search for an
+        index name, a list of index names or a table name
+        """
+        if not isinstance(index, basestring):
+            return list(index)
+        tables = self.registry.indexes(index) if self.registry else []
+        return tables or [index]
+
+    def local_indexes(self, index):
+        """Returns the names of the indexes which have files for the
+        indexes searched (see :meth:`index_names`)
+        """
+        names = self.index_names(index)
+        if self.registry is None:
+            return names
+        return sum([self.registry.local_indexes(name) for name in names], [])
+
+    def search_query(self, index, text=None, filters=None, columns=('id',),
+            order=None, offset=0, limit=20, max_matches=None,
+            raw_text=None):
+        """Returns the `(query, args)` of a search.
+
+        :param index: The name of an index, a list of index names, or a
+                      table name if the client has a registry
+        :param text: The full text to match (escaped)
+        :param filters: A :class:`dict` of attribute names and values, a
+                        list or tuple value filters with IN
+        :param columns: The columns to return
+        :param order: An `ORDER BY` clause, eg. `'weight() DESC'`
+        :param raw_text: A query in the extended query syntax (not escaped),
+                         matched instead of `text`
+        """
+        index = self.index_names(index)
+        conditions, args = [], []
+        if raw_text:
+            conditions.append('MATCH(%s)')
+            args.append(raw_text)
+        elif text:
+            conditions.append('MATCH(%s)')
+            args.append(escape_match(text))
+        for name, value in sorted((filters or {}).iteritems()):
+            if isinstance(value, (list, tuple)):
+                conditions.append('%s IN (%s)' % (
+                    name, ', '.join(str(int(v)) for v in value)))
+            else:
+                conditions.append('%s = %%s' % name)
+                args.append(value)
+
+        query = ['SELECT %s FROM %s' % (', '.join(columns), ', '.join(index))]
+        if conditions:
+            query.append('WHERE ' + ' AND '.join(conditions))
+        if order:
+            query.append('ORDER BY ' + order)
+        query.append('LIMIT %d, %d' % (offset, limit))
+        if max_matches:
+            query.append('OPTION max_matches=%d' % max_matches)
+        return ' '.join(query), args
+
+    def search(self, index, text=None, **options):
+        """Searches the index and returns the matching rows. See
+        :meth:`search_query` for the options.
+        """
+        options.update(index=index, text=text)
+        return self.search_many([options])[0]
+
+    def autocomplete(self, table, text, limit=10, **options):
+        """Returns the rows of the autocomplete index of the table whose
+        words start with the words of the text, eg. `ipho` finds `iPhone`.
+        Requires a registry.
+        """
+        index = self.registry and self.registry.autocomplete_index(table)
+        if index is None:
+            raise ValueError("%s has no autocomplete index" % table)
+        words = escape_match(text).split()
+        options.update(index=[index], limit=limit, raw_text=' '.join(
+            word + '*' for word in words))
+        return self.search_many([options])[0]
+
+    def search_many(self, searches):
+        """Runs several searches, each a :class:`dict` of the arguments of
+        :meth:`search_query`, in as few round trips as possible. With a
+        cache only the searches which are not cached are sent.
+        """
+        queries = [self.search_query(**search) for search in searches]
+        if self.cache is None:
+            return self.execute_many(queries)
+
+        results, missing = [], []
+        for search, (query, args) in zip(searches, queries):
+            key = (query, tuple(args))
+            result = self.cache.get(key)
+            if result is None:
+                generations = self.cache.generations(
+                    self.local_indexes(search['index']))
+                missing.append((len(results), key, generations))
+            results.append(result)
+        rows = self.execute_many([queries[position]
+            for position, _, _ in missing])
+        for (position, key, generations), result in zip(missing, rows):
+            self.cache.put(key, generations, result)
+            results[position] = result
+        return results
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    cluster
+
+    Spreads the generated indexes over several searchd nodes. Every local
+    index (with its delta index) or every shard of a large model is
+    assigned to as many nodes as there are replicas, the largest first to
+    the least loaded nodes, and a front node searches them through
+    distributed indexes whose agents list the mirrors of every index.
+
+    The nodes are read from an inventory file::
+
+        [cluster]
+        replicas = 2
+        ha_strategy = nodeads
+        agent_connect_timeout = 1000
+        agent_query_timeout = 3000
+
+        [node search1]
+        host = 10.0.0.1
+        port = 9312
+        weight = 2
+
+        [node search2]
+        host = 10.0.0.2
+
+    Mirrors and `ha_strategy` need searchd 2.1.1 or later.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+from ConfigParser import SafeConfigParser, Error
+
+from configuration import DataSource, DistributedIndex
+from xmlpipe import XmlpipeSource
+
+#: The options of the `[cluster]` section which go in the distributed
+#: indexes of the front node
+AGENT_OPTIONS = ('ha_strategy', 'agent_connect_timeout',
+    'agent_query_timeout')
+
+
+class Node(object):
+    """A searchd node of the cluster.
+
+    `name`: The name of the node, also the suffix of its config file (see
+            :func:`node_filename`)
+    `host`: The host of its searchd
+    `port`: The port of its searchd (SphinxAPI)
+    `weight`: Its share of the indexes, relative to the other nodes
+    """
+
+    def __init__(self, name, host, port=9312, weight=1.0):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.load = 0
+
+    @property
+    def address(self):
+        return '%s:%d' % (self.host, self.port)
+
+
+class Cluster(object):
+    """The nodes of a cluster and how the front node searches them.
+
+    `nodes`: The list of :class:`Node`
+    `replicas`: The number of nodes every index is copied to
+    `options`: A list of `(option, value)` tuples of the distributed indexes
+               of the front node (eg. `ha_strategy`)
+    """
+
+    def __init__(self, nodes, replicas=1, options=None):
+        if not nodes:
+            raise ValueError("The cluster has no node")
+        if not 1 <= replicas <= len(nodes):
+            raise ValueError("Can not copy the indexes to %d of the %d "
+                "nodes" % (replicas, len(nodes)))
+        for node in nodes:
+            if node.weight <= 0:
+                raise ValueError("The weight of the node %s must be "
+                    "positive" % node.name)
+        self.nodes = nodes
+        self.replicas = replicas
+        self.options = options or []
+
+
+def read_inventory(filename):
+    """Returns the :class:`Cluster` described by an inventory file
+    """
+    parser = SafeConfigParser()
+    try:
+        if not parser.read(filename):
+            raise ValueError("Can not read the inventory %s" % filename)
+        return _read_cluster(parser)
+    except Error as exception:
+        raise ValueError("Invalid inventory %s: %s" % (filename,
+            str(exception).strip()))
+
+
+def _read_cluster(parser):
+    nodes = []
+    for section in parser.sections():
+        if not section.startswith('node '):
+            continue
+        name = section[len('node '):].strip()
+        nodes.append(Node(name,
+            parser.get(section, 'host') if parser.has_option(section,
+                'host') else name,
+            parser.getint(section, 'port') if parser.has_option(section,
+                'port') else 9312,
+            parser.getfloat(section, 'weight') if parser.has_option(section,
+                'weight') else 1.0))
+    replicas, options = 1, []
+    if parser.has_section('cluster'):
+        if parser.has_option('cluster', 'replicas'):
+            replicas = parser.getint('cluster', 'replicas')
+        options = [(option, parser.get('cluster', option))
+            for option in AGENT_OPTIONS
+            if parser.has_option('cluster', option)]
+    return Cluster(nodes, replicas, options)
+
+
+def index_groups(sources):
+    """Returns the list of the `(name, sources)` groups of indexes which
+    must be on the same nodes: a main index and its delta index (searched
+    together for the kill-list to apply), or a single index
+    """
+    groups, by_name = [], {}
+    for source in sources:
+        if isinstance(source, DataSource):
+            name = source.index_name
+            parent = source.name.split(':')[1].strip() \
+                if ':' in source.name else None
+            if parent in by_name:
+                by_name[parent].append(source)
+                by_name[name] = by_name[parent]
+                continue
+        elif isinstance(source, XmlpipeSource):
+            name = source.name
+        else:
+            continue
+        by_name[name] = [source]
+        groups.append((name, by_name[name]))
+    return groups
+
+
+def source_index_name(source):
+    if isinstance(source, DataSource):
+        return source.index_name
+    return source.name
+
+
+class ClusterLayout(object):
+    """The configs of a cluster.
+
+    `front`: The :class:`DistributedIndex` of the front node
+    `nodes`: A list of tuples `(node, sources)` of the sources every node
+             indexes
+    """
+
+    def __init__(self, front, nodes):
+        self.front = front
+        self.nodes = nodes
+
+
+def plan_cluster(cluster, sources, sizes=None):
+    """Assigns the groups of indexes of the sources (see
+    :func:`index_groups`) to the nodes of the cluster and returns the
+    :class:`ClusterLayout`. The largest groups are assigned first, each to
+    the `replicas` least loaded nodes relative to their weight, and the
+    shards of a model to different nodes when possible.
+
+    :param sizes: A :class:`dict` of the names of the indexes and their size
+                  (every index counts the same if unknown)
+    """
+    sizes = sizes or {}
+    groups = index_groups(sources)
+    distributed = [source for source in sources
+        if isinstance(source, DistributedIndex)]
+    siblings = {}
+    for index in distributed:
+        for local in index.locals:
+            siblings[local] = index.name
+
+    for node in cluster.nodes:
+        node.load = 0
+    placed, assignment = {}, {}
+    for name, group in sorted(groups, key=lambda item: (-sum(
+            sizes.get(source_index_name(source), 1) for source in item[1]),
+            item[0])):
+        size = sum(sizes.get(source_index_name(source), 1)
+            for source in group)
+        family = siblings.get(name)
+        nodes = sorted(cluster.nodes, key=lambda node: (
+            node.name in placed.get(family, ()) if family else False,
+            node.load / node.weight, node.name))[:cluster.replicas]
+        for node in nodes:
+            node.load += size
+            if family:
+                placed.setdefault(family, set()).add(node.name)
+        assignment[name] = nodes
+
+    def agent(name):
+        group = dict(groups)[name]
+        return '%s:%s' % ('|'.join(node.address
+            for node in assignment[name]), ','.join(
+                source_index_name(source) for source in group))
+
+    front = []
+    for name, group in groups:
+        if name in siblings:
+            continue
+        front.append(DistributedIndex(name, [], [agent(name)],
+            group[0].table, cluster.options,
+            getattr(group[0], 'autocomplete', False)))
+    for index in distributed:
+        front.append(DistributedIndex(index.name, [],
+            [agent(local) for local in index.locals],
+            dict(groups)[index.locals[0]][0].table, cluster.options))
+
+    nodes = []
+    for node in cluster.nodes:
+        nodes.append((node, [source for name, group in groups
+            if node in assignment[name] for source in group]))
+    return ClusterLayout(front, nodes)
+
+
+def node_filename(filename, node):
+    """Returns the name of the config file of a node: `sphinx.conf` becomes
+    `sphinx.<node>.conf`
+    """
+    root, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (root, node.name, ext)
+
+
+def report(layout):
+    """Returns the assignment of the indexes to the nodes as a text report
+    """
+    lines = []
+    for node, sources in layout.nodes:
+        lines.append('%s (%s): %d indexes' % (node.name, node.address,
+            len(sources)))
+        lines.extend('    %s' % source_index_name(source)
+            for source in sources)
+    return '\n'.join(lines) + '\n'
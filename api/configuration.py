@@ -8,10 +8,15 @@
     :license: BSD, see LICENSE for more details.
 """
 from trytond.model import ModelSQL
+from trytond.model.fields import Many2One, One2Many, Function
 from trytond.config import CONFIG
-from jinja2 import Environment
 
-from utils import guess_type
+from utils import get_attributes, get_multi_attributes
+from hydrate import stored_columns
+from attributes import overflow_check
+from catalog import CatalogModel
+import delta
+import renderer
 
 
 class BaseSource(object):
@@ -44,14 +49,17 @@ class BaseSource(object):
 
 
     @classmethod
-    def from_tryton_config(cls, database_name):
+    def from_tryton_config(cls, database_name, prefix=''):
         """Creates a :class:`BaseSource` from the current tryton configuration
         in the environment.
 
         :param database_name: The database name to use in the database source.
                               Equivalent to setting :attr:`sql_db`
+        :param prefix: A prefix for the name of the source, to tell apart the
+                       base sources of several databases in one config
         """
         self = cls()
+        self.name = prefix + cls.name
 
         self.type = {
             'postgresql': 'pgsql',
@@ -67,26 +75,8 @@ class BaseSource(object):
 
         return self
 
-    def as_string(self):
-        """Returns the string representation of the config as it has to appear
-        int he sphinx.conf
-        """
-        template = Environment().from_string("""
-source {{name}}
-{
-    # data source type. mandatory, no default value
-    # known types are mysql, pgsql, mssql, xmlpipe, xmlpipe2, odbc
-    type        = {{type}}
-
-    sql_host    = {{sql_host}}
-    sql_user    = {{sql_user}}
-    sql_pass    = {{sql_pass}}
-    sql_db      = {{sql_db}}
-    sql_port    = {{sql_port}}
-
-    }
-        """)
-        return template.render(
+    def _context(self):
+        return dict(
             name=self.name,
             type=self.type,
             sql_host=self.sql_host,
@@ -96,6 +86,18 @@ source {{name}}
             sql_port=self.sql_port
             )
 
+    def as_string(self):
+        """Returns the string representation of the config as it has to appear
+        int he sphinx.conf
+        """
+        return renderer.render('base_source', **self._context())
+
+    def write_to(self, file):
+        """Streams the config as it has to appear in the sphinx.conf into the
+        given file
+        """
+        renderer.stream(file, 'base_source', **self._context())
+
 
 class DataSource(object):
     """This class represents a `sphinx data source 
@@ -127,56 +129,190 @@ class DataSource(object):
     `sql_query_range` : Range query setup, query that must return min and max 
                         ID values optional, default is empty
     `sql_range_step`: Range query step (Default: 1024)
+    `sql_query_pre`: A list of queries to run before the main fetch query
+    `sql_query_killlist`: Query returning the document ids which must be
+                          suppressed from the indexes preceding this one
+                          (used by delta indexes)
+    `table`: The table of the model the data source was built from
+    `multi_attributes`: A :class:`dict` of multi-valued attribute names as
+                        keys and a tuple of the ranged query fetching the
+                        `(document id, value)` pairs and its range query as
+                        values
+    `index_options`: A list of `(option, value)` tuples of the index block
+                     (see :mod:`tryton_sphinx.profiles`)
+    `bits`: A :class:`dict` of the names of the `sql_attr_uint` attributes
+            stored as bitfields and their width
+    `lookups`: A :class:`dict` of the names of the ordinal attributes and
+               the list of their `(value, ordinal)` tuples
+    `stored`: A :class:`dict` of the names of the fields stored in the index
+              for the list views and their
+              :class:`tryton_sphinx.hydrate.StoredColumn`
+    `autocomplete`: True for the autocomplete index of its table (see
+                    :func:`tryton_sphinx.profiles.autocomplete_source`)
     """
 
 
     def __init__(self, name, sql_query, attributes, 
-            sql_query_range=None, sql_range_step=1024):
+            sql_query_range=None, sql_range_step=1024, sql_query_pre=None,
+            sql_query_killlist=None, table=None, multi_attributes=None,
+            index_options=None, bits=None, lookups=None, stored=None,
+            autocomplete=False):
         self.name = name
         self.sql_query = sql_query
         self.attributes = attributes
         self.sql_query_range = sql_query_range
         self.sql_range_step = sql_range_step
+        self.sql_query_pre = sql_query_pre or []
+        self.sql_query_killlist = sql_query_killlist
+        self.table = table
+        self.multi_attributes = multi_attributes or {}
+        self.index_options = index_options or []
+        self.bits = bits or {}
+        self.lookups = lookups or {}
+        self.stored = stored or {}
+        self.autocomplete = autocomplete
+
+    @property
+    def index_name(self):
+        """Name of the data source without its parent, which is also the
+        name of its index
+        """
+        return self.name.split(':')[0].strip()
+
+    @staticmethod
+    def rec_name_join(model_object, name):
+        """Returns a tuple `(join, column)` of the LEFT JOIN on the target of
+        the Many2One field and the column selecting the `_rec_name` of the
+        target as a full text field, or None if the `_rec_name` of the
+        target is not stored in its table.
+        """
+        table = model_object._table
+        field = model_object._columns[name]
+        target = model_object.pool.get(field.model_name)
+        rec_field = target._columns.get(target._rec_name)
+        if rec_field is None or isinstance(rec_field, Function):
+            return None
+        alias = '%s_%s' % (table, name)
+        return (
+            'LEFT JOIN "%s" AS "%s" ON ("%s"."id" = "%s"."%s")' % (
+                target._table, alias, alias, table, name),
+            '"%s"."%s" AS "%s_rec_name"' % (alias, target._rec_name, name),
+            )
+
+    @staticmethod
+    def multi_attribute_queries(model_object, name, condition = None,
+            sql_query_range = None):
+        """Returns a tuple of the ranged query fetching the `(document id,
+        value)` pairs of the One2Many or Many2Many field and its range query
+
+        :param condition: A condition on the table of the model restricting
+                          the documents whose values are fetched (eg. the
+                          records changed since the last main build)
+        :param sql_query_range: The range query to use instead of the range
+                                of the whole relation table
+        """
+        field = model_object._columns[name]
+        if isinstance(field, One2Many):
+            table = model_object.pool.get(field.model_name)._table
+            document, value = field.field, 'id'
+        else:
+            table = model_object.pool.get(field.relation_name)._table
+            document, value = field.origin, field.target
+        query = 'SELECT "%s"."%s" AS "id", "%s"."%s" AS "%s" FROM "%s" ' \
+            'WHERE "%s"."%s" >= $start AND "%s"."%s" <= $end' % (
+                table, document, table, value, name, table,
+                table, document, table, document)
+        if condition:
+            query += ' AND "%s"."%s" IN (SELECT "id" FROM "%s" WHERE %s)' % (
+                table, document, model_object._table, condition)
+        return (query, sql_query_range or
+            'SELECT MIN("%s"), MAX("%s") FROM "%s"' % (
+                document, document, table))
 
     @classmethod
-    def from_model(cls, model_object, base_source = None):
+    def from_model(cls, model_object, base_source = None, prefix = '',
+            join_rec_names = False, attribute_map = None, stored = None):
         """Creates and returns a new data source from a given model
 
+        Many2One fields become foreign key attributes and One2Many and
+        Many2Many fields become multi-valued attributes, so that sphinx can
+        filter on relations itself.
+
         :param model_object: The instance of a model as obtained from the 
                              `trytond.pool.Pool`
         :param base_source: The base_source to inherit from. Must be an 
                             instance of :class:`BaseSource`
+        :param prefix: A prefix for the name of the data source (eg. the
+                       database name when several databases share a config)
+        :param join_rec_names: Join the `_rec_name` of the targets of the
+                               Many2One fields as full text fields
+        :param attribute_map: A :class:`dict` of field names and their
+                              :class:`tryton_sphinx.attributes.Attribute`
+                              to use instead of the default attribute types
+        :param stored: The names of the fields to store in the index for the
+                       list views (see :mod:`tryton_sphinx.hydrate`)
         """
-        assert isinstance(model_object, ModelSQL), \
+        assert isinstance(model_object, (ModelSQL, CatalogModel)), \
             "model_object must be an instance of ModelSQL"
         if base_source:
             assert isinstance(base_source, BaseSource), \
                 "base_source must be an instance of BaseSource (got %s)" % type(
                     base_source)
 
-        attributes = {}
-        for name, field in model_object._columns.iteritems():
-            if field.select != 1:
-                continue
-            try:
-                attributes[name] = guess_type(field)
-            except ValueError:
-                # Ignore if a value error is raised because its a field which
-                # sphinx doesnt know the proper type for conversion
-                continue
+        if attribute_map is None:
+            attributes = get_attributes(model_object)
+            attribute_map = {}
+        else:
+            attributes = dict((name, attribute.type)
+                for name, attribute in attribute_map.iteritems())
+        multi_attributes = dict(
+            (name, cls.multi_attribute_queries(model_object, name))
+            for name in get_multi_attributes(model_object))
+        stored, extra = stored_columns(model_object, stored or [],
+            attributes, attribute_map)
+        if extra and (attributes or multi_attributes):
+            attribute_map = dict(attribute_map, **extra)
+            attributes.update((name, attribute.type)
+                for name, attribute in extra.iteritems())
 
         sql_query = ""
         sql_query_range = 'SELECT MIN(id),MAX(id) FROM "%s"' \
             % model_object._table
  
-        if attributes:
+        if attributes or multi_attributes:
+            columns = []
+            for name in attributes.keys():
+                expression = name in attribute_map and \
+                    attribute_map[name].expression
+                columns.append('%s AS "%s"' % (expression or '"%s"."%s"' % (
+                    model_object._table, name), name))
+            if not columns:
+                # Only multi-valued attributes: sphinx needs a full text
+                # field in the schema, the `_rec_name` or an empty one
+                rec_name = model_object._rec_name
+                rec_field = model_object._columns.get(rec_name)
+                if rec_field is not None and \
+                        not isinstance(rec_field, Function):
+                    columns.append('"%s"."%s" AS "%s"' % (
+                        model_object._table, rec_name, rec_name))
+                else:
+                    columns.append('\'\' AS "rec_name"')
+            joins = []
+            if join_rec_names:
+                for name in sorted(attributes):
+                    if not isinstance(model_object._columns.get(name),
+                            Many2One):
+                        continue
+                    rec_name_join = cls.rec_name_join(model_object, name)
+                    if rec_name_join is not None:
+                        joins.append(rec_name_join[0])
+                        columns.append(rec_name_join[1])
+
             # Construct the SQL query if attributes do exist
             sql_query = ['SELECT "%s"."id" AS "id",' % model_object._table]
-            sql_query.append(", ".join([
-                '"%s"."%s" AS "%s"' % (model_object._table, name, name) \
-                    for name in attributes.keys()
-                ]))
+            sql_query.append(", ".join(columns))
             sql_query.append('FROM "%s"' % model_object._table)
+            sql_query.extend(joins)
             sql_query.extend([
                 'WHERE',
                 '"%s"."id" >= $start' % model_object._table,
@@ -185,47 +321,213 @@ class DataSource(object):
                 ])
 
         # Build the data source name
-        data_source_name = model_object._table
+        data_source_name = prefix + model_object._table
         if base_source:
             data_source_name = "%s : %s" % (data_source_name, base_source.name)
 
         # Create a new instance of Data Source with the data we have
-        return cls(
+        source = cls(
             name = data_source_name,
             sql_query = ' '.join(sql_query),
             attributes = attributes,
             sql_query_range = sql_query_range,
+            table = model_object._table,
+            multi_attributes = multi_attributes,
+            bits = dict((name, attribute.bits)
+                for name, attribute in attribute_map.iteritems()
+                if attribute.bits),
+            lookups = dict((name, attribute.lookup)
+                for name, attribute in attribute_map.iteritems()
+                if attribute.lookup),
+            stored = stored if attributes else {},
             )
+        source.sql_query_pre = source.overflow_checks()
+        return source
+
+    @classmethod
+    def from_model_with_delta(cls, model_object, base_source = None,
+            prefix = '', join_rec_names = False, attribute_map = None,
+            stored = None):
+        """Creates a main and a delta data source for the given model and
+        returns them as a tuple `(main, delta)`.
+
+        The main source records the time of every full build in the
+        counter table (see :mod:`tryton_sphinx.delta`). The delta source
+        inherits from the main source and only fetches the records which
+        were created or written since then, and its kill-list hides those
+        records (and the deleted ones) from the main index.
+
+        :param model_object: The instance of a model as obtained from the 
+                             `trytond.pool.Pool`
+        :param base_source: The base_source to inherit from. Must be an 
+                            instance of :class:`BaseSource`
+        :param prefix: A prefix for the names of the data sources
+        :param join_rec_names: See :meth:`from_model`
+        :param attribute_map: See :meth:`from_model`
+        :param stored: See :meth:`from_model`
+        """
+        main = cls.from_model(model_object, base_source, prefix,
+            join_rec_names, attribute_map, stored)
+        if not main.sql_query:
+            return main, None
+
+        for column in ('create_date', 'write_date'):
+            if column not in model_object._columns:
+                raise ValueError(
+                    "%s has no %s column, cannot build a delta source" % (
+                        model_object._name, column))
+
+        table = model_object._table
+        index_name = main.index_name
+        main.sql_query_pre = main.overflow_checks() + \
+            delta.main_query_pre(index_name)
+
+        changed = delta.changed_condition(table, index_name)
+        sql_query_range = 'SELECT MIN(id),MAX(id) FROM "%s" WHERE %s' % (
+            table, changed)
+        delta_source = cls(
+            name = "%s : %s" % (delta.delta_name(index_name), index_name),
+            sql_query = "%s AND %s" % (main.sql_query, changed),
+            attributes = main.attributes,
+            sql_query_range = sql_query_range,
+            sql_range_step = main.sql_range_step,
+            sql_query_pre = main.overflow_checks(changed) + \
+                delta.delta_query_pre(index_name),
+            sql_query_killlist = delta.killlist_query(table, index_name),
+            table = table,
+            multi_attributes = dict(
+                (name, cls.multi_attribute_queries(model_object, name,
+                    changed, sql_query_range))
+                for name in main.multi_attributes),
+            index_options = main.index_options,
+            bits = main.bits,
+            lookups = main.lookups,
+            stored = main.stored,
+            )
+        return main, delta_source
+
+    def overflow_checks(self, condition = None):
+        """Returns the `sql_query_pre` statements which fail the indexing
+        once a column outgrew its bitfield (the ordinals of the selections
+        can not), see :func:`tryton_sphinx.attributes.overflow_check`
+
+        :param condition: A condition restricting the rows checked
+        """
+        return [overflow_check(self.table, name, bits, condition)
+            for name, bits in sorted(self.bits.iteritems())
+            if name not in self.lookups]
+
+    def shard(self, count, min_id, max_id):
+        """Splits the data source in `count` data sources which each fetch
+        a contiguous range of ids and returns them as a list. The first and
+        the last shards are open ended so that the records created after the
+        config was generated still get indexed.
+
+        :param count: The number of shards (at most one per id of the table)
+        :param min_id: The lowest id of the table
+        :param max_id: The highest id of the table
+        """
+        span = max_id - min_id + 1
+        count = min(count, span)
+        if count <= 1:
+            return [self]
+
+        parent = self.name.split(':')[1].strip() if ':' in self.name else None
+        checks = self.overflow_checks()
+        sql_query_pre = [query for query in self.sql_query_pre
+            if query not in checks]
+
+        shards = []
+        for number in xrange(count):
+            # The ranges differ by one id at most, none is empty
+            start = min_id + number * span // count
+            end = min_id + (number + 1) * span // count - 1
+            if number == 0:
+                sql_query_range = 'SELECT MIN(id), %d FROM "%s"' % (
+                    end, self.table)
+                condition = '"%s"."id" <= %d' % (self.table, end)
+            elif number == count - 1:
+                sql_query_range = 'SELECT %d, MAX(id) FROM "%s"' % (
+                    start, self.table)
+                condition = '"%s"."id" >= %d' % (self.table, start)
+            else:
+                sql_query_range = 'SELECT %d, %d' % (start, end)
+                condition = '"%s"."id" BETWEEN %d AND %d' % (self.table,
+                    start, end)
+            name = '%s_%d' % (self.index_name, number)
+            if parent:
+                name = '%s : %s' % (name, parent)
+            shards.append(self.__class__(
+                name = name,
+                sql_query = self.sql_query,
+                attributes = self.attributes,
+                sql_query_range = sql_query_range,
+                sql_range_step = self.sql_range_step,
+                # Only the rows of the shard are checked
+                sql_query_pre = (self.overflow_checks(condition)
+                    if checks else []) + sql_query_pre,
+                sql_query_killlist = self.sql_query_killlist,
+                table = self.table,
+                # The values of the documents of the shard only
+                multi_attributes = dict((attribute, (queries[0],
+                    sql_query_range)) for attribute, queries in
+                    self.multi_attributes.iteritems()),
+                index_options = self.index_options,
+                bits = self.bits,
+                lookups = self.lookups,
+                stored = self.stored,
+                ))
+        return shards
+
+    def as_string(self):
+        """Returns the string representation of the config as it has to appear
+        in the sphinx.conf
+        """
+        return renderer.render('data_source', cls=self, config=CONFIG)
+
+    def write_to(self, file):
+        """Streams the config as it has to appear in the sphinx.conf into the
+        given file
+        """
+        renderer.stream(file, 'data_source', cls=self, config=CONFIG)
+
+
+class DistributedIndex(object):
+    """This class represents a `sphinx distributed index
+    <http://sphinxsearch.com/docs/2.0.1/distributed.html>`_ which searches
+    several local indexes (eg. the shards of a large model) in parallel.
+
+    The possible arguments are:
+
+    `name`: Name of the index (needs to be unique)
+    `locals`: The list of the names of the local indexes to search
+    `agents`: The list of the remote indexes to search, as
+              `host:port[|host:port...]:index[,index...]` where the hosts
+              separated by `|` are mirrors of the same indexes
+    `table`: The table of the indexes (known from the local indexes when
+             there are some)
+    `options`: A list of `(option, value)` tuples of the index block (eg.
+               `ha_strategy` or `agent_query_timeout`)
+    `autocomplete`: True if it searches the autocomplete index of its table
+    """
+
+    def __init__(self, name, locals, agents=None, table=None, options=None,
+            autocomplete=False):
+        self.name = name
+        self.locals = locals
+        self.agents = agents or []
+        self.table = table
+        self.options = options or []
+        self.autocomplete = autocomplete
 
     def as_string(self):
         """Returns the string representation of the config as it has to appear
         in the sphinx.conf
         """
-        # TODO: Morphology
-        # TODO: An indexer for each language ???
-        # TODO: Check the realtime indexing
-        template = Environment().from_string("""
-source {{cls.name}}
-{
-    sql_query           = {{cls.sql_query}}
-
-    {% if cls.sql_query_range %}
-    sql_query_range     = {{cls.sql_query_range}}
-    sql_range_step      = {{cls.sql_range_step}}
-    {% endif %}
-
-    {% for attr_name, attr_type in cls.attributes.iteritems() %}
-    {{attr_type}}       = {{attr_name}}
-    {% endfor %}
-    }
-
-{% set name_without_parent = cls.name.split(':')[0] %}
-
-index {{name_without_parent}}
-{
-    source              = {{name_without_parent}}
-    path                = {{config.options['data_path']}}/sphinx/{{name_without_parent}}
-    charset_type        = utf-8
-    }
-        """)
-        return template.render(cls=self, config=CONFIG)
+        return renderer.render('distributed_index', index=self)
+
+    def write_to(self, file):
+        """Streams the config as it has to appear in the sphinx.conf into the
+        given file
+        """
+        renderer.stream(file, 'distributed_index', index=self)
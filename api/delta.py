@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    delta
+
+    Helpers for the main + delta indexing scheme.
+
+    Every main index records the time it was built in a counter table. The
+    delta index only fetches the records created or written after that time
+    and hides them (together with the deleted records) from the main index
+    through its kill-list. Merging the delta into the main index moves the
+    counter forward so that the delta stays small.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+
+#: Name of the table which keeps the time of the last main and delta build
+#: for every index
+COUNTER_TABLE = 'sphinx_counter'
+
+#: Name of the table which records the ids of deleted records so that they
+#: can be added to the kill-list of the delta index
+KILLLIST_TABLE = 'sphinx_killlist'
+
+#: Suffix used for the delta data source and index names
+DELTA_SUFFIX = '_delta'
+
+
+def delta_name(index_name):
+    """Returns the name of the delta index for the given main index
+    """
+    return index_name + DELTA_SUFFIX
+
+
+def _last_main_build(index_name):
+    return '(SELECT "main_indexed" FROM "%s" WHERE "index_name" = \'%s\')' % (
+        COUNTER_TABLE, index_name)
+
+
+def changed_since_delta_query(table, index_name):
+    """Returns the query selecting the ids of the records of the table which
+    were created or written since the last delta build, ie. which neither
+    the main nor the delta index have seen yet
+    """
+    return 'SELECT "%s"."id" FROM "%s" WHERE COALESCE("%s"."write_date", ' \
+        '"%s"."create_date") > (SELECT "delta_indexed" FROM "%s" ' \
+        'WHERE "index_name" = \'%s\')' % (table, table, table, table,
+            COUNTER_TABLE, index_name)
+
+
+def main_query_pre(index_name):
+    """Returns the `sql_query_pre` statements of a main source which reset
+    the counter of the index to the time of the build
+    """
+    return [
+        'DELETE FROM "%s" WHERE "index_name" = \'%s\'' % (
+            COUNTER_TABLE, index_name),
+        'INSERT INTO "%s" ("index_name", "main_indexed", "delta_indexed") '
+            'VALUES (\'%s\', NOW(), NOW())' % (COUNTER_TABLE, index_name),
+        ]
+
+
+def delta_query_pre(index_name):
+    """Returns the `sql_query_pre` statements of a delta source which record
+    the time of the delta build. The merge uses this time to move the main
+    counter forward.
+    """
+    return [
+        'UPDATE "%s" SET "delta_indexed" = NOW() WHERE "index_name" = \'%s\'' \
+            % (COUNTER_TABLE, index_name),
+        ]
+
+
+def changed_condition(table, index_name):
+    """Returns the SQL condition which selects the records of the table that
+    were created or written since the last main build
+    """
+    return 'COALESCE("%s"."write_date", "%s"."create_date") > %s' % (
+        table, table, _last_main_build(index_name))
+
+
+def killlist_query(table, index_name):
+    """Returns the kill-list query of a delta source: the records changed or
+    deleted since the last main build
+    """
+    return ' '.join([
+        'SELECT "%s"."id" FROM "%s" WHERE %s' % (
+            table, table, changed_condition(table, index_name)),
+        'UNION',
+        'SELECT "record_id" FROM "%s"' % KILLLIST_TABLE,
+        'WHERE "table_name" = \'%s\'' % table,
+        'AND "deleted_at" > %s' % _last_main_build(index_name),
+        ])
+
+
+def schema_sql(tables):
+    """Returns the SQL statements (as a string) which create the counter and
+    the kill-list tables, the trigger which logs deleted records and the
+    indexes which keep the delta queries cheap on the given tables.
+
+    The statements are meant to be run by the operator (e.g. with `psql`)
+    before the first build. They can be run again, e.g. once a model was
+    added, as they skip what already exists (`CREATE INDEX IF NOT EXISTS`
+    needs PostgreSQL 9.5).
+
+    :param tables: An iterable of table names which have a delta index
+    """
+    statements = [
+        'CREATE TABLE IF NOT EXISTS "%s" ('
+            '"index_name" VARCHAR(255) PRIMARY KEY, '
+            '"main_indexed" TIMESTAMP, '
+            '"delta_indexed" TIMESTAMP)' % COUNTER_TABLE,
+        'CREATE TABLE IF NOT EXISTS "%s" ('
+            '"table_name" VARCHAR(255) NOT NULL, '
+            '"record_id" BIGINT NOT NULL, '
+            '"deleted_at" TIMESTAMP NOT NULL DEFAULT NOW())' % KILLLIST_TABLE,
+        'CREATE INDEX IF NOT EXISTS "%s_table_deleted" '
+            'ON "%s" ("table_name", "deleted_at")' % (
+                KILLLIST_TABLE, KILLLIST_TABLE),
+        'CREATE OR REPLACE FUNCTION "%s_log"() RETURNS trigger AS $$ '
+            'BEGIN '
+            'INSERT INTO "%s" ("table_name", "record_id") '
+            'VALUES (TG_TABLE_NAME, OLD."id"); '
+            'RETURN OLD; '
+            'END; $$ LANGUAGE plpgsql' % (KILLLIST_TABLE, KILLLIST_TABLE),
+        ]
+    for table in sorted(tables):
+        statements.extend([
+            'DROP TRIGGER IF EXISTS "%s" ON "%s"' % (KILLLIST_TABLE, table),
+            'CREATE TRIGGER "%s" AFTER DELETE ON "%s" '
+                'FOR EACH ROW EXECUTE PROCEDURE "%s_log"()' % (
+                    KILLLIST_TABLE, table, KILLLIST_TABLE),
+            'CREATE INDEX IF NOT EXISTS "%s_sphinx_changed" ON "%s" '
+                '(COALESCE("write_date", "create_date"))' % (table, table),
+            ])
+    return ';\n'.join(statements) + ';\n'
+
+
+def advance_counter(cursor, index_name, table_name=None):
+    """Moves the main counter of the index to the time of the last delta
+    build and purges the deleted records which are now part of the main
+    index. To be called once the delta has been merged into the main index.
+
+    :param cursor: A cursor on the tryton database
+    :param index_name: Name of the main index
+    :param table_name: Name of the indexed table if it differs from the name
+                       of the index
+    """
+    cursor.execute(
+        'UPDATE "%s" SET "main_indexed" = "delta_indexed" '
+        'WHERE "index_name" = %%s' % COUNTER_TABLE, (index_name,))
+    cursor.execute(
+        'DELETE FROM "%s" WHERE "table_name" = %%s '
+        'AND "deleted_at" <= (SELECT "main_indexed" FROM "%s" '
+            'WHERE "index_name" = %%s)' % (KILLLIST_TABLE, COUNTER_TABLE),
+        (table_name or index_name, index_name))
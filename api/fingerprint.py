@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+    fingerprint
+
+    Fingerprints of the config blocks of the indexes, stored next to the
+    generated config, so that a new config can be compared with the
+    previous one and only the indexes which changed rebuilt with
+    `indexer --rotate`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import json
+import hashlib
+
+from configuration import DataSource
+from xmlpipe import XmlpipeSource
+
+
+def fingerprint_filename(filename):
+    """Returns the name of the file holding the fingerprints of a config
+    """
+    return filename + '.fingerprints'
+
+
+def fingerprints(builds):
+    """Returns a :class:`dict` of the names of the sources and indexes of
+    the builds as keys and a :class:`dict` of the name of their index and
+    their fingerprint as values.
+
+    The fingerprint of a data source covers its whole block (query,
+    attributes, range settings...) and the base source it inherits from.
+
+    :param builds: A list of :class:`tryton_sphinx.builder.DatabaseBuild`
+    """
+    result = {}
+    for database_build in builds:
+        base = database_build.base_source.as_string()
+        for source in database_build.sources:
+            block = source.as_string()
+            if isinstance(source, DataSource):
+                block = base + block
+                index = source.index_name
+            else:
+                index = source.name
+            result[source.name] = {
+                'index': index,
+                'rotate': isinstance(source, (DataSource, XmlpipeSource)),
+                'fingerprint': hashlib.sha1(
+                    block.encode('utf-8')).hexdigest(),
+                }
+    return result
+
+
+def load(filename):
+    """Returns the fingerprints stored for the config (empty if there are
+    none)
+    """
+    try:
+        with open(fingerprint_filename(filename)) as file:
+            return json.load(file)
+    except IOError:
+        return {}
+
+
+def save(filename, current):
+    """Stores the fingerprints of the config
+    """
+    with open(fingerprint_filename(filename), 'w') as file:
+        json.dump(current, file, indent=2, sort_keys=True)
+
+
+class Changes(object):
+    """The differences between the fingerprints of two configs.
+
+    `added`, `changed`, `removed`: The sorted names of the sources and
+                                   indexes
+    `rotate_sources`: The added or changed data sources
+    `rotate`: The sorted names of the indexes to rebuild with
+              `indexer --rotate`
+    """
+
+    def __init__(self, previous, current):
+        self.added = sorted(set(current) - set(previous))
+        self.removed = sorted(set(previous) - set(current))
+        self.changed = sorted(name for name in set(current) & set(previous)
+            if current[name]['fingerprint'] !=
+                previous[name]['fingerprint'])
+        self.rotate_sources = [name for name in self.added + self.changed
+            if current[name]['rotate']]
+        self.rotate = sorted(set(current[name]['index']
+            for name in self.rotate_sources))
+
+    def __nonzero__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def report(self, config_filename):
+        """Returns the changes and the indexer command rebuilding the
+        affected indexes as text
+        """
+        if not self:
+            return 'No source or index changed\n'
+        lines = []
+        for label, names in [('Added', self.added), ('Changed', self.changed),
+                ('Removed', self.removed)]:
+            if names:
+                lines.append('%s: %s' % (label, ', '.join(names)))
+        if self.rotate:
+            lines.append('indexer -c %s --rotate %s' % (
+                config_filename, ' '.join(self.rotate)))
+        restart = [name for name in self.changed
+            if name not in self.rotate_sources]
+        if self.added or self.removed or restart:
+            lines.append('searchd has to be restarted to serve the added '
+                'or removed indexes and the changed real-time or '
+                'distributed indexes')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    hydrate
+
+    Serves the list views of the searches from the indexes. The fields a
+    list view shows (the `_sphinx_stored` list of a model, or the ones given
+    with `--stored`) are stored in the index as attributes and returned with
+    the matches, so a page of results needs no query to the database. The
+    fields which are not stored are read at once for all the matches, and
+    the records keep the order of the ranking.
+
+    The values are stored so that they come back as `read` returns them:
+    numbers, dates and timestamps as their text (sphinx keeps floats on 32
+    bits and timestamps in seconds), the selections compacted to ordinals
+    (see :mod:`tryton_sphinx.attributes`) through their lookup. Sphinx has
+    no NULL: an empty integer comes back as 0 and an empty string as `''`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from trytond.model.fields import (Integer, BigInteger, Boolean, Char, Text,
+    Selection, Many2One, Float, Numeric, Date, DateTime, Function)
+
+from attributes import Attribute
+
+#: The attribute types which hold the value of a field of each kind as is.
+#: An integer column may hold negative values, which `sql_attr_uint` would
+#: return as `2 ** 32 - n`, ids can not.
+KIND_TYPES = {
+    'string': ('sql_field_string', 'sql_attr_string'),
+    'selection': ('sql_field_string', 'sql_attr_string'),
+    'integer': ('sql_attr_bigint',),
+    'many2one': ('sql_attr_uint', 'sql_attr_bigint'),
+    'boolean': ('sql_attr_bool',),
+    }
+
+#: The attribute type a field of each kind is stored as
+STORED_TYPES = {
+    'string': 'sql_attr_string',
+    'selection': 'sql_attr_string',
+    'integer': 'sql_attr_bigint',
+    'many2one': 'sql_attr_uint',
+    'boolean': 'sql_attr_bool',
+    }
+
+#: The suffix of the string attribute holding the text of a field whose
+#: attribute does not keep its value
+TEXT_SUFFIX = '_text'
+
+
+class StoredColumn(object):
+    """How a field is stored in an index.
+
+    `column`: The name of the attribute holding its value
+    `kind`: How the value is decoded: `string`, `selection`, `integer`,
+            `many2one`, `boolean`, `float`, `numeric`, `date` or
+            `datetime`
+    `lookup`: For a selection stored as ordinals, the list of its
+              `(value, ordinal)` tuples
+    """
+
+    def __init__(self, column, kind, lookup=None):
+        self.column = column
+        self.kind = kind
+        self.lookup = lookup
+
+
+def field_kind(field):
+    """Returns the kind of the values of the field (see
+    :class:`StoredColumn`) or None if it can not be stored
+    """
+    if field is None or isinstance(field, Function):
+        return None
+    for types, kind in (
+            ((Integer, BigInteger), 'integer'),
+            (Boolean, 'boolean'),
+            (DateTime, 'datetime'),
+            (Date, 'date'),
+            (Numeric, 'numeric'),
+            (Float, 'float'),
+            (Selection, 'selection'),
+            ((Char, Text), 'string'),
+            (Many2One, 'many2one')):
+        if isinstance(field, types):
+            return kind
+    return None
+
+
+def stored_fields(model_object, stored=None):
+    """Returns the names of the fields of the model to store in its index:
+    the ones given for the model in `stored`, or its `_sphinx_stored`
+
+    :param stored: A :class:`dict` of model names and lists of field names
+    """
+    if stored and model_object._name in stored:
+        return list(stored[model_object._name])
+    return list(getattr(model_object, '_sphinx_stored', None) or [])
+
+
+def stored_columns(model_object, names, attributes, attribute_map):
+    """Returns a tuple `(columns, extra)`: a :class:`dict` of the names of
+    the fields which can be stored and their :class:`StoredColumn`, and a
+    :class:`dict` of the attributes to add to the data source for them and
+    their :class:`tryton_sphinx.attributes.Attribute`. A field which is
+    already an attribute holding its value is not stored twice.
+
+    :param attributes: A :class:`dict` of the names of the attributes of the
+                       data source and their type
+    :param attribute_map: A :class:`dict` of the names of the attributes and
+                          their :class:`tryton_sphinx.attributes.Attribute`
+    """
+    table = model_object._table
+    columns, extra = {}, {}
+    for name in names:
+        kind = field_kind(model_object._columns.get(name))
+        if kind is None:
+            continue
+        attr_type = attributes.get(name)
+        attribute = attribute_map.get(name)
+        if attr_type in KIND_TYPES.get(kind, ()) and not (attribute
+                and attribute.expression):
+            columns[name] = StoredColumn(name, kind)
+        elif kind == 'selection' and attribute and attribute.lookup:
+            columns[name] = StoredColumn(name, kind, attribute.lookup)
+        elif kind in STORED_TYPES and attr_type is None:
+            columns[name] = StoredColumn(name, kind)
+            extra[name] = Attribute(STORED_TYPES[kind])
+        else:
+            column = name + TEXT_SUFFIX if attr_type else name
+            columns[name] = StoredColumn(column, kind)
+            extra[column] = Attribute('sql_attr_string',
+                expression='CAST("%s"."%s" AS TEXT)' % (table, name))
+    return columns, extra
+
+
+def decode(column, value):
+    """Returns the value of a stored field as `read` returns it
+    """
+    if value is None:
+        return None
+    kind = column.kind
+    if kind == 'selection' and column.lookup:
+        return dict((ordinal, key)
+            for key, ordinal in column.lookup).get(int(value))
+    if kind in ('string', 'selection'):
+        return value.decode('utf-8') if isinstance(value, str) else value
+    if kind == 'integer':
+        # The text of the column if its attribute is an unsigned bitfield
+        return int(value) if value != '' else None
+    if kind == 'many2one':
+        return int(value) or None
+    if kind == 'boolean':
+        return bool(int(value))
+    # The text of the column, empty if it was NULL
+    if value == '':
+        return None
+    if kind == 'float':
+        return float(value)
+    if kind == 'numeric':
+        return Decimal(value)
+    if kind == 'date':
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(
+        microsecond=int((value[20:26] or '0').ljust(6, '0')))
+
+
+def select_columns(columns, fields_names):
+    """Returns the columns a search has to select to hydrate the fields
+    """
+    return ['id'] + sorted(set(columns[name].column
+        for name in fields_names if name in columns))
+
+
+def hydrate(model_object, rows, fields_names, columns):
+    """Returns the records of the matches of a search, in their order, as
+    the :class:`dict` `read` returns. The stored fields are decoded from the
+    rows and the others are read for all the matches in a single `read`;
+    the matches whose record was deleted since it was indexed are then left
+    out.
+
+    :param rows: The rows sphinx returned, with the columns of
+                 :func:`select_columns`
+    :param fields_names: The names of the fields to return
+    :param columns: A :class:`dict` of the names of the stored fields and
+                    their :class:`StoredColumn` (see
+                    :meth:`tryton_sphinx.client.IndexRegistry.stored_columns`)
+    """
+    records = []
+    for row in rows:
+        record = {'id': int(row['id'])}
+        for name in fields_names:
+            if name in columns:
+                record[name] = decode(columns[name],
+                    row.get(columns[name].column))
+        records.append(record)
+
+    missing = [name for name in fields_names if name not in columns]
+    if not missing or not records:
+        return records
+    values = dict((value['id'], value) for value in
+        model_object.read([record['id'] for record in records], missing))
+    result = []
+    for record in records:
+        value = values.get(record['id'])
+        if value is None:
+            continue
+        record.update((name, value[name]) for name in missing)
+        result.append(record)
+    return result
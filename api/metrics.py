@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+    metrics
+
+    Metrics of the generation of the config and of the builds of the
+    indexes, written in the Prometheus text-file format (for the textfile
+    collector of the node exporter) or as JSON, and a parser of the output
+    of the sphinx `indexer`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import time
+import json
+from contextlib import contextmanager
+
+#: The type and the help of every metric, without the prefix
+METRICS = {
+    'buildconf_seconds': ('gauge',
+        'Seconds spent in every stage of the generation of the config'),
+    'buildconf_models': ('gauge',
+        'Models introspected, by what became of them'),
+    'buildconf_skipped_fields': ('gauge',
+        'select=1 fields of the models sphinx has no attribute type for'),
+    'buildconf_sources': ('gauge',
+        'Sources and indexes written to the config, by type'),
+    'buildconf_last_run_timestamp': ('gauge',
+        'Time the config was last generated'),
+    'index_documents': ('gauge',
+        'Documents indexed by the last build of the index'),
+    'index_bytes': ('gauge',
+        'Bytes of text indexed by the last build of the index'),
+    'index_seconds': ('gauge',
+        'Seconds the last build of the index took'),
+    'index_documents_per_second': ('gauge',
+        'Documents per second of the last build of the index'),
+    'index_success': ('gauge',
+        'Whether the last build of the index succeeded'),
+    'index_pending_changes': ('gauge',
+        'Rows created or written since the index was last built'),
+    'index_last_build_timestamp': ('gauge',
+        'Time the index was last built'),
+    }
+
+_INDEXING = re.compile(r"^indexing index '([^']+)'")
+_TOTAL_DOCS = re.compile(r'^total (\d+) docs, (\d+) bytes')
+_TOTAL_TIME = re.compile(r'^total ([\d.]+) sec')
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metrics(object):
+    """A set of metrics and their samples. Every sample is identified by the
+    name of its metric (one of :data:`METRICS`) and its labels.
+
+    `prefix`: The prefix of the names of the exported metrics
+    """
+
+    def __init__(self, prefix='tryton_sphinx'):
+        self.prefix = prefix
+        self.samples = {}
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise ValueError("Unknown metric %s" % name)
+        return name, tuple(sorted(labels.iteritems()))
+
+    def set(self, name, value, **labels):
+        """Sets the value of a sample
+        """
+        self.samples[self._key(name, labels)] = value
+
+    def add(self, name, value=1, **labels):
+        """Adds to the value of a sample
+        """
+        key = self._key(name, labels)
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def get(self, name, **labels):
+        return self.samples.get(self._key(name, labels))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Adds the seconds spent in the block to a sample
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start, **labels)
+
+    def update(self, other):
+        """Adds the samples of other metrics, eg. the ones of another
+        database built in a worker process
+        """
+        for (name, labels), value in other.samples.iteritems():
+            self.add(name, value, **dict(labels))
+
+    def as_prometheus(self):
+        """Returns the samples in the Prometheus text format
+        """
+        lines = []
+        for name in sorted(set(name for name, _ in self.samples)):
+            metric_type, help = METRICS[name]
+            full_name = self.prefix + '_' + name
+            lines.append('# HELP %s %s' % (full_name, help))
+            lines.append('# TYPE %s %s' % (full_name, metric_type))
+            for (sample_name, labels), value in sorted(
+                    self.samples.iteritems()):
+                if sample_name != name:
+                    continue
+                label_text = ','.join('%s="%s"' % (label, _escape(
+                    label_value)) for label, label_value in labels)
+                lines.append('%s%s %s' % (full_name,
+                    label_text and '{%s}' % label_text, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def as_json(self):
+        """Returns the samples as JSON
+        """
+        return json.dumps({
+            'prefix': self.prefix,
+            'metrics': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.samples.iteritems())
+                ],
+            }, indent=2, sort_keys=True)
+
+    def write(self, filename):
+        """Writes the samples to the file, as JSON if its name ends with
+        `.json` and in the Prometheus text format otherwise. The file is
+        replaced at once so that a collector never reads half of it.
+        """
+        if filename.endswith('.json'):
+            text = self.as_json()
+        else:
+            text = self.as_prometheus()
+        temporary = '%s.%d.tmp' % (filename, os.getpid())
+        with open(temporary, 'w') as file:
+            file.write(text.encode('utf-8'))
+        os.rename(temporary, filename)
+
+
+class IndexerResult(object):
+    """The totals the indexer printed for an index.
+
+    `name`: The name of the index
+    `documents`: The number of documents indexed
+    `bytes`: The number of bytes of text indexed
+    `seconds`: The time the build took
+    """
+
+    def __init__(self, name, documents=0, bytes=0, seconds=0.0):
+        self.name = name
+        self.documents = documents
+        self.bytes = bytes
+        self.seconds = seconds
+
+    @property
+    def documents_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.documents / self.seconds
+
+
+def parse_indexer_output(text):
+    """Returns a :class:`dict` of the names of the indexes built by an
+    `indexer` run and their :class:`IndexerResult`, read from its output
+    """
+    results, current = {}, None
+    for line in text.splitlines():
+        line = line.strip()
+        match = _INDEXING.match(line)
+        if match:
+            current = results[match.group(1)] = IndexerResult(
+                match.group(1))
+            continue
+        if current is None:
+            continue
+        match = _TOTAL_DOCS.match(line)
+        if match:
+            current.documents = int(match.group(1))
+            current.bytes = int(match.group(2))
+            continue
+        match = _TOTAL_TIME.match(line)
+        if match:
+            current.seconds = float(match.group(1))
+    return results
+
+
+def record_indexer_result(metrics, result, success=True):
+    """Records the :class:`IndexerResult` of an index in the metrics
+    """
+    metrics.set('index_documents', result.documents, index=result.name)
+    metrics.set('index_bytes', result.bytes, index=result.name)
+    metrics.set('index_seconds', result.seconds, index=result.name)
+    metrics.set('index_documents_per_second', result.documents_per_second,
+        index=result.name)
+    metrics.set('index_success', int(success), index=result.name)
+    if success:
+        metrics.set('index_last_build_timestamp', int(time.time()),
+            index=result.name)
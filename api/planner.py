@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+    planner
+
+    Chooses the ranged query step of every data source and the memory
+    settings of the indexer from the statistics of the tables, and explains
+    the choices in a report.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+
+#: The amount of data every ranged query should fetch. Larger steps mean
+#: fewer round trips, smaller steps keep the result sets of the indexer's
+#: SQL connection small.
+TARGET_STEP_BYTES = 8 * 1024 * 1024
+
+#: Bounds of the ranged query step
+MIN_RANGE_STEP = 1024
+MAX_RANGE_STEP = 1000000
+
+#: A histogram bucket wider than this many times the median bucket is
+#: reported as an id gap
+GAP_FACTOR = 10
+
+#: Bounds of the indexer memory settings (in bytes). mem_limit can not go
+#: beyond 2047M.
+MIN_MEM_LIMIT = 32 * 1024 * 1024
+MAX_MEM_LIMIT = 2047 * 1024 * 1024
+MIN_WRITE_BUFFER = 1024 * 1024
+MAX_WRITE_BUFFER = 16 * 1024 * 1024
+
+#: Share of the available memory of the host the indexer may use
+MEMORY_SHARE = 0.25
+
+
+def format_size(size):
+    """Formats a size in bytes the way sphinx expects it (eg. 256M)
+    """
+    if size >= 1024 * 1024:
+        return '%dM' % (size // (1024 * 1024))
+    return '%dK' % max(1, size // 1024)
+
+
+def parse_size(size):
+    """Parses a size like 512M or 8G into bytes
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = size.strip().upper()
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def host_memory():
+    """Returns the memory (in bytes) available on this host: `MemAvailable`
+    from `/proc/meminfo` when it exists, the physical memory otherwise
+    """
+    try:
+        with open('/proc/meminfo') as file:
+            meminfo = dict(
+                (line.split(':')[0], int(line.split()[1]) * 1024)
+                for line in file)
+    except (IOError, ValueError, IndexError):
+        meminfo = {}
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    if 'MemFree' in meminfo:
+        return sum(meminfo.get(key, 0)
+            for key in ('MemFree', 'Buffers', 'Cached'))
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def dense_density(stats):
+    """Returns the density of the ids in the dense parts of the table.
+
+    The average density is misleading when the ids have gaps (eg. after
+    large deletions): the ranged queries over the dense parts would then
+    fetch far more rows than expected. The histogram of the ids has buckets
+    of equal row counts, so the median bucket width gives the density of
+    the typical part of the table.
+    """
+    bounds = stats.id_bounds
+    if len(bounds) < 3:
+        return stats.density
+    widths = sorted(max(1, high - low)
+        for low, high in zip(bounds, bounds[1:]))
+    median = widths[len(widths) // 2]
+    rows_per_bucket = float(stats.rows) / len(widths)
+    return min(1.0, rows_per_bucket / median)
+
+
+def gap_ids(stats):
+    """Returns the number of ids in the gaps of the table, the histogram
+    buckets which are much wider than the median one
+    """
+    bounds = stats.id_bounds
+    if len(bounds) < 3:
+        return 0
+    widths = [max(1, high - low) for low, high in zip(bounds, bounds[1:])]
+    median = sorted(widths)[len(widths) // 2]
+    return sum(width - median for width in widths
+        if width > GAP_FACTOR * median)
+
+
+class SourcePlan(object):
+    """The plan of a data source: its ranged query step and why.
+
+    `name`: The name of the index
+    `stats`: The :class:`tryton_sphinx.stats.TableStats` of the table
+    `row_width`: The average width in bytes of a fetched row
+    `sql_range_step`: The chosen ranged query step
+    `reasons`: A list of sentences explaining the choice
+    """
+
+    def __init__(self, name, stats, row_width, sql_range_step, reasons):
+        self.name = name
+        self.stats = stats
+        self.row_width = row_width
+        self.sql_range_step = sql_range_step
+        self.reasons = reasons
+
+    @property
+    def data_size(self):
+        """The estimated amount of data fetched to build the index
+        """
+        return self.stats.rows * self.row_width
+
+    @property
+    def queries(self):
+        """The estimated number of ranged queries to build the index
+        """
+        if not self.stats.id_span:
+            return 0
+        return -(-self.stats.id_span // self.sql_range_step)
+
+
+def plan_source(source, stats):
+    """Chooses the ranged query step of the data source so that each query
+    fetches about :data:`TARGET_STEP_BYTES`, sets it on the source and
+    returns the :class:`SourcePlan`.
+
+    :param source: A :class:`tryton_sphinx.DataSource`
+    :param stats: The :class:`tryton_sphinx.stats.TableStats` of its table,
+                  completed by :func:`tryton_sphinx.stats.column_stats`
+    """
+    row_width = stats.row_width(source.attributes.keys())
+    reasons = ['%d rows of about %d bytes' % (stats.rows, row_width)]
+
+    if not stats.id_span:
+        reasons.append('empty table, keeping the step')
+        return SourcePlan(source.index_name, stats, row_width,
+            source.sql_range_step, reasons)
+
+    density = dense_density(stats)
+    rows_per_step = max(1, TARGET_STEP_BYTES // row_width)
+    step = int(rows_per_step / max(density, 1.0 / stats.id_span))
+    reasons.append('%.1f%% of the ids used in the dense parts, so %d ids '
+        'fetch about %s' % (
+            density * 100, step, format_size(TARGET_STEP_BYTES)))
+
+    if step < MIN_RANGE_STEP:
+        step = MIN_RANGE_STEP
+        reasons.append('raised to the minimum of %d' % MIN_RANGE_STEP)
+    elif step > MAX_RANGE_STEP:
+        step = MAX_RANGE_STEP
+        reasons.append('lowered to the maximum of %d' % MAX_RANGE_STEP)
+    if step >= stats.id_span:
+        reasons.append('the whole table fits in one query')
+
+    gaps = gap_ids(stats)
+    if gaps:
+        reasons.append('about %d ids (%d queries) fall in gaps of the id '
+            'sequence' % (gaps, gaps // step))
+
+    source.sql_range_step = step
+    return SourcePlan(source.index_name, stats, row_width, step, reasons)
+
+
+class IndexerPlan(object):
+    """The memory settings of the indexer and why.
+
+    `mem_limit`: The memory limit of the indexer, in bytes
+    `write_buffer`: The size of the write buffers, in bytes
+    `reasons`: A list of sentences explaining the choice
+    """
+
+    def __init__(self, mem_limit, write_buffer, reasons):
+        self.mem_limit = mem_limit
+        self.write_buffer = write_buffer
+        self.reasons = reasons
+
+
+def plan_indexer(plans, memory=None):
+    """Sizes `mem_limit` after the largest index, within a share of the
+    memory of the host, and the write buffers after `mem_limit`.
+
+    :param plans: The list of :class:`SourcePlan`
+    :param memory: The memory of the host in bytes (Default: detected)
+    """
+    if memory is None:
+        memory = host_memory()
+    largest = max([plan.data_size for plan in plans] or [0])
+    budget = int(memory * MEMORY_SHARE)
+    reasons = [
+        'the largest index fetches about %s' % format_size(largest),
+        '%d%% of the %s of memory of the host is %s' % (
+            MEMORY_SHARE * 100, format_size(memory), format_size(budget)),
+        ]
+
+    mem_limit = min(largest, budget)
+    if mem_limit < MIN_MEM_LIMIT:
+        mem_limit = MIN_MEM_LIMIT
+        reasons.append('mem_limit raised to the default of %s' % (
+            format_size(MIN_MEM_LIMIT)))
+    elif mem_limit > MAX_MEM_LIMIT:
+        mem_limit = MAX_MEM_LIMIT
+        reasons.append('mem_limit lowered to the maximum of %s' % (
+            format_size(MAX_MEM_LIMIT)))
+
+    # Up to 4 write buffers are allocated on top of mem_limit
+    write_buffer = max(MIN_WRITE_BUFFER,
+        min(MAX_WRITE_BUFFER, mem_limit // 32))
+    reasons.append('write_buffer is 1/32 of mem_limit, between %s and %s' % (
+        format_size(MIN_WRITE_BUFFER), format_size(MAX_WRITE_BUFFER)))
+    return IndexerPlan(mem_limit, write_buffer, reasons)
+
+
+def report(plans, indexer_plan):
+    """Returns the plans explained as a text report
+    """
+    lines = ['Data sources', '============', '']
+    for plan in sorted(plans, key=lambda plan: plan.name):
+        lines.append('%s: sql_range_step = %d (%d queries)' % (
+            plan.name, plan.sql_range_step, plan.queries))
+        lines.extend('    - %s' % reason for reason in plan.reasons)
+    lines.extend(['', 'Indexer', '=======', ''])
+    lines.append('mem_limit = %s, write_buffer = %s' % (
+        format_size(indexer_plan.mem_limit),
+        format_size(indexer_plan.write_buffer)))
+    lines.extend('    - %s' % reason for reason in indexer_plan.reasons)
+    return '\n'.join(lines) + '\n'
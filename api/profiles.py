@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    profiles
+
+    Index profiles: the dictionary, prefix/infix and morphology settings of
+    the index blocks, and the lightweight autocomplete indexes which only
+    hold the short text fields of a model with prefixes or infixes, so that
+    type-ahead searches do not need `ilike` or a wildcard expansion over the
+    main index.
+
+    A model chooses the profile of its main index with `_sphinx_profile`
+    (which can be overridden when the config is generated) and the fields of
+    its autocomplete index with `_sphinx_autocomplete`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+from trytond.model.fields import Char
+
+from configuration import DataSource
+from searchd import Setting
+
+#: The index options of every profile, in the order they are written
+PROFILES = {
+    # The main indexes stay lean: exact words only
+    'default': [],
+    'stemmed': [
+        ('morphology', 'stem_en'),
+        ('min_stemming_len', '4'),
+        ],
+    'prefix': [
+        ('dict', 'keywords'),
+        ('min_prefix_len', '2'),
+        ('enable_star', '1'),
+        ],
+    'infix': [
+        ('dict', 'keywords'),
+        ('min_infix_len', '3'),
+        ('enable_star', '1'),
+        ],
+    # Every infix is a keyword of the dictionary (dict=crc), so `*pho*`
+    # finds all the words containing `pho` without an expansion limit:
+    # the index is larger, but it answers `ilike` exactly (see
+    # tryton_sphinx.search)
+    'substring': [
+        ('min_infix_len', '3'),
+        ('enable_star', '1'),
+        ],
+    }
+
+#: The searchd settings the profiles rely on. The expansions of the star
+#: searches of `dict = keywords` are cut at `expansion_limit`, a setting of
+#: searchd for all its indexes, so the lowest limit of the profiles in use
+#: applies.
+PROFILE_SETTINGS = {
+    'prefix': {'expansion_limit': 16},
+    'infix': {'expansion_limit': 32},
+    }
+
+#: Suffix of the names of the autocomplete indexes
+AUTOCOMPLETE_SUFFIX = '_ac'
+
+
+def profile_options(name):
+    """Returns the index options of the profile with the given name
+    """
+    try:
+        return list(PROFILES[name])
+    except KeyError:
+        raise ValueError("Unknown index profile %s (known: %s)" % (
+            name, ', '.join(sorted(PROFILES))))
+
+
+def source_profiles(sources):
+    """Returns the sorted names of the profiles of :data:`PROFILE_SETTINGS`
+    the indexes of the data sources have
+    """
+    names = set()
+    for source in sources:
+        options = getattr(source, 'index_options', None) or []
+        names.update(name for name in PROFILE_SETTINGS
+            if not [option for option in PROFILES[name]
+                if option not in options])
+    return sorted(names)
+
+
+def profile_settings(sources):
+    """Returns the list of :class:`tryton_sphinx.searchd.Setting` of the
+    searchd block the profiles of the data sources rely on
+    """
+    values = {}
+    for name in source_profiles(sources):
+        for option, value in PROFILE_SETTINGS[name].iteritems():
+            values.setdefault(option, []).append((value, name))
+    return [Setting(option, str(min(values[option])[0]),
+        'the lowest value of the index profiles %s' % ', '.join(
+            name for _, name in sorted(values[option])))
+        for option in sorted(values)]
+
+
+def substring_length(options):
+    """Returns the `min_infix_len` of an index if its star searches on
+    infixes find every word containing them, or None. The expansions of
+    `dict = keywords` are cut at the `expansion_limit` of searchd, so only
+    the indexes of `dict = crc` qualify.
+
+    :param options: The list of the `(option, value)` tuples of the index
+    """
+    options = dict(options or [])
+    try:
+        length = int(options.get('min_infix_len', 0))
+        substring = int(options.get('max_substring_len', 0))
+    except ValueError:
+        return None
+    if length <= 0 or substring or options.get('enable_star') != '1':
+        return None
+    if options.get('dict') == 'keywords':
+        return None
+    return length
+
+
+def model_profile(model_object, profiles=None):
+    """Returns the name of the profile of the main index of the model: the
+    one given for the model in `profiles`, its `_sphinx_profile` or
+    `default`
+
+    :param profiles: A :class:`dict` of model names and profile names
+    """
+    if profiles and model_object._name in profiles:
+        return profiles[model_object._name]
+    return getattr(model_object, '_sphinx_profile', None) or 'default'
+
+
+def autocomplete_fields(model_object):
+    """Returns the sorted names of the fields of the autocomplete index of
+    the model: its `_sphinx_autocomplete` list, or else its Char fields with
+    `select=1`
+    """
+    names = getattr(model_object, '_sphinx_autocomplete', None)
+    if names is not None:
+        return sorted(names)
+    return sorted(name for name, field in model_object._columns.iteritems()
+        if isinstance(field, Char) and field.select == 1)
+
+
+def autocomplete_source(model_object, base_source=None, prefix='',
+        profile='prefix'):
+    """Returns the :class:`tryton_sphinx.DataSource` of the autocomplete
+    index of the model, or None if it has no short text field. It only
+    fetches the id and the text fields, as full text fields without
+    attributes, with the given profile.
+    """
+    names = autocomplete_fields(model_object)
+    if not names:
+        return None
+    table = model_object._table
+    name = prefix + table + AUTOCOMPLETE_SUFFIX
+    if base_source:
+        name = "%s : %s" % (name, base_source.name)
+    return DataSource(
+        name = name,
+        sql_query = 'SELECT "%s"."id" AS "id", %s FROM "%s" '
+            'WHERE "%s"."id" >= $start AND "%s"."id" <= $end' % (
+                table, ', '.join('"%s"."%s" AS "%s"' % (table, field, field)
+                    for field in names), table, table, table),
+        attributes = {},
+        sql_query_range = 'SELECT MIN(id),MAX(id) FROM "%s"' % table,
+        table = table,
+        index_options = profile_options(profile),
+        autocomplete = True,
+        )
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+    querylog
+
+    Reads the query log of searchd, in the plain or in the `sphinxql`
+    format, line by line in constant memory: the latencies of every index
+    go in a fixed histogram, the queries are grouped by shape (the query
+    with its values replaced by `?`) in a bounded table, and the filters on
+    columns which are not attributes of the index are counted, as they
+    point at the fields which should get `select=1`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import gzip
+import json
+import heapq
+
+# [date] real-time sec [wall-time sec] [mode/filters/sort total (offset,limit)
+# @groupby] [index,...] query
+_PLAIN = re.compile(r'^\[[^\]]*\]\s+([\d.]+)\s+sec\s+(?:[\d.]+\s+sec\s+)?'
+    r'(?:x\d+\s+)?\[(\w+)/(\d+)/(\S+)[^\]]*\]\s+\[([^\]]+)\]\s?(.*)$')
+# /* date conn N real 0.004 wall 0.004 found 12 */ SELECT ...; # error=...
+_SPHINXQL = re.compile(r'^/\*.*?\breal\s+([\d.]+)(?:.*?\bfound\s+(\d+))?'
+    r'.*?\*/\s*(.*?)\s*;?\s*(?:#\s*error=(.*))?$')
+_FROM = re.compile(r'\bFROM\s+([\w\s,]+?)\s*'
+    r'(?:\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|\bOPTION\b|$)', re.I)
+_WHERE = re.compile(r'\bWHERE\b(.*?)(?:\bGROUP\b|\bORDER\b|\bLIMIT\b|'
+    r'\bOPTION\b|$)', re.I)
+_MATCH = re.compile(r"\bMATCH\s*\(\s*'(?:[^'\\]|\\.|'')*'\s*\)", re.I)
+_CONDITION = re.compile(r'\b(\w+)\s*(?:=|!=|<>|<=|>=|<|>|\bNOT\s+IN\b|'
+    r'\bIN\b|\bBETWEEN\b)', re.I)
+_ERROR_COLUMN = re.compile(r"(?:unknown column|no such filter attribute)"
+    r"[:\s]*'?(\w+)'?", re.I)
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r'\b-?\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACES = re.compile(r'\s+')
+
+#: The upper bounds of the latency buckets, in seconds: 0.1ms growing by
+#: a quarter up to about two minutes, so a percentile is known within 25%
+BUCKETS = [0.0001 * 1.25 ** i for i in xrange(64)]
+
+#: The number of query shapes kept; beyond it a new shape replaces the
+#: one with the least total time (see :class:`LightestHeap`)
+MAX_SHAPES = 1000
+
+
+class Query(object):
+    """A query read from the log.
+
+    `indexes`: The names of the indexes searched
+    `seconds`: The time the query took
+    `found`: The number of matches (None if unknown)
+    `shape`: The query with its values replaced by `?`
+    `columns`: The columns the query filters on (only known in the
+               `sphinxql` format)
+    `error`: The error searchd answered (or None)
+    `text`: The query as logged: the full text query in the plain format,
+            the SphinxQL statement in the `sphinxql` format
+    `mode`: The matching mode of the plain format (None in the `sphinxql`
+            format)
+    """
+
+    def __init__(self, indexes, seconds, found, shape, columns, error=None,
+            text=None, mode=None):
+        self.indexes = indexes
+        self.seconds = seconds
+        self.found = found
+        self.shape = shape
+        self.columns = columns
+        self.error = error
+        self.text = text
+        self.mode = mode
+
+
+def query_shape(query):
+    """Returns the query with its strings, numbers and lists of values
+    replaced by `?`
+    """
+    query = _STRING.sub('?', query)
+    query = _NUMBER.sub('?', query)
+    query = _LIST.sub('(?)', query)
+    return _SPACES.sub(' ', query).strip()
+
+
+def filter_columns(query):
+    """Returns the sorted names of the columns the `WHERE` clause of a
+    SphinxQL query filters on
+    """
+    match = _WHERE.search(_MATCH.sub('', query))
+    if match is None:
+        return []
+    return sorted(set(name.lower() for name in _CONDITION.findall(
+        _STRING.sub('?', match.group(1)))) - set(['and', 'or', 'not']))
+
+
+def parse_line(line):
+    """Returns the :class:`Query` of a line of the query log, or None if the
+    line is not a query
+    """
+    line = line.rstrip('\r\n')
+    match = _PLAIN.match(line)
+    if match is not None:
+        seconds, mode, filters, sort, indexes, text = match.groups()
+        # Only the number of filters of the plain format is known
+        return Query(
+            [name.strip() for name in indexes.split(',') if name.strip()],
+            float(seconds), None,
+            '[%s] %s/%s filters=%s' % (indexes, mode, sort, filters), [],
+            text=text, mode=mode)
+    if not line.startswith('/*'):
+        return None
+    match = _SPHINXQL.match(line)
+    if match is None:
+        return None
+    seconds, found, query, error = match.groups()
+    indexes = _FROM.search(query)
+    if indexes is None:
+        return None
+    columns = filter_columns(query)
+    if error:
+        columns = sorted(set(columns) | set(
+            name.lower() for name in _ERROR_COLUMN.findall(error)))
+    return Query(
+        [name.strip() for name in indexes.group(1).split(',')
+            if name.strip()],
+        float(seconds), found and int(found), query_shape(query), columns,
+        error and error.strip(), query)
+
+
+def open_log(filename):
+    """Opens a query log, compressed with gzip if its name ends with `.gz`
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename)
+    return open(filename)
+
+
+class Histogram(object):
+    """The latencies of the queries of an index in the fixed
+    :data:`BUCKETS`
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        low, high = 0, len(BUCKETS)
+        while low < high:
+            middle = (low + high) // 2
+            if BUCKETS[middle] < seconds:
+                low = middle + 1
+            else:
+                high = middle
+        self.counts[low] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, share):
+        """Returns the upper bound of the bucket of the percentile (the
+        maximum if it is beyond the last bucket)
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = share * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if bucket == len(BUCKETS):
+                    return self.maximum
+                return min(BUCKETS[bucket], self.maximum)
+        return self.maximum
+
+
+class LightestHeap(object):
+    """The keys of a :class:`dict` of counters in a heap ordered by their
+    weight, for the Space-Saving algorithm: once the dict is full a new key
+    takes the place of the lightest one and inherits its weight. The
+    weights are then upper bounds of the true ones, exact for the keys
+    which replaced none, and a frequent key can not be pushed out by a
+    stream of keys seen once, as each of them starts as heavy as the one
+    it replaced.
+
+    The weights only grow, so the heap is not updated when they do: an
+    entry whose weight is out of date is pushed back with the current one
+    when it comes out, and finding the lightest key takes `O(log n)`
+    amortized instead of a scan of the dict.
+
+    `weight`: A callable returning the weight of a value of the dict
+    """
+
+    def __init__(self, weight):
+        self.weight = weight
+        self._heap = []
+
+    def push(self, key, value):
+        """Adds a key of the dict
+        """
+        heapq.heappush(self._heap, (self.weight(value), key))
+
+    def pop(self, items):
+        """Removes the lightest key from the dict and returns its value
+        """
+        while True:
+            weight, key = heapq.heappop(self._heap)
+            value = items[key]
+            if self.weight(value) == weight:
+                del items[key]
+                return value
+            heapq.heappush(self._heap, (self.weight(value), key))
+
+
+class Shape(object):
+    """The queries of a shape.
+
+    `shape`: The query with its values replaced by `?`
+    `example`: The slowest query of the shape
+    `error`: The time inherited from the shape it replaced (see
+             :class:`LightestHeap`), by which `total` may be overestimated
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.example = None
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.error = 0.0
+
+    def add(self, query, text):
+        self.count += 1
+        self.total += query.seconds
+        if query.seconds >= self.maximum:
+            self.maximum = query.seconds
+            self.example = text
+
+
+class Analysis(object):
+    """The statistics of the query logs.
+
+    `attributes`: A :class:`dict` of the names of the indexes and the set of
+                  their attributes and fields (see :func:`index_attributes`)
+                  to check the filters against, None not to check them
+    """
+
+    def __init__(self, attributes=None, max_shapes=MAX_SHAPES):
+        self.attributes = attributes
+        self.max_shapes = max_shapes
+        self.lines = 0
+        self.queries = 0
+        self.errors = 0
+        self.histograms = {}
+        self.shapes = {}
+        self.missing = {}
+        self._lightest = LightestHeap(lambda shape: shape.total)
+
+    def add(self, line):
+        """Adds a line of the log
+        """
+        self.lines += 1
+        query = parse_line(line)
+        if query is None:
+            return
+        self.queries += 1
+        if query.error:
+            self.errors += 1
+        for name in query.indexes:
+            self.histograms.setdefault(name, Histogram()).add(query.seconds)
+            self.check_columns(name, query.columns)
+
+        shape = self.shapes.get(query.shape)
+        if shape is None:
+            shape = Shape(query.shape)
+            if len(self.shapes) >= self.max_shapes:
+                lightest = self._lightest.pop(self.shapes)
+                shape.count, shape.total = lightest.count, lightest.total
+                shape.error = lightest.total
+            self.shapes[query.shape] = shape
+            self._lightest.push(query.shape, shape)
+        shape.add(query, line.strip())
+
+    def check_columns(self, name, columns):
+        if self.attributes is None or name not in self.attributes:
+            return
+        known = self.attributes[name]
+        for column in columns:
+            if column != 'id' and column not in known:
+                key = (name, column)
+                self.missing[key] = self.missing.get(key, 0) + 1
+
+    def read(self, file):
+        """Adds the lines of a file, one at a time
+        """
+        for line in file:
+            self.add(line)
+        return self
+
+    def slowest(self, count=10):
+        """Returns the `count` shapes which took the most time overall
+        """
+        return sorted(self.shapes.itervalues(),
+            key=lambda shape: -shape.total)[:count]
+
+    def as_dict(self, count=10):
+        return {
+            'lines': self.lines,
+            'queries': self.queries,
+            'errors': self.errors,
+            'indexes': dict((name, {
+                'queries': histogram.count,
+                'mean': histogram.total / histogram.count,
+                'p50': histogram.percentile(0.5),
+                'p95': histogram.percentile(0.95),
+                'p99': histogram.percentile(0.99),
+                'max': histogram.maximum,
+                }) for name, histogram in self.histograms.iteritems()),
+            'slowest_shapes': [{
+                'shape': shape.shape,
+                'queries': shape.count,
+                'total': shape.total,
+                'error': shape.error,
+                'max': shape.maximum,
+                'example': shape.example,
+                } for shape in self.slowest(count)],
+            'missing_attributes': [{
+                'index': name,
+                'column': column,
+                'queries': queries,
+                } for (name, column), queries in sorted(
+                    self.missing.iteritems(), key=lambda item: -item[1])],
+            }
+
+    def as_json(self, count=10):
+        return json.dumps(self.as_dict(count), indent=2, sort_keys=True)
+
+    def report(self, count=10):
+        """Returns the analysis as a text report
+        """
+        lines = ['%d queries (%d errors) in %d lines' % (self.queries,
+            self.errors, self.lines), '', 'Latency (ms)', '============', '',
+            '%-40s %9s %8s %8s %8s %8s' % ('index', 'queries', 'p50', 'p95',
+                'p99', 'max')]
+        for name, histogram in sorted(self.histograms.iteritems(),
+                key=lambda item: -item[1].total):
+            lines.append('%-40s %9d %8.1f %8.1f %8.1f %8.1f' % (name,
+                histogram.count, histogram.percentile(0.5) * 1000,
+                histogram.percentile(0.95) * 1000,
+                histogram.percentile(0.99) * 1000, histogram.maximum * 1000))
+
+        lines.extend(['', 'Slowest query shapes', '====================', ''])
+        for shape in self.slowest(count):
+            lines.append('%8.1fs total%s, %d queries, %.1f ms max: %s' % (
+                shape.total, shape.error and ' (up to %.1fs too much)'
+                    % shape.error or '', shape.count, shape.maximum * 1000,
+                shape.shape))
+
+        if self.missing:
+            lines.extend(['', 'Filters on columns which are not attributes',
+                '===========================================', ''])
+            for (name, column), queries in sorted(self.missing.iteritems(),
+                    key=lambda item: -item[1]):
+                lines.append('%s.%s: %d queries (give the field select=1)' % (
+                    name, column, queries))
+        return '\n'.join(lines) + '\n'
+
+
+def index_attributes(blocks):
+    """Returns a :class:`dict` of the names of the indexes of a config (see
+    :func:`tryton_sphinx.scheduler.read_config`) and the set of the names of
+    their attributes and fields. A distributed index has the ones of its
+    local indexes.
+    """
+    sources = dict((block.name, block) for block in blocks
+        if block.section == 'source')
+    result, distributed = {}, {}
+    for block in blocks:
+        if block.section != 'index':
+            continue
+        if block.get('type') == 'distributed':
+            distributed[block.name] = block.options.get('local', [])
+            continue
+        names = set()
+        options = block.options
+        if block.get('source') in sources:
+            options = sources[block.get('source')].options
+        for option, values in options.iteritems():
+            if option == 'sql_attr_multi':
+                # uint <name> from ranged-query; ...
+                names.update(value.split()[1].lower() for value in values
+                    if len(value.split()) > 1)
+            elif option.startswith(('sql_attr_', 'rt_attr_', 'rt_field',
+                    'sql_field_')):
+                names.update(value.split(':')[0].strip().lower()
+                    for value in values)
+            elif option == 'sql_query':
+                # The full text fields are the columns of the query
+                names.update(name.lower() for name in re.findall(
+                    r'\bAS\s+"?(\w+)"?', values[0], re.I))
+        result[block.name] = names
+    for name, locals in distributed.iteritems():
+        result[name] = set().union(*[result.get(local, set())
+            for local in locals])
+    return result
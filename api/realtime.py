@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+    realtime
+
+    Real-time (RT) indexes fed by a change-capture queue.
+
+    Triggers on the table of every indexed model record the ids of the
+    created, written and deleted records in a queue table. A worker drains
+    that queue in batches and pushes the changes to searchd over SphinxQL
+    with one `REPLACE INTO` and one `DELETE` statement per index and batch.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import time
+import calendar
+from datetime import datetime, date
+from decimal import Decimal
+
+from trytond.model import ModelSQL
+from trytond.config import CONFIG
+
+from utils import get_attributes
+from catalog import CatalogModel
+import renderer
+
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
+
+
+#: Name of the table in which the triggers queue the changed records
+QUEUE_TABLE = 'sphinx_rt_queue'
+
+#: Maps the sphinx attribute types returned by
+#: :func:`tryton_sphinx.utils.guess_type` to the RT index declarations.
+#: Strings are declared as a full text field and a string attribute so that
+#: they behave like `sql_field_string`.
+RT_TYPES = {
+    'sql_attr_bigint': ['rt_attr_bigint'],
+    'sql_attr_uint': ['rt_attr_uint'],
+    'sql_attr_bool': ['rt_attr_uint'],
+    'sql_attr_timestamp': ['rt_attr_timestamp'],
+    'sql_attr_float': ['rt_attr_float'],
+    'sql_field_string': ['rt_field', 'rt_attr_string'],
+    }
+
+
+class RealtimeIndex(object):
+    """This class represents a `sphinx real-time index
+    <http://sphinxsearch.com/docs/2.0.1/rt-indexes.html>`_ for a model.
+
+    The possible arguments are:
+
+    `name`: Name of the index (needs to be unique)
+    `table`: The table of the model whose records are indexed
+    `attributes`: A :class:`dict` of field names as keys and type as values
+                  eg {'name': 'sql_field_string'}
+    """
+
+    def __init__(self, name, table, attributes):
+        self.name = name
+        self.table = table
+        self.attributes = attributes
+
+    @classmethod
+    def from_model(cls, model_object, prefix=''):
+        """Creates and returns a new real-time index from a given model
+
+        :param model_object: The instance of a model as obtained from the
+                             `trytond.pool.Pool`
+        :param prefix: A prefix for the name of the index (eg. the database
+                       name when several databases share a config)
+        """
+        assert isinstance(model_object, (ModelSQL, CatalogModel)), \
+            "model_object must be an instance of ModelSQL"
+        return cls(
+            name = prefix + model_object._table,
+            table = model_object._table,
+            attributes = get_attributes(model_object),
+            )
+
+    @property
+    def columns(self):
+        """The names of the indexed columns in a stable order
+        """
+        return sorted(self.attributes.keys())
+
+    def declarations(self):
+        """Returns a list of `(rt_type, name)` tuples for the index block
+        """
+        result = []
+        for name in self.columns:
+            for rt_type in RT_TYPES[self.attributes[name]]:
+                result.append((rt_type, name))
+        return result
+
+    def convert(self, name, value):
+        """Converts a value read from the database to a value that SphinxQL
+        accepts for the given column
+        """
+        attr_type = self.attributes[name]
+        if attr_type == 'sql_field_string':
+            if value is None:
+                return ''
+            if isinstance(value, unicode):
+                return value.encode('utf-8')
+            return value
+        if value is None:
+            return 0
+        if attr_type == 'sql_attr_timestamp':
+            if isinstance(value, datetime):
+                return calendar.timegm(value.timetuple())
+            if isinstance(value, date):
+                return calendar.timegm(value.timetuple())
+        if attr_type == 'sql_attr_bool':
+            return int(bool(value))
+        if attr_type == 'sql_attr_float' or isinstance(value, Decimal):
+            return float(value)
+        return value
+
+    def as_string(self):
+        """Returns the string representation of the config as it has to appear
+        in the sphinx.conf
+        """
+        return renderer.render('realtime_index', index=self, config=CONFIG)
+
+    def write_to(self, file):
+        """Streams the config as it has to appear in the sphinx.conf into the
+        given file
+        """
+        renderer.stream(file, 'realtime_index', index=self, config=CONFIG)
+
+
+def schema_sql(tables):
+    """Returns the SQL statements (as a string) which create the queue table
+    and the triggers which fill it for the given tables.
+
+    The statements are meant to be run once by the operator (e.g. with
+    `psql`) before the worker is started.
+
+    :param tables: An iterable of table names which have a real-time index
+    """
+    statements = [
+        'CREATE TABLE IF NOT EXISTS "%s" ('
+            '"id" BIGSERIAL PRIMARY KEY, '
+            '"table_name" VARCHAR(255) NOT NULL, '
+            '"record_id" BIGINT NOT NULL, '
+            '"operation" CHAR(1) NOT NULL)' % QUEUE_TABLE,
+        'CREATE OR REPLACE FUNCTION "%s_log"() RETURNS trigger AS $$ '
+            'BEGIN '
+            'IF TG_OP = \'DELETE\' THEN '
+            'INSERT INTO "%s" ("table_name", "record_id", "operation") '
+            'VALUES (TG_TABLE_NAME, OLD."id", \'D\'); '
+            'RETURN OLD; '
+            'END IF; '
+            'INSERT INTO "%s" ("table_name", "record_id", "operation") '
+            'VALUES (TG_TABLE_NAME, NEW."id", \'U\'); '
+            'RETURN NEW; '
+            'END; $$ LANGUAGE plpgsql' % (
+                QUEUE_TABLE, QUEUE_TABLE, QUEUE_TABLE),
+        ]
+    for table in sorted(tables):
+        statements.extend([
+            'DROP TRIGGER IF EXISTS "%s" ON "%s"' % (QUEUE_TABLE, table),
+            'CREATE TRIGGER "%s" AFTER INSERT OR UPDATE OR DELETE ON "%s" '
+                'FOR EACH ROW EXECUTE PROCEDURE "%s_log"()' % (
+                    QUEUE_TABLE, table, QUEUE_TABLE),
+            ])
+    return ';\n'.join(statements) + ';\n'
+
+
+def populate_sql(table):
+    """Returns the SQL statement which queues every record of the table, to
+    fill an empty real-time index
+    """
+    return 'INSERT INTO "%s" ("table_name", "record_id", "operation") ' \
+        'SELECT \'%s\', "id", \'U\' FROM "%s"' % (QUEUE_TABLE, table, table)
+
+
+def connect(host='127.0.0.1', port=9306):
+    """Returns a new SphinxQL connection to searchd. Requires `MySQLdb`.
+    """
+    if MySQLdb is None:
+        raise ImportError("MySQLdb is required to talk to searchd over "
+            "SphinxQL")
+    return MySQLdb.connect(host=host, port=port, use_unicode=False)
+
+
+class RealtimeWorker(object):
+    """Drains the change-capture queue into the real-time indexes.
+
+    The possible arguments are:
+
+    `database_name`: The tryton database which holds the queue
+    `indexes`: A list of :class:`RealtimeIndex`
+    `connection`: A SphinxQL connection (see :func:`connect`)
+    `batch_size`: The maximum number of queued changes read from the queue,
+                  and hence pushed to searchd, at once (Default: 1000)
+    `flush_interval`: Seconds to wait for more changes once the queue has
+                      been drained (Default: 1.0)
+    """
+
+    def __init__(self, database_name, indexes, connection, batch_size=1000,
+            flush_interval=1.0):
+        self.database_name = database_name
+        self.indexes = dict((index.table, index) for index in indexes)
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def push(self, cursor, index, updated, deleted):
+        """Pushes the changes of one index to searchd. The records which
+        were queued as updated but which no longer exist are deleted.
+        """
+        sphinx_cursor = self.connection.cursor()
+        if updated:
+            columns = index.columns
+            cursor.execute(
+                'SELECT "id", %s FROM "%s" WHERE "id" IN %%s' % (
+                    ', '.join('"%s"' % name for name in columns), index.table),
+                (tuple(updated),))
+            rows = cursor.fetchall()
+            deleted = deleted | (updated - set(row[0] for row in rows))
+            if rows:
+                values = []
+                for row in rows:
+                    values.append(row[0])
+                    values.extend(index.convert(name, value)
+                        for name, value in zip(columns, row[1:]))
+                placeholders = '(%s)' % ', '.join(['%s'] * (len(columns) + 1))
+                sphinx_cursor.execute(
+                    'REPLACE INTO %s (id, %s) VALUES %s' % (
+                        index.name, ', '.join(columns),
+                        ', '.join([placeholders] * len(rows))),
+                    values)
+        if deleted:
+            sphinx_cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (
+                index.name, ', '.join(str(int(id)) for id in deleted)))
+        sphinx_cursor.close()
+
+    def drain_batch(self, cursor):
+        """Reads one batch of changes from the queue, pushes it to searchd
+        and removes it from the queue. Returns the number of changes read.
+        """
+        cursor.execute(
+            'SELECT "id", "table_name", "record_id", "operation" FROM "%s" '
+            'ORDER BY "id" LIMIT %%s' % QUEUE_TABLE, (self.batch_size,))
+        changes = cursor.fetchall()
+        if not changes:
+            return 0
+
+        # Only the last change of a record matters
+        last_operation = {}
+        for _, table, record_id, operation in changes:
+            last_operation[(table, record_id)] = operation
+
+        by_table = {}
+        for (table, record_id), operation in last_operation.iteritems():
+            updated, deleted = by_table.setdefault(table, (set(), set()))
+            if operation == 'D':
+                deleted.add(record_id)
+            else:
+                updated.add(record_id)
+
+        for table, (updated, deleted) in by_table.iteritems():
+            if table in self.indexes:
+                self.push(cursor, self.indexes[table], updated, deleted)
+
+        # Only the changes read: the ids of concurrent transactions commit
+        # out of order, a lower id may have been committed since the SELECT
+        cursor.execute('DELETE FROM "%s" WHERE "id" = ANY(%%s)' % QUEUE_TABLE,
+            ([change[0] for change in changes],))
+        cursor.commit()
+        return len(changes)
+
+    def run(self, forever=True):
+        """Drains the queue. Full batches are pushed back to back, and the
+        worker waits for :attr:`flush_interval` seconds whenever the queue
+        has less than a batch left. With `forever=False` the worker returns
+        once the queue is empty.
+        """
+        from trytond.transaction import Transaction
+
+        while True:
+            with Transaction().start(self.database_name, 0):
+                cursor = Transaction().cursor
+                while self.drain_batch(cursor) == self.batch_size:
+                    pass
+            if not forever:
+                return
+            time.sleep(self.flush_interval)
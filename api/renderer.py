@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+    renderer
+
+    Renders the sphinx config blocks. Every template is compiled once per
+    process and can be streamed chunk by chunk into the config file instead
+    of being rendered as a whole string.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+from jinja2 import Environment, DictLoader
+
+
+TEMPLATES = {
+    'base_source': """
+source {{name}}
+{
+    # data source type. mandatory, no default value
+    # known types are mysql, pgsql, mssql, xmlpipe, xmlpipe2, odbc
+    type        = {{type}}
+
+    sql_host    = {{sql_host}}
+    sql_user    = {{sql_user}}
+    sql_pass    = {{sql_pass}}
+    sql_db      = {{sql_db}}
+    sql_port    = {{sql_port}}
+
+    }
+        """,
+
+    # TODO: Morphology
+    # TODO: An indexer for each language ???
+    'data_source': """
+source {{cls.name}}
+{
+    {% for query in cls.sql_query_pre %}
+    sql_query_pre       = {{query}}
+    {% endfor %}
+
+    sql_query           = {{cls.sql_query}}
+
+    {% if cls.sql_query_range %}
+    sql_query_range     = {{cls.sql_query_range}}
+    sql_range_step      = {{cls.sql_range_step}}
+    {% endif %}
+
+    {% if cls.sql_query_killlist %}
+    sql_query_killlist  = {{cls.sql_query_killlist}}
+    {% endif %}
+
+    {% for attr_name, attr_type in cls.attributes.iteritems() %}
+    {% if attr_name in cls.lookups %}
+    # {{attr_name}}: {% for value, ordinal in cls.lookups[attr_name] %}{{value}}={{ordinal}}{% if not loop.last %}, {% endif %}{% endfor %}
+    {% endif %}
+    {{attr_type}}       = {{attr_name}}{% if cls.bits.get(attr_name, 32) < 32 %}:{{cls.bits[attr_name]}}{% endif %}
+    {% endfor %}
+
+    {% for attr_name, queries in cls.multi_attributes.iteritems() %}
+    sql_attr_multi      = uint {{attr_name}} from ranged-query; {{queries[0]}}; {{queries[1]}}
+    {% endfor %}
+    }
+
+{% set name_without_parent = cls.index_name %}
+
+index {{name_without_parent}}
+{
+    source              = {{name_without_parent}}
+    path                = {{config.options['data_path']}}/sphinx/{{name_without_parent}}
+    charset_type        = utf-8
+    {% for option, value in cls.index_options %}
+    {{option}}          = {{value}}
+    {% endfor %}
+    }
+        """,
+
+    'distributed_index': """
+index {{index.name}}
+{
+    type                = distributed
+    {% for local in index.locals %}
+    local               = {{local}}
+    {% endfor %}
+    {% for agent in index.agents %}
+    agent               = {{agent}}
+    {% endfor %}
+    {% for option, value in index.options %}
+    {{option}}          = {{value}}
+    {% endfor %}
+    }
+        """,
+
+    'realtime_index': """
+index {{index.name}}
+{
+    type                = rt
+    path                = {{config.options['data_path']}}/sphinx/{{index.name}}
+    charset_type        = utf-8
+
+    {% for rt_type, name in index.declarations() %}
+    {{rt_type}}         = {{name}}
+    {% endfor %}
+    }
+        """,
+
+    'xmlpipe_source': """
+source {{source.name}}
+{
+    type                = xmlpipe2
+    xmlpipe_command     = {{source.command}}
+    }
+
+index {{source.name}}
+{
+    source              = {{source.name}}
+    path                = {{config.options['data_path']}}/sphinx/{{source.name}}
+    charset_type        = utf-8
+    }
+        """,
+    }
+
+#: The environment shared by all the renderers. The templates never change
+#: at runtime so they are compiled on first use and then kept for the
+#: lifetime of the process.
+environment = Environment(
+    loader=DictLoader(TEMPLATES), cache_size=-1, auto_reload=False)
+
+
+def get_template(template_name):
+    """Returns the compiled template with the given name
+    """
+    return environment.get_template(template_name)
+
+
+def render(template_name, **context):
+    """Renders the template with the given name as a string
+    """
+    return get_template(template_name).render(**context)
+
+
+def stream(file, template_name, **context):
+    """Renders the template with the given name straight into the file, one
+    chunk at a time, without building the whole string in memory
+
+    :param file: A file like object opened in binary mode
+    :param template_name: The name of the template in :data:`TEMPLATES`
+    """
+    for chunk in get_template(template_name).generate(**context):
+        file.write(chunk.encode('utf-8'))
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+    scheduler
+
+    Builds the indexes of a generated sphinx config with several `indexer`
+    processes at once, largest (or most changed) indexes first, within a
+    global I/O budget, and rotates every index as soon as it is built.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import sys
+import glob
+import time
+import tempfile
+import subprocess
+from datetime import datetime
+
+from planner import format_size, parse_size, MIN_MEM_LIMIT
+from metrics import parse_indexer_output
+
+_BLOCK = re.compile(r'^(source|index|indexer|searchd|common)\b\s*'
+    r'([^:{\s]*)\s*(?::\s*([^{\s]+))?\s*\{?\s*$')
+_OPTION = re.compile(r'^(\w+)\s*=\s*(.*)$')
+_TABLE = re.compile(r'\bFROM\s+"?(\w+)"?', re.I)
+
+
+class ConfigBlock(object):
+    """A block of a sphinx config.
+
+    `section`: `source`, `index`, `indexer`, `searchd` or `common`
+    `name`: The name of the source or index (empty for the other sections)
+    `parent`: The name of the block it inherits from (or None)
+    `options`: A :class:`dict` of the options and the list of their values
+    """
+
+    def __init__(self, section, name, parent):
+        self.section = section
+        self.name = name
+        self.parent = parent
+        self.options = {}
+
+    def get(self, option, default=None):
+        values = self.options.get(option)
+        return values[0] if values else default
+
+
+def read_config(filename):
+    """Returns the list of the :class:`ConfigBlock` of a sphinx config,
+    with the options they inherit from their parents
+    """
+    blocks, block = [], None
+    with open(filename) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = _BLOCK.match(line)
+            if block is None and match:
+                block = ConfigBlock(*match.groups())
+                if not line.endswith('{'):
+                    continue
+                line = '{'
+            if block is None or line == '{':
+                continue
+            if line == '}':
+                blocks.append(block)
+                block = None
+                continue
+            match = _OPTION.match(line)
+            if match:
+                block.options.setdefault(match.group(1), []).append(
+                    match.group(2).strip())
+
+    by_name = dict(((block.section, block.name), block) for block in blocks)
+    for block in blocks:
+        parent = by_name.get((block.section, block.parent))
+        while parent is not None:
+            for option, values in parent.options.iteritems():
+                block.options.setdefault(option, values)
+            parent = by_name.get((parent.section, parent.parent))
+    return blocks
+
+
+class IndexJob(object):
+    """An index to build.
+
+    `name`: The name of the index
+    `path`: The path of its files
+    `database`: The database of its source
+    `table`: The table its source reads from (None if unknown)
+    `size`: The size in bytes of its files, None if it was never built
+    `changes`: The number of rows created or written since it was built
+    `result`: The :class:`tryton_sphinx.metrics.IndexerResult` of its
+              build, once built
+    """
+
+    def __init__(self, name, path, database, table):
+        self.name = name
+        self.path = path
+        self.database = database
+        self.table = table
+        self.size = index_size(path)
+        self.changes = None
+        self.result = None
+
+    @property
+    def built(self):
+        """The time the index was last built (None if it never was)
+        """
+        try:
+            return os.stat(self.path + '.sph').st_mtime
+        except OSError:
+            return None
+
+
+def index_size(path):
+    """Returns the size in bytes of the files of the index, None if it was
+    never built
+    """
+    files = glob.glob(path + '.sp?')
+    if not files:
+        return None
+    return sum(os.path.getsize(name) for name in files)
+
+
+def index_jobs(blocks):
+    """Returns an :class:`IndexJob` per index of the config which is built
+    by the indexer (ie. not the distributed and real-time indexes)
+    """
+    sources = dict((block.name, block) for block in blocks
+        if block.section == 'source')
+    jobs = []
+    for block in blocks:
+        if block.section != 'index' or block.get('type', 'plain') != 'plain':
+            continue
+        source = sources.get(block.get('source'))
+        if source is None:
+            continue
+        match = _TABLE.search(source.get('sql_query', ''))
+        jobs.append(IndexJob(block.name, block.get('path'),
+            source.get('sql_db'), match and match.group(1)))
+    return jobs
+
+
+def count_changes(jobs):
+    """Sets the number of rows of the table of every job created or written
+    since its index was last built (all the rows if it never was)
+    """
+    from trytond.transaction import Transaction
+
+    databases = {}
+    for job in jobs:
+        if job.table is not None:
+            databases.setdefault(job.database, []).append(job)
+
+    for database_name, database_jobs in databases.iteritems():
+        with Transaction().start(database_name, 0):
+            cursor = Transaction().cursor
+            for job in database_jobs:
+                cursor.execute("SELECT column_name "
+                    "FROM information_schema.columns "
+                    "WHERE table_name = %s AND column_name IN "
+                    "('create_date', 'write_date')", (job.table,))
+                columns = [row[0] for row in cursor.fetchall()]
+                query = 'SELECT COUNT(*) FROM "%s"' % job.table
+                built = job.built
+                if built is not None and columns:
+                    since = datetime.fromtimestamp(built)
+                    query += ' WHERE ' + ' OR '.join(
+                        '"%s" >= %%s' % column for column in columns)
+                    cursor.execute(query, [since] * len(columns))
+                else:
+                    cursor.execute(query)
+                job.changes = cursor.fetchone()[0]
+
+
+def order_jobs(jobs, order='size'):
+    """Returns the jobs in the order they should be started: the largest
+    indexes first (`size`) so that the longest builds do not end up alone
+    at the end, or the most changed first (`changes`). Indexes which were
+    never built come first as their size is unknown.
+    """
+    if order == 'changes':
+        key = lambda job: (-(job.changes or 0), job.name)
+    elif order == 'size':
+        key = lambda job: (job.size is not None, -(job.size or 0), job.name)
+    else:
+        key = lambda job: job.name
+    return sorted(jobs, key=key)
+
+
+def budget_config(text, jobs, max_iops=None, max_iosize=None):
+    """Returns the text of the config with the `indexer` section limited so
+    that `jobs` indexers running at once share `max_iops` I/O calls per
+    second, and the `mem_limit` of the config.
+    """
+    match = re.search(r'^indexer\s*\n\s*\{\s*\n(.*?)^\s*\}', text,
+        re.M | re.S)
+    if match is None:
+        return text
+    section = match.group(1)
+
+    values = {}
+    mem_limit = re.search(r'^\s*mem_limit\s*=\s*(\S+)', section, re.M)
+    mem_limit = parse_size(mem_limit.group(1)) if mem_limit \
+        else MIN_MEM_LIMIT
+    values['mem_limit'] = format_size(max(MIN_MEM_LIMIT, mem_limit // jobs))
+    if max_iops:
+        values['max_iops'] = str(max(1, max_iops // jobs))
+    if max_iosize:
+        values['max_iosize'] = str(max_iosize)
+
+    for option in values:
+        section = re.sub(r'^\s*%s\s*=.*\n' % option, '', section,
+            flags=re.M)
+    section = ''.join('\t%s\t\t= %s\n' % (option, value)
+        for option, value in sorted(values.iteritems())) + section
+    return text[:match.start(1)] + section + text[match.end(1):]
+
+
+def run_jobs(jobs, filename, concurrency, rotate=True, indexer='indexer',
+        output=sys.stdout):
+    """Runs up to `concurrency` indexers at once, one per job, and returns
+    the list of `(job, returncode, seconds)` in the order they finished.
+    The totals the indexer printed are set as the `result` of the job, and
+    the output of a failed indexer is written to `output`.
+
+    :param filename: The sphinx config to build with
+    :param rotate: Rotate every index as soon as it is built
+    """
+    pending, running, results = list(jobs), [], []
+    while pending or running:
+        while pending and len(running) < concurrency:
+            job = pending.pop(0)
+            log = tempfile.TemporaryFile()
+            arguments = [indexer, '--config', filename, job.name]
+            if rotate:
+                arguments.append('--rotate')
+            process = subprocess.Popen(arguments, stdout=log,
+                stderr=subprocess.STDOUT)
+            running.append((process, job, log, time.time()))
+
+        time.sleep(0.1)
+        for item in list(running):
+            process, job, log, start = item
+            if process.poll() is None:
+                continue
+            running.remove(item)
+            elapsed = time.time() - start
+            results.append((job, process.returncode, elapsed))
+            output.write('%-40s %s %8.1fs\n' % (job.name,
+                'ok    ' if process.returncode == 0 else 'FAILED',
+                elapsed))
+            log.seek(0)
+            text = log.read()
+            log.close()
+            job.result = parse_indexer_output(text).get(job.name)
+            if process.returncode != 0:
+                output.write(text)
+    return results
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+    search
+
+    A mixin which answers the `ilike` clauses of `ModelSQL.search` on the
+    full text fields of a model from its sphinx indexes instead of a
+    sequential scan of the table, when its indexes can find every record
+    the `ilike` finds (the `substring` profile and a delta index, see
+    :meth:`tryton_sphinx.client.IndexRegistry.substring_indexes`):
+
+        class Template(SphinxSearchMixin, ModelSQL, ModelView):
+            _name = 'product.template'
+
+    and once, when the server starts:
+
+        from tryton_sphinx.client import Client, ConnectionPool
+        from tryton_sphinx.search import set_client
+        set_client(Client(ConnectionPool('127.0.0.1', 9306), registry))
+
+    The mixin also returns pages of ranked results for the list views (see
+    :meth:`SphinxSearchMixin.sphinx_search_read`).
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import logging
+
+from utils import get_attributes
+from hydrate import hydrate, select_columns
+from delta import changed_since_delta_query
+
+_CLIENT = None
+
+
+def set_client(client):
+    """Sets the :class:`tryton_sphinx.client.Client` the models search
+    with. Searches go to PostgreSQL as long as no client is set.
+    """
+    global _CLIENT
+    _CLIENT = client
+
+
+def get_client():
+    """Returns the client set with :func:`set_client` (or None)
+    """
+    return _CLIENT
+
+
+def text_fields(model_object, registry=None):
+    """Returns the names of the fields of the model which are indexed as
+    full text fields by :meth:`tryton_sphinx.DataSource.from_model`
+
+    :param registry: The :class:`tryton_sphinx.client.IndexRegistry` of the
+                     indexes, to leave out the selections its indexes
+                     compacted to ordinals
+    """
+    ordinals = registry.ordinal_fields(model_object._table) \
+        if registry is not None else set()
+    return set(name for name, type_ in
+        get_attributes(model_object).iteritems()
+        if type_ == 'sql_field_string' and name not in ordinals)
+
+
+def match_text(value):
+    """Returns the words to match for an `ilike` pattern, or None if the
+    pattern can not be answered by sphinx: it must be a string with `%`
+    wildcards only around the words (eg. `%foo bar%`).
+    """
+    if not isinstance(value, basestring):
+        return None
+    text = value.strip('%')
+    if not text.strip() or '%' in text or '_' in text or '\\' in text:
+        return None
+    return text
+
+
+def substring_words(text, length):
+    """Returns the words of the text sphinx has to find as infixes, or None
+    if a word is shorter than `length` (the `min_infix_len` of the index)
+    or the text is not ASCII, as the `ilike` of the database could then
+    find records sphinx does not.
+    """
+    if any(ord(char) > 127 for char in text):
+        return None
+    words = re.findall(r'[a-z0-9]+', text.lower())
+    if not words or any(len(word) < length for word in words):
+        return None
+    return words
+
+
+def domain_text(domain, fields):
+    """Returns the text sphinx has to match for the `ilike` clauses of the
+    domain on the full text fields, or None if there is none. Only the top
+    level clauses of a domain which is not an `OR` are considered, as the
+    ids matched by sphinx restrict the whole domain.
+
+    :param domain: A tryton domain
+    :param fields: The names of the full text fields of the model
+    """
+    if domain and domain[0] == 'OR':
+        return None
+    words = []
+    for clause in domain:
+        if not isinstance(clause, (list, tuple)) or len(clause) != 3:
+            continue
+        name, operator, value = clause
+        if name not in fields or operator != 'ilike':
+            continue
+        text = match_text(value)
+        if text is not None:
+            words.append(text)
+    if not words:
+        return None
+    return ' '.join(words)
+
+
+class SphinxSearchMixin(object):
+    """Overrides `search` to restrict the records to the ids sphinx matches
+    for the `ilike` clauses on the full text fields of the model.
+
+    Sphinx only answers for the tables whose indexes find every infix of
+    at least `min_infix_len` characters and are kept fresh by a delta
+    index (see
+    :meth:`tryton_sphinx.client.IndexRegistry.substring_indexes`). The
+    records created or written since the last delta build are added to the
+    ids it matches, and the clauses are kept in the domain, so the result
+    is the one PostgreSQL would return on its own. The search falls back to
+    PostgreSQL alone for any other table, for words shorter than
+    `min_infix_len`, when searchd can not be reached, when it matches
+    nothing, or when more than `_sphinx_max_matches` records match.
+    """
+    #: The maximum number of ids restricting the domain
+    _sphinx_max_matches = 1000
+
+    def _sphinx_ids(self, text):
+        """Returns the ids sphinx matches for the text, with the ids of the
+        records changed since the last delta build, or None if the search
+        has to fall back to PostgreSQL
+        """
+        from trytond.transaction import Transaction
+
+        client = get_client()
+        if client is None or client.registry is None:
+            return None
+        indexes = client.registry.substring_indexes(self._table)
+        if indexes is None:
+            return None
+        length, main_indexes = indexes
+        words = substring_words(text, length)
+        if words is None:
+            return None
+        try:
+            rows = client.search(self._table,
+                raw_text=' '.join('*%s*' % word for word in words),
+                limit=self._sphinx_max_matches + 1,
+                max_matches=self._sphinx_max_matches + 1)
+        except Exception:
+            logging.getLogger('tryton_sphinx').warning(
+                'Sphinx search of %s failed, searching in the database'
+                % self._table, exc_info=True)
+            return None
+        if not rows or len(rows) > self._sphinx_max_matches:
+            return None
+
+        ids = set(row['id'] for row in rows)
+        cursor = Transaction().cursor
+        for index_name in main_indexes:
+            cursor.execute('%s LIMIT %d' % (
+                changed_since_delta_query(self._table, index_name),
+                self._sphinx_max_matches + 1))
+            ids.update(row[0] for row in cursor.fetchall())
+            if len(ids) > self._sphinx_max_matches:
+                return None
+        return sorted(ids)
+
+    def search(self, domain, offset=0, limit=None, order=None, count=False,
+            **kwargs):
+        client = get_client()
+        text = domain_text(domain, text_fields(self,
+            client and client.registry))
+        if text is not None:
+            ids = self._sphinx_ids(text)
+            if ids is not None:
+                domain = [domain, ('id', 'in', ids)]
+        return super(SphinxSearchMixin, self).search(domain, offset=offset,
+            limit=limit, order=order, count=count, **kwargs)
+
+    def sphinx_search_read(self, text, fields_names, offset=0, limit=20,
+            filters=None):
+        """Returns a page of the records matching the text, the best ranked
+        first, as the :class:`dict` `read` returns. The fields stored in the
+        indexes (`_sphinx_stored`) come from the matches, the others are
+        read for the whole page at once (see :mod:`tryton_sphinx.hydrate`).
+
+        The access rights of the user are checked as `read` checks them, and
+        the matches are restricted in a single query of their ids to the
+        records the record rules let the user read, which also leaves out
+        the records deleted (or made inactive) since they were indexed, so
+        a page may hold less than `limit` records.
+
+        When searchd can not be reached the records are searched in the
+        database, with an `ilike` on the full text fields, in the default
+        order.
+
+        :param filters: A :class:`dict` of attribute names and values (see
+                        :meth:`tryton_sphinx.client.Client.search_query`)
+        """
+        self.pool.get('ir.model.access').check(self._name, 'read')
+        self.pool.get('ir.model.field.access').check(self._name,
+            fields_names, 'read')
+
+        client = get_client()
+        if client is not None:
+            columns = client.registry.stored_columns(self._table) \
+                if client.registry else {}
+            try:
+                rows = client.search(self._table, text,
+                    columns=select_columns(columns, fields_names),
+                    filters=filters, offset=offset, limit=limit)
+            except Exception:
+                logging.getLogger('tryton_sphinx').warning(
+                    'Sphinx search of %s failed, searching in the database'
+                    % self._table, exc_info=True)
+            else:
+                if rows:
+                    readable = set(self.search([('id', 'in',
+                        [int(row['id']) for row in rows])]))
+                    rows = [row for row in rows
+                        if int(row['id']) in readable]
+                return hydrate(self, rows, fields_names, columns)
+
+        fields = sorted(text_fields(self, client and client.registry))
+        if not fields:
+            return []
+        domain = [['OR'] + [(name, 'ilike', '%' + text + '%')
+            for name in fields]]
+        for name, value in sorted((filters or {}).iteritems()):
+            domain.append((name, 'in' if isinstance(value, (list, tuple))
+                else '=', value))
+        ids = self.search(domain, offset=offset, limit=limit)
+        return hydrate(self, [{'id': id} for id in ids], fields_names, {})
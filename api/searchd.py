@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+    searchd
+
+    Sizes the settings of the `searchd` block after the host it runs on
+    (its number of CPUs and its memory) and the indexes it serves, and
+    writes every chosen value with a comment explaining it. Any value can
+    be overridden.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+
+from planner import format_size
+
+#: Concurrent searches per CPU: a search waits on the disk part of the time
+SEARCHES_PER_CPU = 4
+
+#: Bounds of `max_children`
+MIN_CHILDREN = 4
+MAX_CHILDREN = 256
+
+#: The share of the memory left by the indexes the per-search buffers and
+#: caches of all the concurrent searches may use
+BUFFER_SHARE = 0.05
+
+#: The keywords a search is expected to read at once
+KEYWORDS_PER_SEARCH = 32
+
+#: Bounds of `read_buffer` (the default is 256K)
+MIN_READ_BUFFER = 64 * 1024
+MAX_READ_BUFFER = 1024 * 1024
+
+#: The subtree caches are enabled at these sizes, halved as long as they do
+#: not fit
+SUBTREE_DOCS_CACHE = 4 * 1024 * 1024
+SUBTREE_HITS_CACHE = 8 * 1024 * 1024
+MIN_SUBTREE_CACHE = 256 * 1024
+
+#: Bounds of `max_packet_size`
+MIN_PACKET_SIZE = 8 * 1024 * 1024
+MAX_PACKET_SIZE = 128 * 1024 * 1024
+
+#: The bytes a string attribute is expected to take in a result set
+STRING_WIDTH = 256
+
+#: The settings of the `searchd` block of the generated config
+MAX_MATCHES = 1000
+MAX_BATCH_QUERIES = 32
+
+
+class Setting(object):
+    """A value of the searchd block and why.
+
+    `option`: The name of the option
+    `value`: Its value, as written in the config
+    `reason`: The sentence explaining it
+    """
+
+    def __init__(self, option, value, reason):
+        self.option = option
+        self.value = value
+        self.reason = reason
+
+
+def result_row_width(sources):
+    """Returns the widest row in bytes a result set of the data sources can
+    have: the id, the weight and the attributes
+    """
+    widest = 0
+    for source in sources:
+        attributes = getattr(source, 'attributes', None) or {}
+        width = 12 + sum(
+            STRING_WIDTH if attr_type in ('sql_field_string',
+                'sql_attr_string') else
+            8 if attr_type == 'sql_attr_bigint' else 4
+            for attr_type in attributes.itervalues())
+        widest = max(widest, width)
+    return widest
+
+
+def plan_searchd(cpus, memory, index_memory=0, indexes=0, locals=0,
+        row_width=0, max_matches=MAX_MATCHES):
+    """Returns the list of :class:`Setting` of a searchd host.
+
+    :param cpus: The number of CPUs of the host
+    :param memory: The memory of the host in bytes
+    :param index_memory: The memory the indexes keep in RAM (attributes and
+                         dictionaries), in bytes
+    :param indexes: The number of local indexes
+    :param locals: The largest number of local indexes of a distributed
+                   index (0 if there is none)
+    :param row_width: The widest row of a result set (see
+                      :func:`result_row_width`)
+    :param max_matches: The `max_matches` of searchd
+    """
+    settings = []
+
+    threads = min(locals, cpus) if locals else 0
+    if threads:
+        settings.append(Setting('dist_threads', str(threads),
+            'the largest distributed index has %d local indexes, searched '
+            'by at most one thread per each of the %d CPUs' % (
+                locals, cpus)))
+
+    children = max(MIN_CHILDREN, min(MAX_CHILDREN,
+        cpus * SEARCHES_PER_CPU // max(1, threads)))
+    settings.append(Setting('max_children', str(children),
+        '%d searches per each of the %d CPUs%s, between %d and %d' % (
+            SEARCHES_PER_CPU, cpus,
+            ', shared by the %d threads of a distributed search' % threads
+            if threads else '', MIN_CHILDREN, MAX_CHILDREN)))
+
+    free = max(0, memory - index_memory)
+    per_search = int(free * BUFFER_SHARE) // children
+    settings.append(Setting('read_buffer', format_size(max(MIN_READ_BUFFER,
+        min(MAX_READ_BUFFER, per_search // KEYWORDS_PER_SEARCH))),
+        '%d keywords of each of the %d searches share %d%% of the %s the '
+        '%d indexes leave of the %s of memory' % (KEYWORDS_PER_SEARCH,
+            children, BUFFER_SHARE * 100, format_size(free), indexes,
+            format_size(memory))))
+
+    docs_cache, hits_cache = SUBTREE_DOCS_CACHE, SUBTREE_HITS_CACHE
+    while docs_cache + hits_cache > per_search and \
+            docs_cache > MIN_SUBTREE_CACHE:
+        docs_cache, hits_cache = docs_cache // 2, hits_cache // 2
+    if docs_cache + hits_cache <= per_search:
+        reason = 'the subtree caches of every search fit in its %s share ' \
+            'of the buffers' % format_size(per_search)
+        settings.append(Setting('subtree_docs_cache',
+            format_size(docs_cache), reason))
+        settings.append(Setting('subtree_hits_cache',
+            format_size(hits_cache), reason))
+
+    if row_width:
+        packet = 2 * MAX_BATCH_QUERIES * max_matches * row_width
+        settings.append(Setting('max_packet_size', format_size(max(
+            MIN_PACKET_SIZE, min(MAX_PACKET_SIZE, packet))),
+            'twice a batch of %d queries of %d matches of up to %d bytes, '
+            'between %s and %s' % (MAX_BATCH_QUERIES, max_matches,
+                row_width, format_size(MIN_PACKET_SIZE),
+                format_size(MAX_PACKET_SIZE))))
+    return settings
+
+
+def override(settings, overrides):
+    """Returns the settings with the values given by the operator instead
+    of the computed ones
+
+    :param overrides: A list of `(option, value)` tuples
+    """
+    result = [setting for setting in settings
+        if setting.option not in dict(overrides)]
+    result.extend(Setting(option, value, 'set by the operator')
+        for option, value in overrides)
+    return result
+
+
+def apply_settings(text, settings):
+    """Returns the text of a searchd block with the settings written in
+    place of the values (or the commented out values) of their options,
+    with their reason as a comment. The options which are not in the text
+    are added at the end of the block.
+    """
+    for setting in settings:
+        line = '\t# %s\n\t%s\t\t= %s' % (setting.reason, setting.option,
+            setting.value)
+        pattern = re.compile(r'^\t(?:# ?)?%s\s*=.*$' % re.escape(
+            setting.option), re.M)
+        if pattern.search(text):
+            text = pattern.sub(lambda match: line, text, count=1)
+        else:
+            end = text.rindex('}')
+            text = text[:end] + '\n' + line + '\n' + text[end:]
+    return text
+
+
+def parse_overrides(values):
+    """Parses a list of `option=value` strings into `(option, value)`
+    tuples
+    """
+    overrides = []
+    for value in values:
+        option, separator, setting = value.partition('=')
+        if not separator or not option.strip():
+            raise ValueError("Expected option=value, got %s" % value)
+        overrides.append((option.strip(), setting.strip()))
+    return overrides
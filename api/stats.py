@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    stats
+
+    Reads the statistics of the tables of the models from the database
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+class TableStats(object):
+    """The statistics of a table.
+
+    `table`: The name of the table
+    `rows`: The estimated number of rows (from `pg_class.reltuples`)
+    `min_id`: The lowest id in the table (None if the table is empty)
+    `max_id`: The highest id in the table (None if the table is empty)
+    `widths`: A :class:`dict` of the average width in bytes of the columns
+              (from `pg_stats`, empty if the table was never analysed)
+    `id_bounds`: The bounds of the equal frequency histogram of the ids
+                 (from `pg_stats`, empty if unknown)
+    """
+
+    def __init__(self, table, rows, min_id, max_id, widths=None,
+            id_bounds=None):
+        self.table = table
+        self.rows = rows
+        self.min_id = min_id
+        self.max_id = max_id
+        self.widths = widths or {}
+        self.id_bounds = id_bounds or []
+
+    @property
+    def id_span(self):
+        """The number of ids between the lowest and the highest id
+        """
+        if self.min_id is None:
+            return 0
+        return self.max_id - self.min_id + 1
+
+    @property
+    def density(self):
+        """The ratio of the used ids between the lowest and the highest id
+        """
+        if not self.id_span:
+            return 0.0
+        return min(1.0, float(self.rows) / self.id_span)
+
+    def row_width(self, columns):
+        """The average width in bytes of a row made of the id and the given
+        columns. Columns without statistics count for 8 bytes.
+        """
+        return sum(self.widths.get(column, 8) for column in ['id'] + list(
+            columns))
+
+
+def table_stats(cursor, table):
+    """Returns the :class:`TableStats` of the table.
+
+    The number of rows is the estimate PostgreSQL keeps in `pg_class`, which
+    is free to read. If the table was never analysed the id span is used
+    instead.
+
+    :param cursor: A cursor on the tryton database
+    :param table: The name of the table
+    """
+    cursor.execute('SELECT MIN("id"), MAX("id") FROM "%s"' % table)
+    min_id, max_id = cursor.fetchone()
+
+    cursor.execute("SELECT reltuples FROM pg_class "
+        "WHERE relname = %s AND relkind = 'r'", (table,))
+    row = cursor.fetchone()
+    rows = int(row[0]) if row else 0
+
+    stats = TableStats(table, rows, min_id, max_id)
+    if stats.rows <= 0:
+        stats.rows = stats.id_span
+    return stats
+
+
+def column_stats(cursor, stats):
+    """Completes the :class:`TableStats` with the average width of the
+    columns and the histogram of the ids that PostgreSQL keeps in `pg_stats`
+    """
+    cursor.execute('SELECT attname, avg_width, histogram_bounds::text '
+        'FROM pg_stats WHERE tablename = %s', (stats.table,))
+    for name, width, bounds in cursor.fetchall():
+        stats.widths[name] = width
+        if name == 'id' and bounds:
+            stats.id_bounds = [int(bound) for bound in
+                bounds.strip('{}').split(',')]
+    return stats
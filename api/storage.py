@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+    storage
+
+    Chooses how searchd stores every index from its size and how often it
+    is searched, so that a few huge but rarely searched indexes do not take
+    the RAM of the hot ones:
+
+    * `docinfo = extern` keeps the attributes in RAM, `inline` leaves them
+      in the doclists on disk (sphinx refuses it for the indexes with string
+      or multi-valued attributes, which stay `extern`)
+    * `ondisk_dict = 1` leaves the dictionary on disk
+    * `preopen = 1` keeps the files open instead of opening them on every
+      search
+    * `mlock = 1` locks the attributes and the dictionary in RAM so that
+      they are never swapped out (searchd needs to run as root for it)
+
+    The memory of the indexes kept in RAM fits in the budget of the searchd
+    host. The number of searches of every index is counted from the query
+    log of searchd.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+
+from planner import format_size
+from attributes import attribute_memory
+from querylog import parse_line, open_log
+
+#: Share of the available memory of the host searchd may use for the
+#: attributes and dictionaries
+SEARCHD_MEMORY_SHARE = 0.5
+
+#: The indexes receiving this share of the searches are the hot ones
+HOT_SHARE = 0.8
+
+#: Share of the budget which may be locked in RAM
+MLOCK_SHARE = 0.5
+
+#: The dictionary of an index which was never built is estimated as this
+#: share of its text
+DICTIONARY_SHARE = 0.1
+
+#: The files of a built index holding what searchd keeps in RAM
+ATTRIBUTE_FILES = ('.spa', '.spm', '.sps')
+DICTIONARY_FILES = ('.spi',)
+
+#: The attribute types sphinx can not store inline
+EXTERN_TYPES = ('sql_attr_string', 'sql_field_string')
+
+
+def count_queries(lines):
+    """Returns a :class:`dict` of the names of the indexes and the number of
+    searches of the query log lines, in the plain or in the `sphinxql`
+    format. A search of several indexes counts for every one of them.
+    """
+    counts = {}
+    for line in lines:
+        query = parse_line(line)
+        if query is None:
+            continue
+        for name in query.indexes:
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def read_query_logs(filenames):
+    """Returns the number of searches of every index in the query logs
+    """
+    counts = {}
+    for filename in filenames:
+        with open_log(filename) as file:
+            for name, count in count_queries(file).iteritems():
+                counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def expand_counts(counts, distributed):
+    """Returns the counts with the searches of the distributed indexes added
+    to their local indexes
+
+    :param distributed: A :class:`dict` of the names of the distributed
+                        indexes and the list of their local indexes
+    """
+    result = dict(counts)
+    for name, locals in distributed.iteritems():
+        for local in locals:
+            result[local] = result.get(local, 0) + counts.get(name, 0)
+    return result
+
+
+class IndexSize(object):
+    """The memory searchd needs to keep an index in RAM.
+
+    `name`: The name of the index
+    `attributes`: The size in bytes of its attributes
+    `dictionary`: The size in bytes of its dictionary
+    `built`: True if the sizes are the ones of the files of the index, False
+             if they are estimated from the statistics of its table
+    `inline`: False if the index has string or multi-valued attributes, which
+              sphinx only keeps with `docinfo = extern`
+    """
+
+    def __init__(self, name, attributes, dictionary, built, inline=True):
+        self.name = name
+        self.attributes = attributes
+        self.dictionary = dictionary
+        self.built = built
+        self.inline = inline
+
+
+def index_path(name):
+    from trytond.config import CONFIG
+    return os.path.join(CONFIG['data_path'], 'sphinx', name)
+
+
+def measure_index(source, stats, share=1.0):
+    """Returns the :class:`IndexSize` of the index of a data source: the
+    size of its files if it was built, an estimate from the statistics of
+    its table otherwise.
+
+    :param stats: The :class:`tryton_sphinx.stats.TableStats` of its table
+    :param share: The share of the rows of the table the source indexes
+                  (for the shards)
+    """
+    path = index_path(source.index_name)
+    inline = not source.multi_attributes and not [attr_type
+        for attr_type in source.attributes.itervalues()
+        if attr_type in EXTERN_TYPES]
+
+    def files_size(extensions):
+        return sum(os.path.getsize(path + ext) for ext in extensions
+            if os.path.exists(path + ext))
+
+    if os.path.exists(path + '.sph'):
+        return IndexSize(source.index_name, files_size(ATTRIBUTE_FILES),
+            files_size(DICTIONARY_FILES), True, inline)
+
+    text = sum(stats.widths.get(name, 8) for name, attr_type in
+        source.attributes.iteritems() if attr_type == 'sql_field_string')
+    return IndexSize(source.index_name,
+        int(attribute_memory(source.attributes, source.bits, stats) * share),
+        int(stats.rows * text * DICTIONARY_SHARE * share), False, inline)
+
+
+class StoragePlan(object):
+    """The storage settings of an index and why.
+
+    `name`: The name of the index
+    `queries`: The number of searches of the index in the query log
+    `docinfo`: `extern` or `inline`
+    `ondisk_dict`: Leave the dictionary on disk
+    `preopen`: Keep the files of the index open
+    `mlock`: Lock the attributes and the dictionary in RAM
+    `memory`: The bytes of RAM the index needs with these settings
+    `reasons`: A list of sentences explaining the choice
+    """
+
+    def __init__(self, name, queries, docinfo, ondisk_dict, preopen, mlock,
+            memory, reasons):
+        self.name = name
+        self.queries = queries
+        self.docinfo = docinfo
+        self.ondisk_dict = ondisk_dict
+        self.preopen = preopen
+        self.mlock = mlock
+        self.memory = memory
+        self.reasons = reasons
+
+    @property
+    def options(self):
+        """The `(option, value)` tuples of the index block
+        """
+        return [
+            ('docinfo', self.docinfo),
+            ('ondisk_dict', str(int(self.ondisk_dict))),
+            ('preopen', str(int(self.preopen))),
+            ('mlock', str(int(self.mlock))),
+            ]
+
+
+def plan_storage(sizes, counts, budget):
+    """Returns the :class:`StoragePlan` of every index, the most searched
+    first. The indexes are given the RAM in that order: the attributes and
+    the dictionary of an index are kept in RAM if they fit in what is left
+    of the budget, else its attributes only, else nothing. The attributes
+    of an index with string or multi-valued attributes are always kept in
+    RAM, as sphinx can not store them inline. The hot indexes are locked in
+    RAM as long as they fit in a share of the budget, and the indexes which
+    are never searched are not opened in advance.
+
+    :param sizes: The list of :class:`IndexSize`
+    :param counts: The number of searches of every index (see
+                   :func:`count_queries`)
+    :param budget: The memory of searchd in bytes
+    """
+    ordered = sorted(sizes, key=lambda size: (-counts.get(size.name, 0),
+        size.attributes + size.dictionary, size.name))
+    total = sum(counts.get(size.name, 0) for size in sizes)
+    left, lockable, searched = budget, int(budget * MLOCK_SHARE), 0
+
+    plans = []
+    for size in ordered:
+        queries = counts.get(size.name, 0)
+        hot = queries and searched < total * HOT_SHARE
+        searched += queries
+        reasons = ['%d searches, %s of attributes and %s of dictionary%s' % (
+            queries, format_size(size.attributes),
+            format_size(size.dictionary),
+            '' if size.built else ' (estimated)')]
+
+        if not queries and size.inline:
+            reasons.append('never searched: nothing kept in RAM')
+            docinfo, ondisk_dict, memory = 'inline', True, 0
+        elif not queries:
+            reasons.append('never searched: the dictionary is left on disk, '
+                'the string or multi-valued attributes need docinfo = '
+                'extern')
+            docinfo, ondisk_dict, memory = 'extern', True, size.attributes
+        elif size.attributes + size.dictionary <= left:
+            docinfo, ondisk_dict = 'extern', False
+            memory = size.attributes + size.dictionary
+        elif size.attributes <= left:
+            reasons.append('the dictionary does not fit in the %s left' % (
+                format_size(max(left, 0))))
+            docinfo, ondisk_dict, memory = 'extern', True, size.attributes
+        elif size.inline:
+            reasons.append('the attributes do not fit in the %s left' % (
+                format_size(max(left, 0))))
+            docinfo, ondisk_dict, memory = 'inline', True, 0
+        else:
+            reasons.append('the attributes do not fit in the %s left, but '
+                'the string or multi-valued attributes need docinfo = '
+                'extern' % format_size(max(left, 0)))
+            docinfo, ondisk_dict, memory = 'extern', True, size.attributes
+        left -= memory
+
+        mlock = bool(hot and memory and memory <= lockable)
+        if mlock:
+            lockable -= memory
+            reasons.append('hot: locked in RAM')
+        elif hot and memory:
+            reasons.append('hot but larger than the %s left to lock' % (
+                format_size(lockable)))
+        plans.append(StoragePlan(size.name, queries, docinfo, ondisk_dict,
+            bool(queries), mlock, memory, reasons))
+    return plans
+
+
+def report(plans, budget):
+    """Returns the storage plans explained as a text report
+    """
+    lines = ['Storage', '=======', '']
+    for plan in plans:
+        lines.append('%s: docinfo = %s, ondisk_dict = %d, preopen = %d, '
+            'mlock = %d (%s in RAM)' % (plan.name, plan.docinfo,
+                plan.ondisk_dict, plan.preopen, plan.mlock,
+                format_size(plan.memory) if plan.memory else 'nothing'))
+        lines.extend('    - %s' % reason for reason in plan.reasons)
+    lines.extend(['', '%s of the budget of %s kept in RAM' % (
+        format_size(sum(plan.memory for plan in plans)),
+        format_size(budget))])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    testing
+
+    An in-process stand-in for the SphinxQL endpoint of searchd, to exercise
+    :mod:`tryton_sphinx.client` (and the code using it) without a running
+    searchd.
+
+    It understands the subset of SphinxQL the client generates: `SELECT`
+    with `MATCH()`, equality and `IN` filters, `ORDER BY`, `LIMIT` and
+    `OPTION`, several statements separated by `;`, and `SHOW META`.
+    Matching is a plain case insensitive test that every word of the query
+    appears in a string column of the document.
+
+        server = FakeSphinxQL()
+        server.add('product_template', 1, name='iPhone', active=1)
+        pool = ConnectionPool(connection_factory=server.connect)
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+
+_SELECT = re.compile(
+    r"^SELECT\s+(?P<columns>.+?)\s+FROM\s+(?P<indexes>[\w\s,]+?)"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?:(?P<offset>\d+)\s*,\s*)?(?P<limit>\d+))?"
+    r"(?:\s+OPTION\s+.+)?$", re.I | re.S)
+_MATCH = re.compile(r"^MATCH\('(?P<text>(?:[^'\\]|\\.)*)'\)$", re.I)
+_IN = re.compile(r"^(?P<name>\w+)\s+IN\s+\((?P<values>[^)]*)\)$", re.I)
+_EQUAL = re.compile(r"^(?P<name>\w+)\s*=\s*(?P<value>.+)$")
+
+
+def _split_statements(sql):
+    statements, current, quoted, escaped = [], [], False, False
+    for char in sql:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == "'":
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            statements.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if ''.join(current).strip():
+        statements.append(''.join(current).strip())
+    return statements
+
+
+def _literal(value):
+    value = value.strip()
+    if value.startswith("'"):
+        return value[1:-1].replace("\\'", "'").replace('\\\\', '\\')
+    if '.' in value:
+        return float(value)
+    return int(value)
+
+
+class FakeSphinxQL(object):
+    """Holds the documents of the fake indexes and the log of the queries
+    it received
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self.queries = []
+        self.round_trips = 0
+        self.down = False
+
+    def add(self, index, id, **values):
+        """Adds a document to an index
+        """
+        values['id'] = id
+        self.indexes.setdefault(index, {})[id] = values
+
+    def connect(self, host=None, port=None, timeout=None):
+        """A connection factory for
+        :class:`tryton_sphinx.client.ConnectionPool`
+        """
+        if self.down:
+            raise IOError("searchd is down")
+        return FakeConnection(self)
+
+    def _matches(self, document, text):
+        text = re.sub(r'\\(.)', r'\1', text)
+        words = [word.lower() for word in re.findall(r'\w+', text)]
+        content = ' '.join(value for value in document.values()
+            if isinstance(value, basestring)).lower()
+        return all(word in content for word in words)
+
+    def select(self, statement):
+        """Runs a SELECT statement and returns `(columns, rows)`
+        """
+        match = _SELECT.match(statement)
+        if match is None:
+            raise ValueError("Unsupported statement: %s" % statement)
+
+        documents = []
+        for index in match.group('indexes').split(','):
+            documents.extend(self.indexes.get(index.strip(), {}).values())
+
+        for condition in re.split(r'\s+AND\s+', match.group('where') or ''):
+            condition = condition.strip()
+            if not condition:
+                continue
+            if _MATCH.match(condition):
+                text = _MATCH.match(condition).group('text')
+                documents = [document for document in documents
+                    if self._matches(document, text)]
+            elif _IN.match(condition):
+                name = _IN.match(condition).group('name')
+                values = set(_literal(value) for value in
+                    _IN.match(condition).group('values').split(',')
+                    if value.strip())
+                documents = [document for document in documents
+                    if document.get(name) in values]
+            elif _EQUAL.match(condition):
+                name, value = _EQUAL.match(condition).group('name', 'value')
+                documents = [document for document in documents
+                    if document.get(name) == _literal(value)]
+            else:
+                raise ValueError("Unsupported condition: %s" % condition)
+
+        order = (match.group('order') or 'id ASC').split()
+        if order[0].lower() != 'weight()':
+            documents.sort(key=lambda document: document.get(order[0]),
+                reverse=len(order) > 1 and order[1].upper() == 'DESC')
+
+        offset = int(match.group('offset') or 0)
+        limit = int(match.group('limit') or 20)
+        documents = documents[offset:offset + limit]
+
+        columns = [column.strip() for column in
+            match.group('columns').split(',')]
+        if columns == ['*']:
+            columns = sorted(set(sum([document.keys()
+                for document in documents], ['id'])))
+        return columns, [tuple(document.get(column) for column in columns)
+            for document in documents]
+
+
+class FakeConnection(object):
+    """A DB-API like connection to a :class:`FakeSphinxQL`
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def literal(self, value):
+        if isinstance(value, basestring):
+            return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+        return str(value)
+
+    def ping(self):
+        if self.closed or self.server.down:
+            raise IOError("searchd went away")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+    """A DB-API like cursor on a :class:`FakeConnection`
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._results = []
+        self._rows = []
+
+    def execute(self, sql, args=None):
+        self.connection.ping()
+        server = self.connection.server
+        if args:
+            sql = sql % tuple(self.connection.literal(arg) for arg in args)
+        server.round_trips += 1
+        self._results = []
+        for statement in _split_statements(sql):
+            server.queries.append(statement)
+            if statement.upper().startswith('SHOW META'):
+                result = (['Variable_name', 'Value'], [])
+            else:
+                result = server.select(statement)
+            self._results.append(result)
+        self.nextset()
+
+    def nextset(self):
+        if not self._results:
+            self.description, self._rows = None, []
+            return None
+        columns, self._rows = self._results.pop(0)
+        self.description = [(column,) for column in columns]
+        return True
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+    tests
+
+    The tests of tryton_sphinx which need no database nor searchd.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from test_attributes import suite as attributes_suite
+from test_client import suite as client_suite
+from test_cluster import suite as cluster_suite
+from test_configuration import suite as configuration_suite
+from test_profiles import suite as profiles_suite
+from test_querylog import suite as querylog_suite
+from test_storage import suite as storage_suite
+from test_warmup import suite as warmup_suite
+
+
+def suite():
+    return unittest.TestSuite([attributes_suite(), client_suite(),
+        cluster_suite(), configuration_suite(), profiles_suite(),
+        querylog_suite(), storage_suite(), warmup_suite()])
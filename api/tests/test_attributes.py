@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    test_attributes
+
+    Tests the compact attributes of :mod:`tryton_sphinx.attributes` and the
+    checks failing the indexing once a value no longer fits.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from trytond.model import fields
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.attributes import compact_attribute, overflow_check
+
+
+class Party(object):
+    _table = 'party_party'
+
+
+class CompactAttributeTestCase(unittest.TestCase):
+
+    def compact(self, field, value_range):
+        return compact_attribute(Party(), 'sequence', field, value_range)
+
+    def source(self, attribute):
+        return DataSource('party_party', 'SELECT 1',
+            {'sequence': attribute.type}, table='party_party',
+            bits={'sequence': attribute.bits})
+
+    def test_bitfield(self):
+        "A small integer becomes a bitfield checked for overflow"
+        attribute = self.compact(fields.Integer('Sequence'), (0, 1000))
+        self.assertEqual((attribute.type, attribute.bits),
+            ('sql_attr_uint', 11))
+        source = self.source(attribute)
+        self.assertEqual(source.overflow_checks(),
+            [overflow_check('party_party', 'sequence', 11)])
+        self.assertTrue('sql_attr_uint       = sequence:11'
+            in source.as_string())
+
+    def test_full_width(self):
+        "An integer needing 32 bits is checked but not a bitfield"
+        attribute = self.compact(fields.Integer('Sequence'),
+            (0, 2 ** 30 + 1))
+        self.assertEqual((attribute.type, attribute.bits),
+            ('sql_attr_uint', 32))
+        source = self.source(attribute)
+        self.assertEqual(len(source.overflow_checks()), 1)
+        self.assertTrue('sql_attr_uint       = sequence\n'
+            in source.as_string())
+
+    def test_wide(self):
+        "An integer wider than 32 bits and a negative one stay bigint"
+        for value_range in ((0, 2 ** 32), (-1, 10)):
+            attribute = self.compact(fields.Integer('Sequence'), value_range)
+            self.assertTrue(attribute is None
+                or attribute.type == 'sql_attr_bigint')
+
+    def test_many2one(self):
+        "The ids are full width, unchecked"
+        attribute = self.compact(fields.Many2One('party.party', 'Parent'),
+            (1, 1000))
+        self.assertEqual((attribute.type, attribute.bits),
+            ('sql_attr_uint', None))
+
+    def test_overflow_check(self):
+        "The check fails on values too large and on negative values"
+        check = overflow_check('party_party', 'sequence', 11,
+            '"party_party"."id" >= 5')
+        self.assertTrue(check.endswith('WHERE ("party_party"."sequence" '
+            '>= 2048 OR "party_party"."sequence" < 0) AND '
+            '"party_party"."id" >= 5 LIMIT 1'))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(
+        CompactAttributeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+    test_client
+
+    Tests the connection pool, the batching, the registry and the cache of
+    :class:`tryton_sphinx.client.Client` against
+    :class:`tryton_sphinx.testing.FakeSphinxQL`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.client import Client, ConnectionPool, IndexRegistry
+from tryton_sphinx.cache import ResultCache
+from tryton_sphinx.testing import FakeSphinxQL
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSphinxQL()
+        self.pool = ConnectionPool(size=2, timeout=0.1,
+            connection_factory=self.server.connect)
+
+    def test_reuse(self):
+        "A released connection is handed out again"
+        connection = self.pool.acquire()
+        self.pool.release(connection)
+        self.assertTrue(self.pool.acquire() is connection)
+
+    def test_exhausted(self):
+        "The pool times out once all the connections are in use"
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.assertRaises(RuntimeError, self.pool.acquire)
+        self.pool.release(first)
+        self.assertTrue(self.pool.acquire() is first)
+        self.pool.release(second)
+
+    def test_broken_discarded(self):
+        "A connection which raised is closed instead of being reused"
+        try:
+            with self.pool.connection() as connection:
+                raise IOError("searchd went away")
+        except IOError:
+            pass
+        self.assertTrue(connection.closed)
+        self.assertTrue(self.pool.acquire() is not connection)
+        # The slot of the broken connection was given back
+        self.pool.acquire()
+        self.assertRaises(RuntimeError, self.pool.acquire)
+
+    def test_idle_checked(self):
+        "An idle connection searchd closed is replaced"
+        self.pool.idle_check = -1
+        connection = self.pool.acquire()
+        self.pool.release(connection)
+        connection.close()
+        self.assertTrue(self.pool.acquire() is not connection)
+
+    def test_down(self):
+        "A failed connect does not use up a slot"
+        self.server.down = True
+        self.assertRaises(IOError, self.pool.acquire)
+        self.assertRaises(IOError, self.pool.acquire)
+        self.assertRaises(IOError, self.pool.acquire)
+        self.server.down = False
+        self.pool.acquire()
+        self.pool.acquire()
+
+
+class SearchManyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSphinxQL()
+        for id, name in enumerate(['iPhone', 'iPad', 'iPod', 'Mac', 'Apple'
+                ' TV'], 1):
+            self.server.add('product_template', id, name=name, active=1)
+        self.client = Client(ConnectionPool(
+            connection_factory=self.server.connect), max_batch_queries=2)
+
+    def test_batches(self):
+        "The searches are sent max_batch_queries at a time"
+        words = ['iphone', 'ipad', 'ipod', 'mac', 'tv']
+        results = self.client.search_many([{'index': 'product_template',
+            'text': word} for word in words])
+        self.assertEqual(self.server.round_trips, 3)
+        self.assertEqual(len(self.server.queries), 5)
+        self.assertEqual([[row['id'] for row in rows] for rows in results],
+            [[1], [2], [3], [4], [5]])
+
+    def test_filters(self):
+        "Filters and limits are applied to every search of a batch"
+        results = self.client.search_many([
+            {'index': 'product_template', 'filters': {'id': [2, 4]}},
+            {'index': 'product_template', 'offset': 1, 'limit': 2},
+            ])
+        self.assertEqual(self.server.round_trips, 1)
+        self.assertEqual([[row['id'] for row in rows] for rows in results],
+            [[2, 4], [2, 3]])
+
+
+class IndexRegistryTestCase(unittest.TestCase):
+
+    def source(self, name, table, autocomplete=False):
+        return DataSource(name, 'SELECT 1', {}, table=table,
+            autocomplete=autocomplete)
+
+    def test_autocomplete(self):
+        "Only the flagged sources are autocomplete indexes"
+        registry = IndexRegistry.from_sources([
+            self.source('product_template : base', 'product_template'),
+            self.source('product_template_ac : base', 'product_template',
+                True),
+            self.source('stock_ac : base', 'stock_ac'),
+            ])
+        self.assertEqual(registry.indexes('product_template'),
+            ['product_template'])
+        self.assertEqual(registry.autocomplete_index('product_template'),
+            'product_template_ac')
+        self.assertEqual(registry.indexes('stock_ac'), ['stock_ac'])
+        self.assertEqual(registry.autocomplete_index('stock_ac'), None)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.data_path, 'sphinx'))
+        self.rotate()
+        self.server = FakeSphinxQL()
+        self.server.add('product_template', 1, name='iPhone')
+        self.cache = ResultCache(self.data_path, check_interval=0)
+        self.client = Client(ConnectionPool(
+            connection_factory=self.server.connect), cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def rotate(self, header='header'):
+        with open(os.path.join(self.data_path, 'sphinx',
+                'product_template.sph'), 'w') as file:
+            file.write(header)
+
+    def search(self):
+        return [row['id'] for row in
+            self.client.search('product_template', 'iphone')]
+
+    def test_hit(self):
+        "A search is only sent once"
+        self.assertEqual(self.search(), [1])
+        self.assertEqual(self.search(), [1])
+        self.assertEqual(self.server.round_trips, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_rotation(self):
+        "The results are dropped once the index was rotated"
+        self.search()
+        self.server.add('product_template', 2, name='iPhone case')
+        self.rotate('the header of the rotated index')
+        self.assertEqual(self.search(), [1, 2])
+        self.assertEqual(self.server.round_trips, 2)
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_invalidate(self):
+        "The results of an invalidated index are searched again"
+        self.search()
+        self.cache.invalidate('product_template')
+        self.search()
+        self.assertEqual(self.server.round_trips, 2)
+        self.search()
+        self.assertEqual(self.server.round_trips, 2)
+
+    def test_ttl(self):
+        "An expired result is searched again"
+        self.cache.ttl = -1
+        self.search()
+        self.search()
+        self.assertEqual(self.server.round_trips, 2)
+        self.assertEqual(self.cache.expirations, 1)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for test_case in (ConnectionPoolTestCase, SearchManyTestCase,
+            IndexRegistryTestCase, ResultCacheTestCase):
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(test_case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
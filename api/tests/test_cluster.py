@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    test_cluster
+
+    Tests the placement of the indexes on the nodes of a cluster by
+    :func:`tryton_sphinx.cluster.plan_cluster`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from tryton_sphinx import DataSource, DistributedIndex
+from tryton_sphinx.cluster import Cluster, Node, plan_cluster
+
+
+def source(name, table):
+    return DataSource(name, 'SELECT 1', {}, table=table)
+
+
+class PlanClusterTestCase(unittest.TestCase):
+
+    def placement(self, layout):
+        "Returns the names of the indexes of every node"
+        return dict((node.name, sorted(shard.index_name
+            for shard in sources)) for node, sources in layout.nodes)
+
+    def test_mirrors(self):
+        "Every index and its delta are copied to `replicas` nodes"
+        cluster = Cluster([Node('a', '10.0.0.1'), Node('b', '10.0.0.2'),
+            Node('c', '10.0.0.3')], replicas=2,
+            options=[('ha_strategy', 'nodeads')])
+        layout = plan_cluster(cluster, [source('product', 'product'),
+            source('product_delta : product', 'product'),
+            source('party', 'party')], {'product': 10, 'party': 4})
+        self.assertEqual(self.placement(layout), {
+            'a': ['party', 'product', 'product_delta'],
+            'b': ['product', 'product_delta'],
+            'c': ['party'],
+            })
+        front = dict((index.name, index) for index in layout.front)
+        self.assertEqual(sorted(front), ['party', 'product'])
+        self.assertEqual(front['product'].agents,
+            ['10.0.0.1:9312|10.0.0.2:9312:product,product_delta'])
+        self.assertEqual(front['product'].options,
+            [('ha_strategy', 'nodeads')])
+        # c is the least loaded, a the first of the others by name
+        self.assertEqual(front['party'].agents,
+            ['10.0.0.3:9312|10.0.0.1:9312:party'])
+
+    def test_siblings(self):
+        "The shards of a model go to different nodes when possible"
+        cluster = Cluster([Node('a', 'a'), Node('b', 'b')])
+        layout = plan_cluster(cluster, [source('party', 'party'),
+            source('product_0', 'product'), source('product_1', 'product'),
+            DistributedIndex('product', ['product_0', 'product_1'])],
+            {'party': 10, 'product_0': 5, 'product_1': 5})
+        # The least loaded node b already has product_0
+        self.assertEqual(self.placement(layout), {
+            'a': ['party', 'product_1'],
+            'b': ['product_0'],
+            })
+        front = dict((index.name, index) for index in layout.front)
+        self.assertEqual(sorted(front), ['party', 'product'])
+        self.assertEqual(front['product'].agents,
+            ['b:9312:product_0', 'a:9312:product_1'])
+        self.assertEqual(front['product'].table, 'product')
+
+    def test_weight(self):
+        "A node of twice the weight gets twice the indexes"
+        cluster = Cluster([Node('a', 'a', weight=2), Node('b', 'b')])
+        layout = plan_cluster(cluster, [source('index%d' % i, 'table%d' % i)
+            for i in xrange(6)])
+        self.assertEqual([len(sources) for _, sources in layout.nodes],
+            [4, 2])
+
+    def test_invalid(self):
+        "More replicas than nodes and no node are refused"
+        self.assertRaises(ValueError, Cluster, [Node('a', 'a')], 2)
+        self.assertRaises(ValueError, Cluster, [])
+        self.assertRaises(ValueError, Cluster, [Node('a', 'a', weight=0)])
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PlanClusterTestCase)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    test_configuration
+
+    Tests the sharding of a :class:`tryton_sphinx.DataSource` in ranges of
+    ids.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import unittest
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.attributes import overflow_check
+
+_RANGE = re.compile(r'^SELECT (MIN\(id\)|\d+), (MAX\(id\)|\d+)')
+
+
+class ShardTestCase(unittest.TestCase):
+
+    def source(self):
+        return DataSource('product : base', 'SELECT 1',
+            {'sequence': 'sql_attr_uint'}, table='product',
+            multi_attributes={'categories': ('SELECT "doc", "category"',
+                'SELECT MIN(id), MAX(id) FROM "product"')},
+            bits={'sequence': 8})
+
+    def ranges(self, shards):
+        "Returns the `(start, end)` ids of the shards, None if open ended"
+        result = []
+        for shard in shards:
+            start, end = _RANGE.match(shard.sql_query_range).groups()
+            result.append((None if start == 'MIN(id)' else int(start),
+                None if end == 'MAX(id)' else int(end)))
+        return result
+
+    def test_single(self):
+        "A single shard is the source itself"
+        source = self.source()
+        self.assertEqual(source.shard(1, 1, 100), [source])
+
+    def test_ranges(self):
+        "The shards cover every id once, the first and last open ended"
+        for count, min_id, max_id in ((2, 1, 100), (3, 1, 100),
+                (4, 10, 13), (4, 1, 9), (7, 1000, 1000000)):
+            shards = self.source().shard(count, min_id, max_id)
+            self.assertEqual(len(shards), count)
+            ranges = self.ranges(shards)
+            self.assertEqual(ranges[0][0], None)
+            self.assertEqual(ranges[-1][1], None)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(start, end + 1)
+            # None is empty
+            self.assertTrue(ranges[0][1] >= min_id)
+            for start, end in ranges[1:-1]:
+                self.assertTrue(start <= end)
+            self.assertTrue(ranges[-1][0] <= max_id)
+
+    def test_few_ids(self):
+        "A table is split in at most one shard per id"
+        self.assertEqual(len(self.source().shard(5, 1, 3)), 3)
+        source = self.source()
+        self.assertEqual(source.shard(5, 7, 7), [source])
+
+    def test_names(self):
+        "The shards are numbered and keep the parent of the source"
+        shards = self.source().shard(3, 1, 100)
+        self.assertEqual([shard.name for shard in shards],
+            ['product_0 : base', 'product_1 : base', 'product_2 : base'])
+        self.assertEqual([shard.index_name for shard in shards],
+            ['product_0', 'product_1', 'product_2'])
+
+    def test_restricted(self):
+        "The multi-valued attributes and the checks cover the shard only"
+        source = self.source()
+        source.sql_query_pre = source.overflow_checks() + ['SET a = 1']
+        first, middle, last = source.shard(3, 1, 90)
+        self.assertEqual(middle.sql_query_range, 'SELECT 31, 60')
+        self.assertEqual(middle.multi_attributes, {'categories': (
+            'SELECT "doc", "category"', 'SELECT 31, 60')})
+        self.assertEqual(middle.sql_query_pre, [overflow_check('product',
+            'sequence', 8, '"product"."id" BETWEEN 31 AND 60'),
+            'SET a = 1'])
+        self.assertEqual(first.sql_query_pre[0], overflow_check('product',
+            'sequence', 8, '"product"."id" <= 30'))
+        self.assertEqual(last.sql_query_pre[0], overflow_check('product',
+            'sequence', 8, '"product"."id" >= 61'))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ShardTestCase)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    test_profiles
+
+    Tests the index profiles of :mod:`tryton_sphinx.profiles`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.profiles import profile_options, profile_settings, \
+    substring_length
+
+
+class ProfilesTestCase(unittest.TestCase):
+
+    def source(self, profile, options=None):
+        return DataSource(profile, 'SELECT 1', {},
+            index_options=profile_options(profile) + (options or []))
+
+    def test_index_options(self):
+        "The searchd settings are not written in the index blocks"
+        for profile in ('prefix', 'infix'):
+            self.assertFalse('expansion_limit' in dict(
+                profile_options(profile)))
+
+    def test_settings(self):
+        "The lowest expansion_limit of the profiles in use is set"
+        self.assertEqual(profile_settings([self.source('default'),
+            self.source('substring')]), [])
+        settings = profile_settings([self.source('infix')])
+        self.assertEqual([(setting.option, setting.value)
+            for setting in settings], [('expansion_limit', '32')])
+        settings = profile_settings([self.source('infix'),
+            self.source('prefix', [('docinfo', 'extern')])])
+        self.assertEqual([(setting.option, setting.value)
+            for setting in settings], [('expansion_limit', '16')])
+
+    def test_substring_length(self):
+        "Only the infixes of dict = crc answer ilike"
+        self.assertEqual(substring_length(profile_options('substring')), 3)
+        self.assertEqual(substring_length(profile_options('infix')), None)
+        self.assertEqual(substring_length(profile_options('prefix')), None)
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ProfilesTestCase)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
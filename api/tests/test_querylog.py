@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    test_querylog
+
+    Tests the parsing of the query logs of searchd and the slowest query
+    shapes of :class:`tryton_sphinx.querylog.Analysis`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from tryton_sphinx.querylog import Analysis, parse_line
+
+
+def plain(seconds, text, indexes='product', mode='ext2'):
+    return '[Sat Oct 15 10:00:00.000 2011] %s sec [%s/2/rel 3 (0,20)] ' \
+        '[%s] %s\n' % (seconds, mode, indexes, text)
+
+
+def sphinxql(seconds, statement, error=None):
+    return '/* Sat Oct 15 10:00:00.000 2011 conn 7 real %s wall %s found ' \
+        '12 */ %s;%s\n' % (seconds, seconds, statement,
+            ' # error=%s' % error if error else '')
+
+
+class ParseLineTestCase(unittest.TestCase):
+
+    def test_plain(self):
+        "The plain format gives the indexes, the time and the mode"
+        query = parse_line(plain('0.125', 'mac book', 'product, party'))
+        self.assertEqual(query.indexes, ['product', 'party'])
+        self.assertEqual(query.seconds, 0.125)
+        self.assertEqual(query.found, None)
+        self.assertEqual((query.mode, query.text), ('ext2', 'mac book'))
+        self.assertEqual(query.shape, '[product, party] ext2/rel filters=2')
+        self.assertEqual(query.columns, [])
+
+    def test_sphinxql(self):
+        "The sphinxql format gives the shape and the filtered columns"
+        query = parse_line(sphinxql('0.004', "SELECT * FROM product "
+            "WHERE MATCH('mac') AND category IN (1, 2) AND price > 10.5 "
+            "LIMIT 0, 20"))
+        self.assertEqual(query.indexes, ['product'])
+        self.assertEqual((query.seconds, query.found), (0.004, 12))
+        self.assertEqual(query.mode, None)
+        self.assertEqual(query.shape, "SELECT * FROM product WHERE "
+            "MATCH(?) AND category IN (?) AND price > ? LIMIT ?, ?")
+        self.assertEqual(query.columns, ['category', 'price'])
+
+    def test_error(self):
+        "The column of an error is counted as filtered"
+        query = parse_line(sphinxql('0.001', "SELECT * FROM product "
+            "WHERE colour = 1", "unknown column: 'colour'"))
+        self.assertEqual(query.error, "unknown column: 'colour'")
+        self.assertEqual(query.columns, ['colour'])
+
+    def test_not_a_query(self):
+        "The other lines are skipped"
+        for line in ('', 'garbage\n', '/* not a query */\n'):
+            self.assertEqual(parse_line(line), None)
+
+
+class AnalysisTestCase(unittest.TestCase):
+
+    def test_frequent_kept(self):
+        "A slow shape first seen once the shapes are full is kept"
+        analysis = Analysis(max_shapes=3)
+        for i in xrange(10):
+            analysis.add(sphinxql('0.01', 'SELECT * FROM product%d' % i))
+        for i in xrange(50):
+            analysis.add(sphinxql('0.5', 'SELECT * FROM product'))
+            analysis.add(sphinxql('0.01', 'SELECT * FROM other%d' % i))
+        self.assertEqual(len(analysis.shapes), 3)
+        self.assertEqual(len(analysis._lightest._heap), 3)
+        slowest = analysis.slowest(1)[0]
+        self.assertEqual(slowest.shape, 'SELECT * FROM product')
+        # It inherited the time of the shape it replaced
+        self.assertTrue(25 <= slowest.total <= 25 + slowest.error)
+        self.assertTrue(slowest.error < 0.5)
+        self.assertEqual(analysis.queries, 110)
+
+    def test_exact(self):
+        "The shapes which replaced none are exact"
+        analysis = Analysis()
+        for seconds in ('0.1', '0.2', '0.3'):
+            analysis.add(plain(seconds, 'mac'))
+        shape, = analysis.slowest()
+        self.assertEqual((shape.count, shape.error), (3, 0.0))
+        self.assertAlmostEqual(shape.total, 0.6)
+        self.assertFalse('too much' in analysis.report())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for test_case in (ParseLineTestCase, AnalysisTestCase):
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(test_case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    test_storage
+
+    Tests the storage settings :func:`tryton_sphinx.storage.plan_storage`
+    chooses for the indexes.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import shutil
+import tempfile
+import unittest
+
+from trytond.config import CONFIG
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.stats import TableStats
+from tryton_sphinx.storage import measure_index, plan_storage
+
+
+class PlanStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = CONFIG['data_path']
+        CONFIG['data_path'] = tempfile.mkdtemp()
+        self.stats = TableStats('party_party', 100000, 1, 100000,
+            {'name': 20})
+
+    def tearDown(self):
+        shutil.rmtree(CONFIG['data_path'])
+        CONFIG['data_path'] = self.data_path
+
+    def size(self, attributes, multi_attributes=None):
+        return measure_index(DataSource('party_party', 'SELECT 1',
+            attributes, table='party_party',
+            multi_attributes=multi_attributes), self.stats)
+
+    def plan(self, size, queries):
+        plans = plan_storage([size], {'party_party': queries}, 1024)
+        self.assertEqual(len(plans), 1)
+        return plans[0]
+
+    def test_inline(self):
+        "The numeric attributes of a cold index are left on disk"
+        size = self.size({'active': 'sql_attr_bool',
+            'create_uid': 'sql_attr_uint'})
+        self.assertTrue(size.inline)
+        for queries in (0, 10):
+            plan = self.plan(size, queries)
+            self.assertEqual(plan.docinfo, 'inline')
+            self.assertEqual(plan.memory, 0)
+
+    def test_string_extern(self):
+        "An index with a string attribute keeps docinfo = extern"
+        size = self.size({'name': 'sql_field_string',
+            'active': 'sql_attr_bool'})
+        self.assertFalse(size.inline)
+        for queries in (0, 10):
+            plan = self.plan(size, queries)
+            self.assertEqual(plan.docinfo, 'extern')
+            self.assertTrue(plan.ondisk_dict)
+            self.assertEqual(plan.memory, size.attributes)
+            self.assertEqual(dict(plan.options)['docinfo'], 'extern')
+
+    def test_multi_extern(self):
+        "An index with a multi-valued attribute keeps docinfo = extern"
+        size = self.size({'active': 'sql_attr_bool'},
+            {'categories': ('SELECT 1', None)})
+        self.assertFalse(size.inline)
+        self.assertEqual(self.plan(size, 0).docinfo, 'extern')
+
+    def test_fits(self):
+        "An index which fits in the budget is kept in RAM and locked"
+        size = self.size({'name': 'sql_field_string'})
+        plans = plan_storage([size], {'party_party': 10},
+            (size.attributes + size.dictionary) * 4)
+        self.assertEqual(plans[0].docinfo, 'extern')
+        self.assertFalse(plans[0].ondisk_dict)
+        self.assertTrue(plans[0].mlock)
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PlanStorageTestCase)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
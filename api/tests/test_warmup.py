@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+    test_warmup
+
+    Tests the counting of the hot query shapes and the statements replayed
+    by :mod:`tryton_sphinx.warmup`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from tryton_sphinx.querylog import Histogram, parse_line
+from tryton_sphinx.scheduler import ConfigBlock
+from tryton_sphinx.warmup import HotQueries, Warmup, replay_statement, \
+    searched_indexes, hot_statements
+
+SPHINXQL = "/* Sat Oct 15 10:00:00.000 2011 conn 1 real 0.002 wall 0.002 " \
+    "found 3 */ SELECT * FROM %s WHERE MATCH('%s');"
+PLAIN = "[Sat Oct 15 10:00:00.000 2011] 0.002 sec [%s/0/rel 3 (0,20)] " \
+    "[%s] %s"
+
+
+class HotQueriesTestCase(unittest.TestCase):
+
+    def test_frequent_kept(self):
+        "A frequent shape first seen once the shapes are full is kept"
+        hot = HotQueries(max_shapes=3)
+        for i in xrange(10):
+            hot.add(PLAIN % ('ext2', 'product', 'once%d' % i))
+        for i in xrange(20):
+            hot.add(PLAIN % ('ext2', 'product', 'iphone'))
+            hot.add(PLAIN % ('ext2', 'product', 'other%d' % i))
+        self.assertEqual(len(hot.shapes['product']), 3)
+        self.assertEqual(hot.top('product', 1),
+            ["SELECT * FROM product WHERE MATCH('iphone') LIMIT 0, 20"])
+
+    def test_counts(self):
+        "The shapes are counted per index, the errors are left out"
+        hot = HotQueries()
+        for text in ('ipad', 'ipad', 'mac'):
+            hot.add(SPHINXQL % ('product, product_delta', text))
+        hot.add(SPHINXQL % ('product', 'mac') + " # error=unknown column")
+        self.assertEqual(hot.top('product', 1), hot.top('product_delta', 1))
+        self.assertEqual(hot.top('product', 2), [
+            "SELECT * FROM product, product_delta WHERE MATCH('ipad')",
+            "SELECT * FROM product, product_delta WHERE MATCH('mac')"])
+        self.assertEqual(hot_statements(hot, ['product', 'product_delta'],
+            2), hot.top('product', 2))
+
+
+class ReplayStatementTestCase(unittest.TestCase):
+
+    def replay(self, mode, text):
+        return replay_statement(parse_line(PLAIN % (mode, 'product', text)))
+
+    def test_escaped(self):
+        "The text of a plain query is escaped unless it is extended"
+        self.assertEqual(self.replay('all', "o'neil (mac)"),
+            "SELECT * FROM product WHERE MATCH('o\\'neil \\\\(mac\\\\)') "
+            "LIMIT 0, 20")
+        self.assertEqual(self.replay('ext2', '"mac book"~2'),
+            "SELECT * FROM product WHERE MATCH('\"mac book\"~2') "
+            "LIMIT 0, 20")
+
+    def test_sphinxql(self):
+        "A SphinxQL statement is replayed as logged"
+        self.assertEqual(replay_statement(parse_line(SPHINXQL % ('product',
+            'mac'))), "SELECT * FROM product WHERE MATCH('mac')")
+
+
+class SearchedIndexesTestCase(unittest.TestCase):
+
+    def block(self, name, **options):
+        block = ConfigBlock('index', name, None)
+        block.options.update(options)
+        return block
+
+    def test_distributed(self):
+        "The distributed indexes over the local ones are searched too"
+        blocks = [
+            self.block('product_0', path=['/data/product_0']),
+            self.block('product_1', path=['/data/product_1']),
+            self.block('product', type=['distributed'],
+                local=['product_0', 'product_1']),
+            self.block('party', type=['distributed'], local=['party_0']),
+            ]
+        self.assertEqual(searched_indexes(blocks, ['product_1']),
+            ['product_1', 'product'])
+        self.assertEqual(searched_indexes(blocks, []), [])
+
+
+class WarmupTestCase(unittest.TestCase):
+
+    def result(self, preread):
+        histogram = Histogram()
+        histogram.add(0.01)
+        return Warmup(['product'], 1, preread, 0.1, histogram, histogram, 0)
+
+    def test_first_pass(self):
+        "The first pass is only called cold if nothing was read ahead"
+        self.assertTrue('\ncold ' in self.result(0).report())
+        self.assertTrue('cold' in self.result(0).as_dict())
+        self.assertFalse('cold' in self.result(1024).report())
+        self.assertTrue('\npreread ' in self.result(1024).report())
+        self.assertTrue('preread' in self.result(1024).as_dict())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    for test_case in (HotQueriesTestCase, ReplayStatementTestCase,
+            SearchedIndexesTestCase, WarmupTestCase):
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(test_case))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -9,7 +9,9 @@
 """
 from trytond.model import ModelSQL
 from trytond.model.fields import (Integer, BigInteger, Boolean, DateTime, 
-    Numeric, Float, Char, Text, Selection)
+    Numeric, Float, Char, Text, Selection, Many2One, One2Many, Many2Many)
+
+from catalog import CatalogModel
 
 
 def guess_type(field):
@@ -33,16 +35,74 @@ def guess_type(field):
     if isinstance(field, (Char, Text, Selection)):
         return 'sql_field_string'
 
+    if isinstance(field, Many2One):
+        # Ids are 32 bit integers in the database, so an unsigned int is
+        # enough to filter on the foreign key
+        return 'sql_attr_uint'
+
     raise ValueError("%s is not a type recognised by sphinx" % type(field))
 
 
+def get_attributes(model_object):
+    """Returns a :class:`dict` of the names of the fields of the model which
+    have `select=1` as keys and their sphinx attribute type as values.
+
+    :param model_object: The instance of a model as obtained from the 
+                         `trytond.pool.Pool`
+    """
+    attributes = {}
+    for name, field in model_object._columns.iteritems():
+        if field.select != 1:
+            continue
+        try:
+            attributes[name] = guess_type(field)
+        except ValueError:
+            # Ignore if a value error is raised because its a field which
+            # sphinx doesnt know the proper type for conversion
+            continue
+    return attributes
+
+
+def get_unsupported_fields(model_object):
+    """Returns the sorted names of the fields of the model which have
+    `select=1` but which sphinx has no attribute type for (and which are
+    not multi-valued attributes either), so they are not indexed.
+
+    :param model_object: The instance of a model as obtained from the 
+                         `trytond.pool.Pool`
+    """
+    names = []
+    for name, field in model_object._columns.iteritems():
+        if field.select != 1 or isinstance(field, (One2Many, Many2Many)):
+            continue
+        try:
+            guess_type(field)
+        except ValueError:
+            names.append(name)
+    return sorted(names)
+
+
+def get_multi_attributes(model_object):
+    """Returns a :class:`dict` of the names of the One2Many and Many2Many
+    fields of the model which have `select=1` as keys and the fields as
+    values. Those become multi-valued attributes.
+
+    :param model_object: The instance of a model as obtained from the 
+                         `trytond.pool.Pool`
+    """
+    return dict((name, field)
+        for name, field in model_object._columns.iteritems()
+        if field.select == 1 and isinstance(field, (One2Many, Many2Many)))
+
+
 def iter_sql_models(pool):
     """Given a pool iterate over all models that inherit from ModelSQL
 
-    :param pool: AN instance of init'ed `trytond.pool.Pool` for a DB
+    :param pool: AN instance of init'ed `trytond.pool.Pool` for a DB, or the
+                 :class:`tryton_sphinx.catalog.CatalogPool` of a DB
     """
     for model_name in pool.object_name_list():
         model_obj = pool.get(model_name)
-        if isinstance(model_obj, ModelSQL):
+        if isinstance(model_obj, (ModelSQL, CatalogModel)):
             yield model_obj 
     raise StopIteration
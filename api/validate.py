@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    validate
+
+    Checks the plans PostgreSQL chooses for the queries of the generated data
+    sources before the indexer runs them for hours: every ranged query is
+    explained for a range step in the middle of its ids, and the sequential
+    scans, the nested loops over large relations and the costly steps are
+    reported along with the indexes which would avoid them and an estimate
+    of the time the whole source takes to fetch.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import json
+
+from configuration import DataSource
+
+#: A sequential scan of a relation with more rows than this is reported
+SEQ_SCAN_ROWS = 10000
+
+#: A nested loop whose outer rows times inner rows exceed this is reported
+NESTED_LOOP_ROWS = 1000000
+
+#: A range step costing more than this (in planner units) is reported
+MAX_STEP_COST = 100000.0
+
+#: The rough milliseconds of a unit of planner cost, used to estimate the
+#: time of a source when its steps are not timed
+COST_MILLISECONDS = 0.01
+
+_INDEX_COLUMNS = re.compile(r'\(\s*"?(\w+)"?')
+_FILTER_COLUMN = re.compile(r'(?:\b\w+\.)?"?([a-z_]\w*)"?\)?(?:::[\w ]+)?\s*'
+    r'(?:>=|<=|<>|=|>|<|~~)', re.I)
+
+
+class Finding(object):
+    """A problem of the plan of a query.
+
+    `kind`: `seq_scan`, `nested_loop`, `cost` or `error`
+    `message`: A sentence describing it
+    """
+
+    def __init__(self, kind, message):
+        self.kind = kind
+        self.message = message
+
+
+class QueryValidation(object):
+    """The validation of a ranged query of a data source.
+
+    `source`: The name of the data source
+    `label`: What the query fetches (`documents` or the name of a
+             multi-valued attribute)
+    `steps`: The number of range steps the indexer runs
+    `step_cost`: The estimated cost of a step
+    `step_milliseconds`: The time of a step, measured if `timed`, else
+                         estimated from its cost
+    `findings`: The list of :class:`Finding`
+    `missing_indexes`: The `CREATE INDEX` statements of the indexes the
+                       sequential scans need
+    """
+
+    def __init__(self, source, label, steps=0, step_cost=0.0,
+            step_milliseconds=0.0, timed=False, findings=None,
+            missing_indexes=None):
+        self.source = source
+        self.label = label
+        self.steps = steps
+        self.step_cost = step_cost
+        self.step_milliseconds = step_milliseconds
+        self.timed = timed
+        self.findings = findings or []
+        self.missing_indexes = missing_indexes or []
+
+    @property
+    def total_seconds(self):
+        """The estimated time of all the steps
+        """
+        return self.steps * self.step_milliseconds / 1000.0
+
+
+def substitute(query, start, end):
+    """Returns the ranged query with `$start` and `$end` replaced
+    """
+    return query.replace('$start', str(int(start))).replace(
+        '$end', str(int(end)))
+
+
+def explain(cursor, query, analyze=False):
+    """Returns the plan of the query (the JSON output of `EXPLAIN`), the
+    query being run if `analyze`
+    """
+    cursor.execute('EXPLAIN (%sFORMAT JSON) %s' % (
+        analyze and 'ANALYZE, ' or '', query))
+    result = cursor.fetchone()[0]
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    return result[0]
+
+
+def iter_nodes(node):
+    """Iterates over the node of a plan and all its children
+    """
+    yield node
+    for child in node.get('Plans', []):
+        for descendant in iter_nodes(child):
+            yield descendant
+
+
+def relation_rows(cursor, relation, cache):
+    """Returns the estimated rows of the relation (from `pg_class`)
+    """
+    if relation not in cache:
+        cursor.execute("SELECT reltuples FROM pg_class "
+            "WHERE relname = %s AND relkind = 'r'", (relation,))
+        row = cursor.fetchone()
+        cache[relation] = int(row[0]) if row else 0
+    return cache[relation]
+
+
+def indexed_columns(cursor, relation):
+    """Returns the set of the first columns of the indexes of the relation
+    """
+    cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s',
+        (relation,))
+    columns = set()
+    for indexdef, in cursor.fetchall():
+        match = _INDEX_COLUMNS.search(indexdef[indexdef.find(' USING '):])
+        if match:
+            columns.add(match.group(1))
+    return columns
+
+
+def check_plan(cursor, plan, rows_cache):
+    """Returns a tuple `(findings, scans)` of the plan: the
+    :class:`Finding` of its nodes and the `(relation, filter)` of its
+    sequential scans of large relations
+    """
+    findings, scans = [], []
+    root = plan['Plan']
+    if root.get('Total Cost', 0) > MAX_STEP_COST:
+        findings.append(Finding('cost', 'a range step costs %.0f' % (
+            root['Total Cost'])))
+    for node in iter_nodes(root):
+        node_type = node.get('Node Type')
+        if node_type == 'Seq Scan':
+            relation = node.get('Relation Name')
+            rows = relation_rows(cursor, relation, rows_cache)
+            if rows > SEQ_SCAN_ROWS:
+                findings.append(Finding('seq_scan', 'sequential scan of '
+                    '%s (%d rows)%s' % (relation, rows, node.get('Filter')
+                        and ' filtered on %s' % node['Filter'] or '')))
+                scans.append((relation, node.get('Filter') or ''))
+        elif node_type == 'Nested Loop' and len(node.get('Plans', [])) == 2:
+            outer, inner = node['Plans']
+            loops = outer.get('Plan Rows', 0) * max(1,
+                inner.get('Plan Rows', 0))
+            if loops > NESTED_LOOP_ROWS and 'Index' not in inner.get(
+                    'Node Type', ''):
+                findings.append(Finding('nested_loop', 'nested loop of %d '
+                    'rows over a %s of %s' % (loops, inner.get('Node Type'),
+                        inner.get('Relation Name', 'a subquery'))))
+    return findings, scans
+
+
+def missing_indexes(cursor, scans):
+    """Returns the `CREATE INDEX` statements of the columns the sequential
+    scans filter on which are not the first column of an index
+    """
+    statements = []
+    for relation, condition in scans:
+        columns = indexed_columns(cursor, relation)
+        for column in sorted(set(_FILTER_COLUMN.findall(condition))):
+            if column in columns:
+                continue
+            statement = 'CREATE INDEX "%s_%s_index" ON "%s" ("%s");' % (
+                relation, column, relation, column)
+            if statement not in statements:
+                statements.append(statement)
+    return statements
+
+
+def validate_query(cursor, source, label, query, range_query, step,
+        analyze=False, rows_cache=None):
+    """Returns the :class:`QueryValidation` of a ranged query, explained for
+    the range step in the middle of the ids its range query returns
+    """
+    validation = QueryValidation(source, label)
+    rows_cache = {} if rows_cache is None else rows_cache
+    cursor.execute('SAVEPOINT tryton_sphinx_validate')
+    try:
+        cursor.execute(range_query)
+        low, high = cursor.fetchone()
+        if low is None:
+            low = high = 0
+        validation.steps = (high - low) // step + 1
+        start = low + (high - low) // 2
+        plan = explain(cursor, substitute(query, start, start + step - 1),
+            analyze)
+    except Exception as exception:
+        cursor.execute('ROLLBACK TO SAVEPOINT tryton_sphinx_validate')
+        validation.findings.append(Finding('error', str(exception).strip()))
+        return validation
+
+    validation.step_cost = plan['Plan'].get('Total Cost', 0.0)
+    if analyze:
+        validation.timed = True
+        validation.step_milliseconds = plan.get('Execution Time',
+            plan.get('Total Runtime', plan['Plan'].get('Actual Total Time',
+                0.0)))
+    else:
+        validation.step_milliseconds = validation.step_cost * \
+            COST_MILLISECONDS
+    validation.findings, scans = check_plan(cursor, plan, rows_cache)
+    validation.missing_indexes = missing_indexes(cursor, scans)
+    cursor.execute('RELEASE SAVEPOINT tryton_sphinx_validate')
+    return validation
+
+
+def validate_sources(database_name, sources, analyze=False):
+    """Returns the :class:`QueryValidation` of the ranged queries of the
+    data sources: the documents and every multi-valued attribute
+
+    :param analyze: Run the queries of a step (`EXPLAIN ANALYZE`) to time
+                    them instead of estimating from their cost
+    """
+    from trytond.transaction import Transaction
+
+    validations, rows_cache = [], {}
+    with Transaction().start(database_name, 0):
+        cursor = Transaction().cursor
+        for source in sources:
+            if not isinstance(source, DataSource) or \
+                    not source.sql_query_range:
+                continue
+            queries = [('documents', source.sql_query,
+                source.sql_query_range)]
+            queries.extend((name, query, range_query) for name,
+                (query, range_query) in sorted(
+                    source.multi_attributes.iteritems()))
+            for label, query, range_query in queries:
+                validations.append(validate_query(cursor, source.name, label,
+                    query, range_query, source.sql_range_step, analyze,
+                    rows_cache))
+    return validations
+
+
+def report(validations):
+    """Returns the validations as a text report
+    """
+    lines, statements, total = [], [], 0.0
+    for validation in validations:
+        total += validation.total_seconds
+        lines.append('%s (%s): %d steps of cost %.0f, %s%.1fs' % (
+            validation.source, validation.label, validation.steps,
+            validation.step_cost,
+            '' if validation.timed else 'about ', validation.total_seconds))
+        lines.extend('    - %s: %s' % (finding.kind, finding.message)
+            for finding in validation.findings)
+        statements.extend(statement for statement in
+            validation.missing_indexes if statement not in statements)
+    lines.extend(['', 'Total: about %.0fs of queries' % total])
+    if statements:
+        lines.extend(['', 'Missing indexes', '===============', ''])
+        lines.extend(statements)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+    warmup
+
+    Warms up the indexes searchd has just rotated. `seamless_rotate` and
+    `preopen_indexes` open the new files before they are swapped in, but
+    their pages are not in the page cache yet, so the first searches after
+    every rotation read them from the disk.
+
+    The most frequent query shapes of every index are taken from the query
+    log and replayed against searchd at a limited concurrency, once the
+    files of the indexes have optionally been read ahead. The queries are
+    replayed twice: the first pass is the warm-up itself and times the cold
+    indexes (or, once the files were read ahead, the indexes whose pages
+    are already cached), the second pass times the warm ones.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import time
+import json
+import threading
+from Queue import Queue, Empty
+
+from querylog import parse_line, Histogram, LightestHeap
+from planner import format_size
+from client import escape_match
+
+#: The number of query shapes kept per index while reading the log; beyond
+#: it a new shape replaces the least frequent one (see
+#: :class:`tryton_sphinx.querylog.LightestHeap`)
+MAX_SHAPES = 1000
+
+#: The distinct queries replayed for every shape
+EXAMPLES_PER_SHAPE = 3
+
+#: The number of matches of a query of the plain log (its limit is not
+#: logged)
+DEFAULT_LIMIT = 20
+
+#: The files searchd reads when it searches: the attributes, the
+#: dictionary and the document lists
+PREREAD_EXTENSIONS = ('.spa', '.spi', '.spd')
+PREREAD_CHUNK = 1024 * 1024
+
+
+def quote(value):
+    """Returns the value as a SphinxQL string literal
+    """
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def replay_statement(query):
+    """Returns the SphinxQL statement replaying a
+    :class:`tryton_sphinx.querylog.Query`
+    """
+    if query.mode is None:
+        return query.text.rstrip().rstrip(';')
+    statement = 'SELECT * FROM %s' % ', '.join(query.indexes)
+    text = (query.text or '').strip()
+    if text:
+        if not query.mode.startswith(('ext', 'boolean')):
+            text = escape_match(text)
+        statement += ' WHERE MATCH(%s)' % quote(text)
+    return statement + ' LIMIT 0, %d' % DEFAULT_LIMIT
+
+
+def hot_shape(query):
+    """Returns the shape of the query the warm-up counts. The plain log
+    does not log the values of the filters, so its full text queries are
+    told apart by their words.
+    """
+    if query.mode is None:
+        return query.shape
+    return '%s %s' % (query.shape, ' '.join((query.text or '').lower(
+        ).split()))
+
+
+class HotQueries(object):
+    """The most frequent query shapes of every index of the query logs,
+    counted in constant memory with the Space-Saving algorithm: a new shape
+    replacing the least frequent one inherits its count, so the shapes
+    which are frequent over the whole log are kept.
+    """
+
+    def __init__(self, max_shapes=MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self.shapes = {}
+        self._lightest = {}
+
+    def add(self, line):
+        """Adds a line of the log
+        """
+        query = parse_line(line)
+        if query is None or query.error:
+            return
+        shape = hot_shape(query)
+        statement = None
+        for name in query.indexes:
+            shapes = self.shapes.setdefault(name, {})
+            counted = shapes.get(shape)
+            if counted is None:
+                lightest = self._lightest.setdefault(name,
+                    LightestHeap(lambda counted: counted[0]))
+                inherited = 0
+                if len(shapes) >= self.max_shapes:
+                    inherited = lightest.pop(shapes)[0]
+                counted = shapes[shape] = [inherited, []]
+                lightest.push(shape, counted)
+            counted[0] += 1
+            if len(counted[1]) < EXAMPLES_PER_SHAPE:
+                statement = statement or replay_statement(query)
+                if statement not in counted[1]:
+                    counted[1].append(statement)
+
+    def read(self, file):
+        """Adds the lines of a file, one at a time
+        """
+        for line in file:
+            self.add(line)
+        return self
+
+    def top(self, name, count):
+        """Returns the statements of the `count` most frequent shapes of the
+        index, the most frequent first
+        """
+        shapes = self.shapes.get(name, {})
+        return sum([shapes[shape][1] for shape in sorted(shapes,
+            key=lambda shape: (-shapes[shape][0], shape))[:count]], [])
+
+
+def index_paths(blocks):
+    """Returns a :class:`dict` of the names of the local indexes of a config
+    (see :func:`tryton_sphinx.scheduler.read_config`) and the path of their
+    files
+    """
+    return dict((block.name, block.get('path')) for block in blocks
+        if block.section == 'index' and block.get('path')
+            and block.get('type') != 'distributed')
+
+
+def searched_indexes(blocks, names):
+    """Returns the names of the indexes the searches of the local indexes go
+    through: the indexes themselves and the distributed indexes which have
+    any of them as local index
+    """
+    result = list(names)
+    for block in blocks:
+        if block.section == 'index' and block.get('type') == 'distributed' \
+                and set(block.options.get('local', [])) & set(names) \
+                and block.name not in result:
+            result.append(block.name)
+    return result
+
+
+def hot_statements(hot, names, count):
+    """Returns the statements of the `count` most frequent shapes of every
+    index, each statement once
+    """
+    statements = []
+    for name in names:
+        for statement in hot.top(name, count):
+            if statement not in statements:
+                statements.append(statement)
+    return statements
+
+
+def wait_rotation(paths, timeout, interval=0.5):
+    """Waits until searchd has rotated the new files (`<path>.new.*`) of the
+    indexes in, and returns False if it has not within `timeout` seconds
+    """
+    deadline = time.time() + timeout
+    while True:
+        pending = [path for path in paths
+            if os.path.exists(path + '.new.sph')]
+        if not pending:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def preread(paths):
+    """Reads the files searchd searches of the indexes through, so that
+    their pages are in the page cache, and returns the number of bytes read
+    """
+    total = 0
+    for path in paths:
+        for extension in PREREAD_EXTENSIONS:
+            if not os.path.exists(path + extension):
+                continue
+            with open(path + extension, 'rb') as file:
+                while True:
+                    chunk = file.read(PREREAD_CHUNK)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+    return total
+
+
+def replay(client, statements, concurrency=4):
+    """Runs the statements through the
+    :class:`tryton_sphinx.client.Client`, `concurrency` at a time, and
+    returns a tuple `(histogram, errors)` of their latencies (a
+    :class:`tryton_sphinx.querylog.Histogram`) and the number of the ones
+    which failed
+    """
+    queue = Queue()
+    for statement in statements:
+        queue.put(statement)
+    histogram, errors, lock = Histogram(), [0], threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                statement = queue.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            try:
+                client.execute(statement)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            elapsed = time.time() - start
+            with lock:
+                histogram.add(elapsed)
+
+    threads = [threading.Thread(target=worker)
+        for _ in xrange(max(1, min(concurrency, len(statements))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return histogram, errors[0]
+
+
+class Warmup(object):
+    """The result of a warm-up.
+
+    `indexes`: The names of the indexes warmed up
+    `queries`: The number of statements replayed
+    `preread`: The bytes of the index files read ahead
+    `seconds`: The time of the warm-up (read ahead and first pass)
+    `cold`: The :class:`tryton_sphinx.querylog.Histogram` of the first pass,
+            which is only cold if nothing was read ahead
+    `warm`: The :class:`tryton_sphinx.querylog.Histogram` of the second
+            pass (None if there was none)
+    `errors`: The number of statements which failed
+    """
+
+    def __init__(self, indexes, queries, preread, seconds, cold, warm,
+            errors):
+        self.indexes = indexes
+        self.queries = queries
+        self.preread = preread
+        self.seconds = seconds
+        self.cold = cold
+        self.warm = warm
+        self.errors = errors
+
+    @staticmethod
+    def _latencies(histogram):
+        if histogram is None or not histogram.count:
+            return None
+        return {
+            'mean': histogram.total / histogram.count,
+            'p50': histogram.percentile(0.5),
+            'p95': histogram.percentile(0.95),
+            'p99': histogram.percentile(0.99),
+            'max': histogram.maximum,
+            }
+
+    @property
+    def first_pass(self):
+        """The name of the first pass: `cold`, or `preread` once the
+        files were read ahead
+        """
+        return 'preread' if self.preread else 'cold'
+
+    def as_dict(self):
+        return {
+            'indexes': self.indexes,
+            'queries': self.queries,
+            'preread_bytes': self.preread,
+            'seconds': self.seconds,
+            'errors': self.errors,
+            self.first_pass: self._latencies(self.cold),
+            'warm': self._latencies(self.warm),
+            }
+
+    def as_json(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def report(self):
+        """Returns the warm-up as a text report
+        """
+        lines = ['Warmed up %d indexes with %d queries (%d errors) in '
+            '%.1fs%s' % (len(self.indexes), self.queries, self.errors,
+                self.seconds, self.preread and ', %s read ahead' %
+                format_size(self.preread) or ''), '',
+            '%-8s %8s %8s %8s %8s' % ('(ms)', 'p50', 'p95', 'p99', 'max')]
+        for label, histogram in ((self.first_pass, self.cold),
+                ('warm', self.warm)):
+            latencies = self._latencies(histogram)
+            if latencies is None:
+                continue
+            lines.append('%-8s %8.1f %8.1f %8.1f %8.1f' % (label,
+                latencies['p50'] * 1000, latencies['p95'] * 1000,
+                latencies['p99'] * 1000, latencies['max'] * 1000))
+        return '\n'.join(lines) + '\n'
+
+
+def warm_up(client, indexes, statements, concurrency=4, paths=None,
+        measure=True):
+    """Warms up the indexes and returns the :class:`Warmup`
+
+    :param client: The :class:`tryton_sphinx.client.Client` of searchd
+    :param indexes: The names of the indexes
+    :param statements: The statements to replay (see
+                       :func:`hot_statements`)
+    :param paths: The paths of the files of the indexes to read ahead (see
+                  :func:`index_paths`)
+    :param measure: Replay the statements a second time to time the warm
+                    indexes
+    """
+    start = time.time()
+    read = preread(paths) if paths else 0
+    cold, errors = replay(client, statements, concurrency)
+    seconds = time.time() - start
+    warm = None
+    if measure:
+        warm, warm_errors = replay(client, statements, concurrency)
+        errors += warm_errors
+    return Warmup(list(indexes), len(statements), read, seconds, cold, warm,
+        errors)
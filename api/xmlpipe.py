@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+    xmlpipe
+
+    `xmlpipe2 <http://sphinxsearch.com/docs/2.0.1/xmlpipe2.html>`_ sources
+    for the models with `fields.Function` fields, which have no column to
+    read with `sql_query`. The indexer runs `tryton-sphinx-xmlpipe.py`,
+    which reads the records through the model in batches of ids, so the
+    computed fields are evaluated by their getters, and streams them as XML
+    on its stdout.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import sys
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+from trytond.model.fields import Function
+from trytond.config import CONFIG
+
+from realtime import RealtimeIndex
+from utils import get_attributes, guess_type
+import renderer
+
+#: The xmlpipe2 schema declarations of the sphinx attribute types
+XMLPIPE_TYPES = {
+    'sql_attr_bigint': '<sphinx:attr name=%s type="bigint"/>',
+    'sql_attr_uint': '<sphinx:attr name=%s type="int" bits="32"/>',
+    'sql_attr_bool': '<sphinx:attr name=%s type="bool"/>',
+    'sql_attr_timestamp': '<sphinx:attr name=%s type="timestamp"/>',
+    'sql_attr_float': '<sphinx:attr name=%s type="float"/>',
+    'sql_field_string': '<sphinx:field name=%s attr="string"/>',
+    }
+
+#: The characters XML does not allow, which would stop the indexer
+_INVALID_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def get_function_attributes(model_object):
+    """Returns a :class:`dict` of the names of the `fields.Function` fields
+    of the model which have `select=1` as keys and the sphinx attribute
+    type of the field they compute as values.
+    """
+    attributes = {}
+    for name, field in model_object._columns.iteritems():
+        if not isinstance(field, Function) or field.select != 1:
+            continue
+        try:
+            attributes[name] = guess_type(field._field)
+        except ValueError:
+            continue
+    return attributes
+
+
+class XmlpipeSource(RealtimeIndex):
+    """An xmlpipe2 source and its index for a model. The values are
+    converted like the ones of the real-time indexes.
+
+    The possible arguments are:
+
+    `name`: Name of the source and of the index (needs to be unique)
+    `table`: The table of the model whose records are indexed
+    `attributes`: A :class:`dict` of field names as keys and type as values
+    `command`: The command the indexer runs to read the documents
+    """
+
+    def __init__(self, name, table, attributes, command):
+        super(XmlpipeSource, self).__init__(name, table, attributes)
+        self.command = command
+
+    @classmethod
+    def from_model(cls, model_object, database_name, prefix='',
+            batch_size=1000):
+        """Creates and returns a new xmlpipe2 source from a given model.
+        Its attributes are the ones of a data source and the `select=1`
+        Function fields.
+
+        :param model_object: The instance of a model as obtained from the
+                             `trytond.pool.Pool`
+        :param database_name: The name of the database to read from
+        :param prefix: A prefix for the name of the source
+        :param batch_size: The number of records read at once
+        """
+        attributes = get_attributes(model_object)
+        attributes.update(get_function_attributes(model_object))
+        command = ['tryton-sphinx-xmlpipe.py', '--batch-size',
+            str(batch_size)]
+        if CONFIG.configfile:
+            command.extend(['--config', CONFIG.configfile])
+        command.extend([database_name, model_object._name])
+        return cls(
+            name = prefix + model_object._table,
+            table = model_object._table,
+            attributes = attributes,
+            command = ' '.join(command),
+            )
+
+    def schema(self):
+        """Returns the `sphinx:schema` element of the documents
+        """
+        return '<sphinx:schema>\n%s\n</sphinx:schema>\n' % '\n'.join(
+            XMLPIPE_TYPES[self.attributes[name]] % quoteattr(name)
+            for name in self.columns)
+
+    def document(self, values):
+        """Returns the `sphinx:document` element of a record read from the
+        model
+        """
+        elements = []
+        for name in self.columns:
+            value = self.convert(name, values.get(name))
+            if isinstance(value, str):
+                value = value.decode('utf-8')
+            else:
+                value = unicode(value)
+            elements.append('<%s>%s</%s>' % (name,
+                escape(_INVALID_XML.sub(u'', value)), name))
+        return (u'<sphinx:document id="%d">%s</sphinx:document>\n' % (
+            values['id'], ''.join(elements))).encode('utf-8')
+
+    def as_string(self):
+        """Returns the string representation of the config as it has to appear
+        in the sphinx.conf
+        """
+        return renderer.render('xmlpipe_source', source=self, config=CONFIG)
+
+    def write_to(self, file):
+        """Streams the config as it has to appear in the sphinx.conf into the
+        given file
+        """
+        renderer.stream(file, 'xmlpipe_source', source=self, config=CONFIG)
+
+
+def iter_id_batches(cursor, table, batch_size):
+    """Iterates over the ids of the table in batches of `batch_size`, by
+    ascending id. Each batch starts after the last id of the previous one,
+    so the gaps in the ids cost nothing.
+    """
+    last_id = 0
+    while True:
+        cursor.execute('SELECT "id" FROM "%s" WHERE "id" > %%s '
+            'ORDER BY "id" LIMIT %%s' % table, (last_id, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def stream_documents(source, model_object, cursor, file,
+        batch_size=1000, report=sys.stderr):
+    """Streams the records of the model as an xmlpipe2 docset into the file.
+    Only one batch of records is held at once. The throughput is written to
+    `report` once done.
+
+    Returns the number of documents.
+
+    :param source: The :class:`XmlpipeSource` of the model
+    :param model_object: The instance of the model as obtained from the
+                         `trytond.pool.Pool`
+    :param cursor: A cursor of the transaction to read with
+    """
+    start, count = time.time(), 0
+    file.write('<?xml version="1.0" encoding="utf-8"?>\n<sphinx:docset>\n')
+    file.write(source.schema())
+    for ids in iter_id_batches(cursor, source.table, batch_size):
+        for values in model_object.read(ids, source.columns):
+            file.write(source.document(values))
+        count += len(ids)
+    file.write('</sphinx:docset>\n')
+    file.flush()
+
+    elapsed = time.time() - start
+    if report is not None:
+        report.write('%s: %d documents in %.1fs (%.0f documents/s)\n' % (
+            source.name, count, elapsed, count / elapsed if elapsed else 0))
+    return count
@@ -9,8 +9,20 @@
     :copyright: (c) 2011 by Douglas Morato
     :license: BSD, see LICENSE for more details.
 """
-from tryton_sphinx import BaseSource, DataSource
-from tryton_sphinx.utils import iter_sql_models
+import os
+import sys
+import time
+import filecmp
+import tempfile
+import multiprocessing
+
+from tryton_sphinx import delta, realtime, planner, fingerprint, cluster, \
+    attributes, storage, searchd, validate
+from tryton_sphinx.metrics import Metrics
+from tryton_sphinx import DataSource, DistributedIndex
+from tryton_sphinx.profiles import PROFILES, profile_settings
+from tryton_sphinx.builder import build, build_many, list_databases, \
+    verify_fast
 
 INDEXER_SETTINGS = """
 #############################################################################
@@ -290,41 +302,495 @@ searchd
 # --eof--
 """
 
+def indexer_settings(indexer_plan=None):
+    """Returns the indexer settings, with the memory settings of the plan if
+    there is one
+    """
+    if indexer_plan is None:
+        return INDEXER_SETTINGS
+    return INDEXER_SETTINGS.replace(
+        '\tmem_limit\t\t= 32M',
+        '\tmem_limit\t\t= %s' % planner.format_size(indexer_plan.mem_limit)
+        ).replace(
+        '\t# write_buffer\t\t= 1M',
+        '\twrite_buffer\t\t= %s' % planner.format_size(
+            indexer_plan.write_buffer))
+
+
+def searchd_settings(dist_threads=0, storage_plans=None, settings=None):
+    """Returns the searchd settings. `dist_threads` is enabled when there are
+    distributed indexes to search in parallel. With storage plans the
+    indexes are not all preopened, every index sets its own `preopen`.
+    The :class:`tryton_sphinx.searchd.Setting` are written last.
+    """
+    text = SEARCHD_SETTINGS
+    if dist_threads:
+        text = text.replace('\t# dist_threads\t\t= 4',
+            '\tdist_threads\t\t= %d' % dist_threads)
+    if storage_plans:
+        text = text.replace('\tpreopen_indexes\t\t= 1',
+            '\tpreopen_indexes\t\t= 0')
+    if settings:
+        text = searchd.apply_settings(text, settings)
+    return text
+
+
+def tune_searchd(builds, cpus=None, memory=None, storage_plans=None,
+        max_matches=searchd.MAX_MATCHES):
+    """Returns the :class:`tryton_sphinx.searchd.Setting` of the searchd
+    host serving the indexes of the builds
+
+    :param cpus: The number of CPUs of the host (Default: the ones of this
+                 host)
+    :param memory: The memory of the host in bytes (Default: the available
+                   memory of this host)
+    """
+    sources = sum([database_build.sources for database_build in builds], [])
+    if storage_plans is not None:
+        index_memory = sum(plan.memory for plan in storage_plans)
+    else:
+        index_memory = sum(size.attributes + size.dictionary
+            for database_build in builds for size in database_build.sizes)
+    return searchd.plan_searchd(
+        cpus or multiprocessing.cpu_count(),
+        memory or planner.host_memory(),
+        index_memory,
+        len([source for source in sources
+            if not isinstance(source, DistributedIndex)]),
+        max(database_build.dist_threads for database_build in builds),
+        searchd.result_row_width(sources), max_matches)
+
+
+def apply_storage(builds, query_logs, memory=None, host_memory=None):
+    """Plans the storage of the indexes of the data sources of the builds
+    from their sizes and the searches of the query logs, sets the options
+    of their index blocks and returns a tuple `(plans, budget)`.
+
+    :param memory: The memory of searchd in bytes (Default: a share of the
+                   memory of its host)
+    :param host_memory: The memory of the searchd host in bytes (Default:
+                        the available memory of this host)
+    """
+    if memory is None:
+        memory = int((host_memory or planner.host_memory()) *
+            storage.SEARCHD_MEMORY_SHARE)
+    distributed = {}
+    for database_build in builds:
+        for source in database_build.sources:
+            if isinstance(source, DistributedIndex):
+                distributed[source.name] = source.locals
+    counts = storage.expand_counts(storage.read_query_logs(query_logs),
+        distributed)
+    plans = storage.plan_storage(sum([database_build.sizes
+        for database_build in builds], []), counts, memory)
+
+    by_name = dict((plan.name, plan) for plan in plans)
+    for database_build in builds:
+        for source in database_build.sources:
+            if isinstance(source, DataSource) and \
+                    source.index_name in by_name:
+                # The options may be shared with the delta or the shards
+                source.index_options = source.index_options + \
+                    by_name[source.index_name].options
+    return plans, memory
+
+
+def render_cluster(builds, layout, filename, indexer_plan=None,
+        storage_plans=None, settings=None):
+    """Returns a list of tuples `(filename, render)` of the configs of a
+    :class:`tryton_sphinx.cluster.ClusterLayout`: the one of the front node
+    in `filename`, with the distributed indexes searching the agents, and
+    the one of every node next to it with the indexes it builds and serves.
+    `render` streams a config into a file (see :func:`write_config`).
+    """
+    def render_front(file):
+        for index in layout.front:
+            index.write_to(file)
+        file.write(searchd_settings(settings=settings))
+
+    def render_node(sources):
+        def render(file):
+            for database_build in builds:
+                database_build.base_source.write_to(file)
+            for source in sources:
+                source.write_to(file)
+            file.write(indexer_settings(indexer_plan))
+            file.write(searchd_settings(0, storage_plans, settings))
+        return render
+
+    configs = [(filename, render_front)]
+    for node, sources in layout.nodes:
+        configs.append((cluster.node_filename(filename, node),
+            render_node(sources)))
+    return configs
+
+
+def write_config(filename, render, keep_unchanged=False):
+    """Streams a config into a temporary file next to `filename` with
+    `render(file)` and moves it over `filename`, so that indexer and
+    searchd never read a partly written config. With `keep_unchanged` a
+    previous config with the same content is kept as is.
+
+    Returns True if the config was written.
+    """
+    handle, temporary = tempfile.mkstemp(prefix='.%s.' % os.path.basename(
+        filename), dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            render(file)
+        if keep_unchanged and os.path.exists(filename) \
+                and filecmp.cmp(temporary, filename, shallow=False):
+            os.remove(temporary)
+            return False
+        # mkstemp creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.rename(temporary, filename)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return True
+
+
+def schema_filename(filename, database_name):
+    """Returns the name of the schema file of a database when several
+    databases are built at once: `sphinx.sql` becomes `sphinx.<db>.sql`
+    """
+    root, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (root, database_name, ext)
+
+
 if __name__ == '__main__':
     from optparse import OptionParser
-    usage = "usage: %prog [options] database filename"
+    usage = "usage: %prog [options] database [database ...] filename"
     parser = OptionParser(usage=usage)
     parser.add_option('-c', '--config', dest="config",
         default=None, help="The tryton configuration file to use")
+    parser.add_option('-d', '--delta', dest="delta", action="store_true",
+        default=False, help="Generate a main and a delta index per model")
+    parser.add_option('-r', '--realtime', dest="realtime",
+        action="store_true", default=False,
+        help="Generate a real-time index per model")
+    parser.add_option('-s', '--schema', dest="schema", default=None,
+        help="Write the SQL needed by the delta or real-time indexes to "
+            "this file")
+    parser.add_option('-a', '--all-databases', dest="all_databases",
+        action="store_true", default=False,
+        help="Generate the config of all the databases on the server")
+    parser.add_option('-j', '--jobs', dest="jobs", type="int", default=None,
+        help="Number of databases to introspect in parallel when several "
+            "databases are given (Default: the number of CPUs)")
+    parser.add_option('--shard-threshold', dest="shard_threshold",
+        type="int", default=None, help="Split the models with more rows than "
+            "this in id range shards searched through a distributed index")
+    parser.add_option('--max-shards', dest="max_shards", type="int",
+        default=None, help="The maximum number of shards of a model "
+            "(Default: the number of CPUs)")
+    parser.add_option('-p', '--plan', dest="plan", action="store_true",
+        default=False, help="Choose sql_range_step, mem_limit and "
+            "write_buffer from the statistics of the tables")
+    parser.add_option('-n', '--dry-run', dest="dry_run", action="store_true",
+        default=False, help="Print the plan and its reasons without "
+            "writing the config (implies --plan)")
+    parser.add_option('-m', '--memory', dest="memory", default=None,
+        help="The memory of the host running the indexer, eg. 8G "
+            "(Default: detected)")
+    parser.add_option('-J', '--join-rec-names', dest="join_rec_names",
+        action="store_true", default=False, help="Index the name of the "
+            "records targeted by Many2One fields as full text fields")
+    parser.add_option('-f', '--fast', dest="fast", action="store_true",
+        default=False, help="Read the models from the ir_model tables and "
+            "the PostgreSQL catalog instead of loading the modules")
+    parser.add_option('-x', '--xmlpipe', dest="xmlpipe",
+        action="store_true", default=False, help="Index the models with "
+            "select=1 Function fields from xmlpipe2 sources reading the "
+            "records through tryton")
+    parser.add_option('-b', '--batch-size', dest="batch_size", type="int",
+        default=1000, help="The number of records the xmlpipe2 sources "
+            "read at once (Default: 1000)")
+    parser.add_option('--profile', dest="profiles", action="append",
+        default=[], metavar="MODEL=PROFILE", help="The profile of the index "
+            "of a model (%s), may be repeated" % ', '.join(sorted(PROFILES)))
+    parser.add_option('--stored', dest="stored", action="append",
+        default=[], metavar="MODEL=FIELD[,FIELD...]", help="The fields of "
+            "a model its list views show, stored in its index so that the "
+            "search results need no query to the database, may be repeated")
+    parser.add_option('-A', '--autocomplete', dest="autocomplete",
+        action="store_true", default=False, help="Generate an autocomplete "
+            "index of the short text fields of every model")
+    parser.add_option('--autocomplete-profile', dest="autocomplete_profile",
+        default='prefix', help="The profile of the autocomplete indexes "
+            "(Default: prefix)")
+    parser.add_option('-i', '--incremental', dest="incremental",
+        action="store_true", default=False, help="Compare with the "
+            "fingerprints of the previous config, print the changed sources "
+            "and the indexer command rotating only their indexes, and keep "
+            "the config file if it did not change")
+    parser.add_option('-C', '--compact', dest="compact",
+        action="store_true", default=False, help="Map the fields to the "
+            "narrowest attribute types their values allow and print the "
+            "memory of the attributes before and after")
+    parser.add_option('--headroom', dest="headroom", type="float",
+        default=attributes.HEADROOM, help="The growth of the values the "
+            "compact bitfields leave room for (Default: %s)" % (
+                attributes.HEADROOM))
+    parser.add_option('-S', '--storage', dest="storage",
+        action="store_true", default=False, help="Choose docinfo, "
+            "ondisk_dict, preopen and mlock of every index from its size and "
+            "its searches in the query logs")
+    parser.add_option('-q', '--query-log', dest="query_logs",
+        action="append", default=[], metavar="FILE", help="A query log of "
+            "searchd to count the searches of the indexes from, may be "
+            "repeated")
+    parser.add_option('--searchd-memory', dest="searchd_memory",
+        default=None, help="The memory searchd may use for the attributes "
+            "and dictionaries, eg. 4G (Default: half of the available "
+            "memory)")
+    parser.add_option('-T', '--tune-searchd', dest="tune_searchd",
+        action="store_true", default=False, help="Size max_children, "
+            "dist_threads, read_buffer, the subtree caches and "
+            "max_packet_size after the searchd host and the indexes")
+    parser.add_option('--searchd-cpus', dest="searchd_cpus", type="int",
+        default=None, help="The number of CPUs of the searchd host "
+            "(Default: the ones of this host)")
+    parser.add_option('--searchd-ram', dest="searchd_ram", default=None,
+        help="The memory of the searchd host, eg. 16G (Default: the "
+            "available memory of this host)")
+    parser.add_option('--searchd-option', dest="searchd_options",
+        action="append", default=[], metavar="OPTION=VALUE",
+        help="A value of the searchd block overriding the computed or the "
+            "default one, may be repeated")
+    parser.add_option('--metrics', dest="metrics", default=None,
+        metavar="FILE", help="Write the timings and counts of the "
+            "generation to this file, as JSON if it ends with .json and in "
+            "the Prometheus text format otherwise")
+    parser.add_option('--validate', dest="validate", action="store_true",
+        default=False, help="Explain the ranged queries of the sources for "
+            "a step of their ids, print the sequential scans, nested loops "
+            "and costly steps, the missing indexes and the estimated time "
+            "of every source, without writing the config")
+    parser.add_option('--validate-analyze', dest="validate_analyze",
+        action="store_true", default=False, help="With --validate, run "
+            "one step of every query to time it instead of estimating "
+            "from its cost")
+    parser.add_option('--cluster', dest="cluster", default=None,
+        metavar="INVENTORY", help="Spread the indexes over the nodes of "
+            "this inventory file: write the config of every node next to "
+            "the filename and the one of the front node, searching them as "
+            "agents, in the filename")
+    parser.add_option('--verify-fast', dest="verify_fast",
+        action="store_true", default=False, help="Print the differences "
+            "between the config of --fast and the one of the modules "
+            "without writing the config")
     (options, args) = parser.parse_args()
-
-    if len(args) != 2:
-        parser.error("Expected 2 argument got %d" % len(args))
+    options.plan = options.plan or options.dry_run
+
+    if options.all_databases:
+        if len(args) != 1:
+            parser.error("Expected 1 argument got %d" % len(args))
+    elif len(args) < 2:
+        parser.error("Expected at least 2 arguments got %d" % len(args))
+
+    if options.delta and options.realtime:
+        parser.error("--delta and --realtime are mutually exclusive")
+
+    if options.shard_threshold and (options.delta or options.realtime):
+        parser.error("--shard-threshold cannot be used with --delta or "
+            "--realtime")
+
+    if options.xmlpipe and (options.delta or options.realtime
+            or options.fast):
+        parser.error("--xmlpipe cannot be used with --delta, --realtime or "
+            "--fast")
+
+    if options.validate_analyze and not options.validate:
+        parser.error("--validate-analyze needs --validate")
+
+    if options.storage and options.realtime:
+        parser.error("--storage cannot be used with --realtime")
+    if options.query_logs and not options.storage:
+        parser.error("--query-log needs --storage")
+
+    try:
+        searchd_overrides = searchd.parse_overrides(options.searchd_options)
+        max_matches = int(dict(searchd_overrides).get('max_matches',
+            searchd.MAX_MATCHES))
+    except ValueError as exception:
+        parser.error(str(exception))
+    searchd_ram = options.searchd_ram and planner.parse_size(
+        options.searchd_ram)
+
+    if options.compact and options.realtime:
+        parser.error("--compact cannot be used with --realtime")
+
+    inventory = None
+    if options.cluster is not None:
+        if options.realtime:
+            parser.error("--cluster cannot be used with --realtime")
+        try:
+            inventory = cluster.read_inventory(options.cluster)
+        except ValueError as exception:
+            parser.error(str(exception))
+    if options.headroom < 1:
+        parser.error("--headroom must be at least 1")
+
+    profiles = {}
+    for profile in options.profiles:
+        model_name, _, profile_name = profile.partition('=')
+        if profile_name not in PROFILES:
+            parser.error("Unknown profile %s" % profile_name)
+        profiles[model_name] = profile_name
+    if options.autocomplete_profile not in PROFILES:
+        parser.error("Unknown profile %s" % options.autocomplete_profile)
+
+    if options.stored and options.realtime:
+        parser.error("--stored cannot be used with --realtime")
+    stored = {}
+    for value in options.stored:
+        model_name, _, names = value.partition('=')
+        if not names.strip():
+            parser.error("Expected MODEL=FIELD[,FIELD...], got %s" % value)
+        stored[model_name] = [name.strip() for name in names.split(',')
+            if name.strip()]
 
     if options.config is not None:
         from trytond.config import CONFIG
         CONFIG.configfile = options.config
         CONFIG.load()
 
-    # Register the classes and get all the modules from the pool
-    from trytond.modules import register_classes
-    register_classes()
-
-    from trytond.pool import Pool
-    pool = Pool(args[0])
-    pool.init()
-
-    with open(args[1], 'wb') as file:
-        base_source = BaseSource.from_tryton_config(args[0])
-        file.write(base_source.as_string())
-
-        for model_object in iter_sql_models(pool):
-            ds = DataSource.from_model(model_object, base_source)
-            if not ds.sql_query:
-                # If there are no attributes which have select=1 then there will
-                # be no sql query, so just ignore those data sources
-                continue
-            file.write(ds.as_string())
-
-        file.write(INDEXER_SETTINGS)
-        file.write(SEARCHD_SETTINGS)
+    if not options.fast or options.verify_fast:
+        # Register the classes and get all the modules from the pool
+        from trytond.modules import register_classes
+        register_classes()
+
+    filename = args[-1]
+    if options.all_databases:
+        database_names = list_databases()
+    else:
+        database_names = args[:-1]
+
+    # A single database keeps the unprefixed names
+    several = options.all_databases or len(database_names) > 1
+    build_options = dict(
+        delta=options.delta,
+        realtime=options.realtime,
+        shard_threshold=options.shard_threshold,
+        max_shards=options.max_shards,
+        plan=options.plan,
+        join_rec_names=options.join_rec_names,
+        fast=options.fast,
+        xmlpipe=options.xmlpipe,
+        batch_size=options.batch_size,
+        profiles=profiles,
+        autocomplete=options.autocomplete and options.autocomplete_profile,
+        compact=options.compact,
+        headroom=options.headroom,
+        storage=options.storage,
+        stored=stored,
+        )
+    if options.verify_fast:
+        differences = []
+        for database_name in database_names:
+            differences.extend('%s: %s' % (database_name, difference)
+                for difference in verify_fast(database_name,
+                    **build_options))
+        sys.stdout.write(''.join(line + '\n' for line in differences))
+        sys.exit(differences and 1 or 0)
+
+    if not several:
+        builds = [build(database_names[0], **build_options)]
+    else:
+        builds = build_many(database_names, options.jobs, **build_options)
+
+    if options.validate:
+        validations = []
+        for database_build in builds:
+            validations.extend(validate.validate_sources(
+                database_build.database_name, database_build.sources,
+                options.validate_analyze))
+        sys.stdout.write(validate.report(validations))
+        sys.exit([validation for validation in validations
+            if validation.findings] and 1 or 0)
+
+    if options.compact:
+        sys.stdout.write(attributes.report(sum([database_build.estimates
+            for database_build in builds], [])))
+
+    storage_plans = None
+    if options.storage:
+        storage_plans, budget = apply_storage(builds, options.query_logs,
+            options.searchd_memory and planner.parse_size(
+                options.searchd_memory), searchd_ram)
+
+    settings = []
+    if options.tune_searchd:
+        settings = tune_searchd(builds, options.searchd_cpus, searchd_ram,
+            storage_plans, max_matches)
+    settings = settings + profile_settings(sum([database_build.sources
+        for database_build in builds], []))
+    settings = searchd.override(settings, searchd_overrides)
+
+    layout = None
+    if inventory is not None:
+        layout = cluster.plan_cluster(inventory,
+            sum([database_build.sources for database_build in builds], []),
+            dict((size.name, size.attributes + size.dictionary)
+                for database_build in builds
+                for size in database_build.sizes))
+        sys.stdout.write(cluster.report(layout))
+
+    indexer_plan = None
+    if options.plan:
+        plans = sum([database_build.plans for database_build in builds], [])
+        indexer_plan = planner.plan_indexer(plans,
+            options.memory and planner.parse_size(options.memory))
+        if options.dry_run:
+            sys.stdout.write(planner.report(plans, indexer_plan))
+            if storage_plans is not None:
+                sys.stdout.write('\n' + storage.report(storage_plans,
+                    budget))
+            sys.exit(0)
+
+    metrics = Metrics()
+    for database_build in builds:
+        metrics.update(database_build.metrics)
+
+    if layout is not None:
+        configs = render_cluster(builds, layout, filename, indexer_plan,
+            storage_plans, settings)
+    else:
+        def render(file):
+            for database_build in builds:
+                database_build.write_to(file)
+            file.write(indexer_settings(indexer_plan))
+            file.write(searchd_settings(
+                max(database_build.dist_threads
+                    for database_build in builds),
+                storage_plans, settings))
+        configs = [(filename, render)]
+
+    current = fingerprint.fingerprints(builds)
+    if options.incremental:
+        changes = fingerprint.Changes(fingerprint.load(filename), current)
+        sys.stdout.write(changes.report(filename))
+
+    with metrics.timer('buildconf_seconds', stage='render'):
+        for config_file, render in configs:
+            write_config(config_file, render, options.incremental)
+    fingerprint.save(filename, current)
+
+    if options.metrics is not None:
+        metrics.set('buildconf_last_run_timestamp', int(time.time()))
+        metrics.write(options.metrics)
+
+    if options.schema is not None:
+        schema = realtime.schema_sql if options.realtime else delta.schema_sql
+        for database_build in builds:
+            schema_file = options.schema
+            if several:
+                schema_file = schema_filename(options.schema,
+                    database_build.database_name)
+            with open(schema_file, 'wb') as file:
+                file.write(schema(database_build.tables))
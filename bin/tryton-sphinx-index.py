@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-index
+
+    A script which builds the indexes of a config generated with
+    `tryton-sphinx-buildconf.py` with several indexer processes at once
+    instead of `indexer --all`, and rotates every index as soon as it is
+    built.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+
+from tryton_sphinx.planner import parse_size
+from tryton_sphinx.metrics import Metrics, IndexerResult, \
+    record_indexer_result
+from tryton_sphinx.scheduler import read_config, index_jobs, count_changes, \
+    order_jobs, budget_config, run_jobs
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] filename [index ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-c', '--config', dest="config",
+        default=None, help="The tryton configuration file to use (needed "
+            "by --order changes and --metrics)")
+    parser.add_option('-i', '--indexer', dest="indexer",
+        default='indexer', help="The sphinx indexer program to use")
+    parser.add_option('-j', '--jobs', dest="jobs", type="int", default=None,
+        help="Number of indexers to run at once (Default: the number of "
+            "CPUs)")
+    parser.add_option('-o', '--order', dest="order", default='size',
+        type="choice", choices=['size', 'changes', 'name'],
+        help="Start the largest indexes first (size), the ones with the "
+            "most rows written since they were built (changes) or by name "
+            "(Default: size)")
+    parser.add_option('--max-iops', dest="max_iops", type="int",
+        default=None, help="The I/O calls per second shared by all the "
+            "indexers")
+    parser.add_option('--max-iosize', dest="max_iosize", default=None,
+        help="The maximum size of an I/O call of the indexers, eg. 1M")
+    parser.add_option('--no-rotate', dest="rotate", action="store_false",
+        default=True, help="Do not rotate the indexes once they are built "
+            "(when searchd is not running)")
+    parser.add_option('--metrics', dest="metrics", default=None,
+        metavar="FILE", help="Write the documents, bytes, time and pending "
+            "changes of every index to this file, as JSON if it ends with "
+            ".json and in the Prometheus text format otherwise")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1:
+        parser.error("Expected at least 1 argument got %d" % len(args))
+
+    filename, index_names = args[0], args[1:]
+    jobs = index_jobs(read_config(filename))
+    if index_names:
+        jobs = [job for job in jobs if job.name in index_names]
+    concurrency = options.jobs or multiprocessing.cpu_count()
+
+    if options.order == 'changes' or options.metrics:
+        if options.config is not None:
+            from trytond.config import CONFIG
+            CONFIG.configfile = options.config
+            CONFIG.load()
+        count_changes(jobs)
+    jobs = order_jobs(jobs, options.order)
+
+    # Every indexer gets its share of the I/O budget and of mem_limit
+    with open(filename) as file:
+        text = budget_config(file.read(), min(concurrency, len(jobs) or 1),
+            options.max_iops,
+            options.max_iosize and parse_size(options.max_iosize))
+    descriptor, budget_filename = tempfile.mkstemp(suffix='.conf')
+    try:
+        with os.fdopen(descriptor, 'w') as file:
+            file.write(text)
+        results = run_jobs(jobs, budget_filename, concurrency,
+            options.rotate, options.indexer)
+    finally:
+        os.remove(budget_filename)
+
+    if options.metrics is not None:
+        metrics = Metrics()
+        for job, returncode, elapsed in results:
+            # The changes were counted before the build: what the index
+            # had to catch up with since the previous one
+            if job.changes is not None:
+                metrics.set('index_pending_changes', job.changes,
+                    index=job.name)
+            record_indexer_result(metrics,
+                job.result or IndexerResult(job.name, seconds=elapsed),
+                returncode == 0)
+        metrics.write(options.metrics)
+
+    failed = [job.name for job, returncode, _ in results if returncode]
+    if failed:
+        sys.stderr.write("Indexing failed for: %s\n" % ', '.join(failed))
+        sys.exit(1)
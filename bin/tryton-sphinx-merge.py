@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-merge
+
+    A script which merges the delta indexes generated with
+    `tryton-sphinx-buildconf.py --delta` into their main indexes and moves the
+    counters forward. Meant to be run on a schedule (e.g. from cron).
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import sys
+import subprocess
+
+from tryton_sphinx.delta import DELTA_SUFFIX, advance_counter
+
+
+def iter_delta_indexes(filename):
+    """Iterate over the names of the main indexes which have a delta index in
+    the given sphinx config file
+    """
+    pattern = re.compile(r'^index\s+(\S+)%s\s*$' % DELTA_SUFFIX)
+    with open(filename) as file:
+        for line in file:
+            match = pattern.match(line)
+            if match:
+                yield match.group(1)
+
+
+def merge(filename, index_name, indexer='indexer'):
+    """Merges the delta of the given index into the main index and rotates
+    it. Returns True if the indexer succeeded.
+    """
+    return subprocess.call([
+        indexer, '--config', filename,
+        '--merge', index_name, index_name + DELTA_SUFFIX,
+        '--rotate',
+        ]) == 0
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] database filename [index ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-c', '--config', dest="config",
+        default=None, help="The tryton configuration file to use")
+    parser.add_option('-i', '--indexer', dest="indexer",
+        default='indexer', help="The sphinx indexer program to use")
+    parser.add_option('-p', '--prefix', dest="prefix", default='',
+        help="The prefix of the index names of the database, for configs "
+            "generated from several databases (usually <database>_)")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 2:
+        parser.error("Expected at least 2 arguments got %d" % len(args))
+
+    if options.config is not None:
+        from trytond.config import CONFIG
+        CONFIG.configfile = options.config
+        CONFIG.load()
+
+    from trytond.transaction import Transaction
+
+    database, filename = args[0], args[1]
+    index_names = args[2:] or [name for name in iter_delta_indexes(filename)
+        if name.startswith(options.prefix)]
+
+    failed = []
+    for index_name in index_names:
+        if not merge(filename, index_name, options.indexer):
+            failed.append(index_name)
+            continue
+        with Transaction().start(database, 0):
+            cursor = Transaction().cursor
+            advance_counter(cursor, index_name,
+                index_name[len(options.prefix):])
+            cursor.commit()
+
+    if failed:
+        sys.stderr.write("Merge failed for: %s\n" % ', '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-querylog
+
+    A script which reads the query logs of searchd and prints the latency
+    percentiles of every index, the slowest query shapes and the filters on
+    columns which are not attributes of the generated config.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+
+from tryton_sphinx.querylog import Analysis, index_attributes, open_log
+from tryton_sphinx.scheduler import read_config
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] logfile [logfile ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-s', '--sphinx-config', dest="sphinx_config",
+        default=None, help="The sphinx config generated by "
+            "tryton-sphinx-buildconf.py, to report the filters on columns "
+            "which are not attributes")
+    parser.add_option('-n', '--shapes', dest="shapes", type="int",
+        default=10, help="The number of slowest query shapes to print "
+            "(Default: 10)")
+    parser.add_option('--json', dest="json", action="store_true",
+        default=False, help="Print the analysis as JSON")
+    (options, args) = parser.parse_args()
+
+    if not args:
+        parser.error("Expected at least 1 argument got 0")
+
+    attributes = None
+    if options.sphinx_config is not None:
+        attributes = index_attributes(read_config(options.sphinx_config))
+
+    analysis = Analysis(attributes)
+    for filename in args:
+        if filename == '-':
+            analysis.read(sys.stdin)
+            continue
+        with open_log(filename) as file:
+            analysis.read(file)
+
+    if options.json:
+        sys.stdout.write(analysis.as_json(options.shapes) + '\n')
+    else:
+        sys.stdout.write(analysis.report(options.shapes))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-rtworker
+
+    A script which drains the change-capture queue of a tryton database into
+    the real-time indexes generated with `tryton-sphinx-buildconf.py
+    --realtime`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+from tryton_sphinx.realtime import RealtimeIndex, RealtimeWorker, connect, \
+    populate_sql
+from tryton_sphinx.utils import iter_sql_models
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] database"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-c', '--config', dest="config",
+        default=None, help="The tryton configuration file to use")
+    parser.add_option('-H', '--host', dest="host", default='127.0.0.1',
+        help="The searchd host (Default: 127.0.0.1)")
+    parser.add_option('-P', '--port', dest="port", type="int", default=9306,
+        help="The searchd SphinxQL port (Default: 9306)")
+    parser.add_option('-b', '--batch-size', dest="batch_size", type="int",
+        default=1000, help="Maximum number of changes pushed at once "
+            "(Default: 1000)")
+    parser.add_option('-f', '--flush-interval', dest="flush_interval",
+        type="float", default=1.0, help="Seconds to wait for more changes "
+            "once the queue is drained (Default: 1.0)")
+    parser.add_option('-p', '--prefix', dest="prefix", default='',
+        help="The prefix of the index names of the database, for configs "
+            "generated from several databases (usually <database>_)")
+    parser.add_option('--populate', dest="populate", action="store_true",
+        default=False, help="Queue every record before draining, to fill "
+            "empty indexes")
+    parser.add_option('--once', dest="once", action="store_true",
+        default=False, help="Exit once the queue is empty")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Expected 1 argument got %d" % len(args))
+
+    if options.config is not None:
+        from trytond.config import CONFIG
+        CONFIG.configfile = options.config
+        CONFIG.load()
+
+    # Register the classes and get all the modules from the pool
+    from trytond.modules import register_classes
+    register_classes()
+
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+    pool = Pool(args[0])
+    pool.init()
+
+    indexes = []
+    for model_object in iter_sql_models(pool):
+        index = RealtimeIndex.from_model(model_object, options.prefix)
+        if index.attributes:
+            indexes.append(index)
+
+    if options.populate:
+        with Transaction().start(args[0], 0):
+            cursor = Transaction().cursor
+            for index in indexes:
+                cursor.execute(populate_sql(index.table))
+            cursor.commit()
+
+    worker = RealtimeWorker(args[0], indexes,
+        connect(options.host, options.port),
+        batch_size=options.batch_size,
+        flush_interval=options.flush_interval)
+    worker.run(forever=not options.once)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-warmup
+
+    A script which warms up the indexes of a config generated with
+    `tryton-sphinx-buildconf.py` once `indexer --rotate` has rotated them:
+    it replays the most frequent query shapes of every index found in the
+    query log against searchd, optionally reading the files of the indexes
+    ahead, and prints how long it took and the latencies before and after.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+
+from tryton_sphinx.client import Client, ConnectionPool
+from tryton_sphinx.querylog import open_log
+from tryton_sphinx.scheduler import read_config
+from tryton_sphinx.warmup import HotQueries, index_paths, searched_indexes, \
+    hot_statements, wait_rotation, warm_up
+
+
+def sphinxql_address(blocks):
+    """Returns the `(host, port)` of the `mysql41` listen point of the
+    searchd block of the config, or None
+    """
+    for block in blocks:
+        if block.section != 'searchd':
+            continue
+        for listen in block.options.get('listen', []):
+            parts = listen.split(':')
+            if parts[-1] == 'mysql41' and len(parts) in (2, 3):
+                host = parts[0] if len(parts) == 3 else '127.0.0.1'
+                return host, int(parts[-2])
+    return None
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] filename [index ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-l', '--query-log', dest="query_logs",
+        action="append", default=[], metavar="FILE", help="A query log of "
+            "searchd, may be repeated (Default: the query_log of the "
+            "searchd block)")
+    parser.add_option('-n', '--queries', dest="queries", type="int",
+        default=20, help="The number of most frequent query shapes of "
+            "every index to replay (Default: 20)")
+    parser.add_option('-j', '--concurrency', dest="concurrency",
+        type="int", default=4, help="The number of queries replayed at "
+            "once (Default: 4)")
+    parser.add_option('--host', dest="host", default=None,
+        help="The host of searchd (Default: the one of the mysql41 listen "
+            "point of the config)")
+    parser.add_option('--port', dest="port", type="int", default=None,
+        help="The SphinxQL port of searchd (Default: the one of the "
+            "mysql41 listen point of the config)")
+    parser.add_option('--preread', dest="preread", action="store_true",
+        default=False, help="Read the .spa, .spi and .spd files of the "
+            "indexes ahead of the queries")
+    parser.add_option('--wait', dest="wait", type="float", default=60,
+        help="The seconds to wait for searchd to rotate the new files of "
+            "the indexes in (Default: 60)")
+    parser.add_option('--no-measure', dest="measure", action="store_false",
+        default=True, help="Do not replay the queries a second time to "
+            "time the warm indexes")
+    parser.add_option('--json', dest="json", action="store_true",
+        default=False, help="Print the result as JSON")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1:
+        parser.error("Expected at least 1 argument got %d" % len(args))
+    if options.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    filename, index_names = args[0], args[1:]
+    blocks = read_config(filename)
+    paths = index_paths(blocks)
+    if index_names:
+        unknown = [name for name in index_names if name not in paths]
+        if unknown:
+            parser.error("Unknown indexes: %s" % ', '.join(unknown))
+    else:
+        index_names = sorted(paths)
+
+    query_logs = options.query_logs or [block.get('query_log')
+        for block in blocks
+        if block.section == 'searchd' and block.get('query_log')]
+    if not query_logs:
+        parser.error("The config has no query_log, give one with "
+            "--query-log")
+
+    address = sphinxql_address(blocks) or ('127.0.0.1', 9306)
+    host, port = options.host or address[0], options.port or address[1]
+
+    hot = HotQueries()
+    for query_log in query_logs:
+        with open_log(query_log) as file:
+            hot.read(file)
+    statements = hot_statements(hot, searched_indexes(blocks, index_names),
+        options.queries)
+
+    index_files = [paths[name] for name in index_names]
+    if not wait_rotation(index_files, options.wait):
+        sys.stderr.write("searchd has not rotated all the indexes in after "
+            "%ss, warming up anyway\n" % options.wait)
+
+    client = Client(ConnectionPool(host, port, size=options.concurrency))
+    result = warm_up(client, index_names, statements, options.concurrency,
+        index_files if options.preread else None, options.measure)
+
+    if options.json:
+        sys.stdout.write(result.as_json() + '\n')
+    else:
+        sys.stdout.write(result.report())
+    if statements and result.errors == result.queries * (
+            2 if options.measure else 1):
+        sys.exit(1)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    tryton-sphinx-xmlpipe
+
+    The command run by the indexer for the xmlpipe2 sources generated with
+    `tryton-sphinx-buildconf.py --xmlpipe`. Streams the records of a model,
+    with its computed fields, as an xmlpipe2 docset on stdout.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+
+from tryton_sphinx.xmlpipe import XmlpipeSource, stream_documents
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] database model"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-c', '--config', dest="config",
+        default=None, help="The tryton configuration file to use")
+    parser.add_option('-b', '--batch-size', dest="batch_size", type="int",
+        default=1000, help="The number of records read at once "
+            "(Default: 1000)")
+    parser.add_option('-l', '--language', dest="language", default=None,
+        help="The language of the translated fields (Default: the "
+            "language of the database)")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("Expected 2 arguments got %d" % len(args))
+
+    if options.config is not None:
+        from trytond.config import CONFIG
+        CONFIG.configfile = options.config
+        CONFIG.load()
+
+    # Register the classes and get all the modules from the pool
+    from trytond.modules import register_classes
+    register_classes()
+
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+    database_name, model_name = args
+    pool = Pool(database_name)
+    pool.init()
+    model_object = pool.get(model_name)
+
+    source = XmlpipeSource.from_model(model_object, database_name,
+        batch_size=options.batch_size)
+    context = {}
+    if options.language:
+        context['language'] = options.language
+    with Transaction().start(database_name, 0, context=context):
+        stream_documents(source, model_object, Transaction().cursor,
+            sys.stdout, options.batch_size)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_autocomplete
+
+    Compares the latency of type-ahead searches on a sample of the values of
+    a text field: an `ilike` in PostgreSQL, an infix wildcard on the main
+    index and a prefix search on the autocomplete index. Needs the tryton
+    database and a searchd serving a config in which the main index of the
+    model has the `infix` profile, so that the wildcard finds the same
+    records as the `ilike`:
+
+        tryton-sphinx-buildconf.py -c trytond.conf --autocomplete \
+            --profile party.party=infix database sphinx.conf
+        python bench_autocomplete.py -c trytond.conf database party_party \
+            name sphinx.conf
+
+    The sample searches the first 2 to 5 characters of the first word of
+    random values of the field, the way users type. The prefixes shorter
+    than the `min_infix_len` or `min_prefix_len` of either index are left
+    out, as the wildcards would not find them. The sample is the same on
+    every run (`--seed`) as long as the table does not change, so that the
+    results of several configs or hosts can be compared.
+
+    Without a database nor searchd, `--fake` runs the same searches on a
+    synthetic sample of product names served by
+    :class:`tryton_sphinx.testing.FakeSphinxQL`, with a scan of the names
+    in place of the `ilike`. Its latencies are the ones of the client and
+    of the fake, not of searchd: it checks the script and the sample.
+
+        python bench_autocomplete.py --fake
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import time
+import random
+
+from tryton_sphinx.client import Client, ConnectionPool, escape_match
+from tryton_sphinx.profiles import AUTOCOMPLETE_SUFFIX, profile_options
+from tryton_sphinx.scheduler import read_config
+from tryton_sphinx.testing import FakeSphinxQL
+
+#: The words of the synthetic product names of `--fake`
+FAKE_WORDS = ['apple', 'iphone', 'ipad', 'ipod', 'macbook', 'charger',
+    'cable', 'case', 'screen', 'keyboard', 'mouse', 'adapter', 'battery',
+    'phone', 'tablet', 'speaker', 'headphones', 'dock', 'stand', 'cover']
+
+
+def prefixes_of(values, seed=0, shortest=2):
+    """Returns the prefixes of 2 to 5 characters of the first word of the
+    values, leaving out the ones shorter than `shortest`
+    """
+    rng = random.Random(seed)
+    prefixes = []
+    for value in values:
+        words = value.split()
+        if not words:
+            continue
+        prefix = words[0][:rng.randint(2, max(shortest, 5))]
+        if len(prefix) >= shortest:
+            prefixes.append(prefix)
+    return prefixes
+
+
+def sample_prefixes(cursor, table, field, count, seed=0, shortest=2):
+    """Returns the prefixes (see :func:`prefixes_of`) of `count` values of
+    the field, the same for the same seed and table
+    """
+    cursor.execute('SELECT setseed(%s)', (rng_seed(seed),))
+    cursor.execute('SELECT "%s" FROM "%s" WHERE "%s" IS NOT NULL '
+        'ORDER BY random(), "id" LIMIT %%s' % (field, table, field),
+        (count,))
+    return prefixes_of([value for value, in cursor.fetchall()], seed,
+        shortest)
+
+
+def fake_values(count, seed=0):
+    """Returns `count` synthetic product names, the same for the same seed
+    """
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(FAKE_WORDS).capitalize()
+        for _ in xrange(rng.randint(1, 3))) for _ in xrange(count)]
+
+
+def rng_seed(seed):
+    """Returns the seed of PostgreSQL, between -1 and 1, for an integer
+    seed
+    """
+    return random.Random(seed).uniform(-1, 1)
+
+
+def index_lengths(blocks, index):
+    """Returns a tuple `(min_infix_len, min_prefix_len)` of an index of
+    the config (the ones of its first local index if it is distributed), 0
+    for the ones it has not, or None if the config has no such index
+    """
+    by_name = dict((block.name, block) for block in blocks
+        if block.section == 'index')
+    block = by_name.get(index)
+    if block is not None and block.get('type') == 'distributed' \
+            and block.options.get('local'):
+        block = by_name.get(block.options['local'][0])
+    if block is None:
+        return None
+    return (int(block.get('min_infix_len', 0)),
+        int(block.get('min_prefix_len', 0)))
+
+
+def timings(function, prefixes):
+    """Returns the sorted latencies in milliseconds of the function called
+    with every prefix
+    """
+    result = []
+    for prefix in prefixes:
+        start = time.time()
+        function(prefix)
+        result.append((time.time() - start) * 1000)
+    return sorted(result)
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def bench(prefixes, searches):
+    """Returns the report of the latencies of the searches, a list of
+    `(label, function)` tuples, on the prefixes
+    """
+    lines = ['%-24s %10s %10s %10s' % ('', 'p50 ms', 'p95 ms', 'max ms')]
+    for label, function in searches:
+        function(prefixes[0])
+        values = timings(function, prefixes)
+        lines.append('%-24s %10.2f %10.2f %10.2f' % (label,
+            percentile(values, 0.5), percentile(values, 0.95), values[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def wildcard_searches(client, index):
+    """Returns the `(label, function)` tuples of the searches of the
+    prefixes on the main and on the autocomplete index
+    """
+    def main_index(prefix):
+        client.search(index, raw_text='*%s*' % escape_match(prefix),
+            limit=10)
+
+    def autocomplete_index(prefix):
+        client.search(index + AUTOCOMPLETE_SUFFIX,
+            raw_text=escape_match(prefix) + '*', limit=10)
+
+    return [('infix index *infix*', main_index),
+        ('autocomplete prefix*', autocomplete_index)]
+
+
+def run_fake(count, seed=0):
+    """Returns the report of the searches of `count` synthetic product
+    names on :class:`tryton_sphinx.testing.FakeSphinxQL`, with the lengths
+    of the `infix` profile and of the `prefix` profile of the autocomplete
+    index
+    """
+    values = fake_values(count, seed)
+    server = FakeSphinxQL()
+    for id, value in enumerate(values, 1):
+        server.add('product_template', id, name=value)
+        server.add('product_template' + AUTOCOMPLETE_SUFFIX, id, name=value)
+    client = Client(ConnectionPool(connection_factory=server.connect))
+    shortest = max(2, int(dict(profile_options('infix'))['min_infix_len']),
+        int(dict(profile_options('prefix'))['min_prefix_len']))
+    prefixes = prefixes_of(values, seed, shortest)
+
+    def scan(prefix):
+        prefix = prefix.lower()
+        [value for value in values if prefix in value.lower()][:10]
+
+    return '%d searches of prefixes of %d synthetic names (seed %d, ' \
+        'shortest %d) on FakeSphinxQL\n\n' % (len(prefixes), len(values),
+            seed, shortest) + bench(prefixes,
+                [('scan (in place of ilike)', scan)]
+                + wildcard_searches(client, 'product_template'))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = "usage: %prog [options] database table field sphinx.conf\n" \
+        "       %prog --fake [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-c', '--config', dest="config",
+        default=None, help="The tryton configuration file to use")
+    parser.add_option('-H', '--host', dest="host", default='127.0.0.1',
+        help="The searchd host (Default: 127.0.0.1)")
+    parser.add_option('-P', '--port', dest="port", type="int", default=9306,
+        help="The searchd SphinxQL port (Default: 9306)")
+    parser.add_option('-n', '--samples', dest="samples", type="int",
+        default=200, help="The number of searches (Default: 200)")
+    parser.add_option('-p', '--prefix', dest="prefix", default='',
+        help="The prefix of the index names")
+    parser.add_option('-s', '--seed', dest="seed", type="int", default=0,
+        help="The seed of the sample (Default: 0)")
+    parser.add_option('--fake', dest="fake", action="store_true",
+        default=False, help="Search synthetic names on FakeSphinxQL, "
+            "without a database nor searchd")
+    (options, args) = parser.parse_args()
+
+    if options.fake:
+        if args:
+            parser.error("--fake takes no argument")
+        sys.stdout.write(run_fake(options.samples, options.seed))
+        sys.exit(0)
+
+    if len(args) != 4:
+        parser.error("Expected 4 arguments got %d" % len(args))
+
+    database_name, table, field, sphinx_config = args
+    index = options.prefix + table
+    blocks = read_config(sphinx_config)
+    lengths = index_lengths(blocks, index)
+    autocomplete_lengths = index_lengths(blocks, index + AUTOCOMPLETE_SUFFIX)
+    if lengths is None or autocomplete_lengths is None:
+        parser.error("%s has no index %s or no autocomplete index, generate "
+            "it with --autocomplete" % (sphinx_config, index))
+    if not lengths[0]:
+        parser.error("The index %s has no min_infix_len, the wildcard would "
+            "not find infixes: generate it with --profile <model>=infix"
+            % index)
+    # The wildcards find nothing below the min_infix_len or min_prefix_len
+    shortest = max((2,) + lengths + autocomplete_lengths)
+
+    if options.config is not None:
+        from trytond.config import CONFIG
+        CONFIG.configfile = options.config
+        CONFIG.load()
+
+    from trytond.transaction import Transaction
+    client = Client(ConnectionPool(options.host, options.port, size=1))
+
+    with Transaction().start(database_name, 0):
+        cursor = Transaction().cursor
+        prefixes = sample_prefixes(cursor, table, field, options.samples,
+            options.seed, shortest)
+
+        def ilike(prefix):
+            cursor.execute('SELECT "id" FROM "%s" WHERE "%s" ILIKE %%s '
+                'LIMIT 10' % (table, field), ('%' + prefix + '%',))
+            cursor.fetchall()
+
+        sys.stdout.write('%d searches of prefixes of %s.%s (seed %d, '
+            'shortest %d)\n\n' % (len(prefixes), table, field,
+                options.seed, shortest))
+        sys.stdout.write(bench(prefixes, [('SQL ilike', ilike)]
+            + wildcard_searches(client, index)))
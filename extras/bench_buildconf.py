@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_buildconf
+
+    Measures how the stages of `tryton-sphinx-buildconf.py` scale with the
+    number of models and columns, on a synthetic pool of models which needs
+    no database (only trytond to be importable).
+
+        python bench_buildconf.py -m 2000 -c 30 -o results.json
+        python bench_buildconf.py -m 2000 -c 30 --compare results.json
+
+    For every stage the best wall time of the runs, the number of objects
+    it retains (those tracked by the garbage collector which are still
+    alive after a collection, not the ones it allocated) and the peak RSS of
+    the process so far are reported. The peak RSS only grows: a stage shows
+    more than the previous one only if it needed more memory than all of
+    them. The results are saved as JSON with `--output` to compare later
+    runs (eg. of another version) with `--compare`.
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import gc
+import sys
+import time
+import json
+import random
+import resource
+from StringIO import StringIO
+
+from trytond.config import CONFIG
+from trytond.model import ModelSQL, fields
+
+from tryton_sphinx import BaseSource, DataSource
+from tryton_sphinx.utils import iter_sql_models, get_attributes
+
+#: The default mix of the columns of the models, as the relative weights of
+#: the field types
+DEFAULT_MIX = 'char:4,text:1,selection:1,integer:2,boolean:1,datetime:1,' \
+    'float:1,many2one:2,one2many:1,many2many:1,binary:1'
+
+FIELDS = {
+    'char': lambda target: fields.Char('Char'),
+    'text': lambda target: fields.Text('Text'),
+    'selection': lambda target: fields.Selection([('a', 'A')], 'Selection'),
+    'integer': lambda target: fields.Integer('Integer'),
+    'biginteger': lambda target: fields.BigInteger('Big Integer'),
+    'boolean': lambda target: fields.Boolean('Boolean'),
+    'datetime': lambda target: fields.DateTime('Date Time'),
+    'float': lambda target: fields.Float('Float'),
+    'numeric': lambda target: fields.Numeric('Numeric'),
+    'binary': lambda target: fields.Binary('Binary'),
+    'many2one': lambda target: fields.Many2One(target, 'Many2One'),
+    'one2many': lambda target: fields.One2Many(target, 'field_0',
+        'One2Many'),
+    'many2many': lambda target: fields.Many2Many(target, 'field_0',
+        'field_1', 'Many2Many'),
+    }
+
+
+class SyntheticPool(object):
+    """A pool of synthetic models with the interface of `trytond.pool.Pool`
+    used to build the config
+    """
+
+    def __init__(self):
+        self.models = {}
+
+    def get(self, name, type='model'):
+        return self.models[name]
+
+    def object_name_list(self, type='model'):
+        return self.models.keys()
+
+
+def parse_mix(mix):
+    """Parses a mix like `char:4,integer:2` into a list of `(type, weight)`
+    """
+    result = []
+    for item in mix.split(','):
+        type_, _, weight = item.strip().partition(':')
+        if type_ not in FIELDS:
+            raise ValueError("Unknown field type %s" % type_)
+        result.append((type_, int(weight or 1)))
+    return result
+
+
+def make_pool(models, columns, mix, select_ratio, seed=0):
+    """Returns a :class:`SyntheticPool` of `models` models of `columns`
+    columns each. The types of the columns are drawn from the weighted
+    `mix`, and a share `select_ratio` of them have `select=1`. Relational
+    fields point to other models of the pool.
+    """
+    rng = random.Random(seed)
+    types = sum([[type_] * weight for type_, weight in mix], [])
+    pool = SyntheticPool()
+    for i in xrange(models):
+        attributes = {
+            '_name': 'bench.model%d' % i,
+            '_table': 'bench_model%d' % i,
+            }
+        for j in xrange(columns):
+            field = FIELDS[rng.choice(types)](
+                'bench.model%d' % rng.randrange(models))
+            field.select = 1 if rng.random() < select_ratio else 0
+            attributes['field_%d' % j] = field
+        # Building the instance the way the pool does would register the
+        # class and initialise the model against a database
+        model_class = type('BenchModel%d' % i, (ModelSQL,), attributes)
+        model_object = object.__new__(model_class)
+        model_object.pool = pool
+        pool.models[attributes['_name']] = model_object
+    return pool
+
+
+def measure(function, repeat):
+    """Runs the function `repeat` times and returns its last result and a
+    :class:`dict` of the measures of the stage
+    """
+    times, result = [], None
+    for run_number in xrange(repeat):
+        # Free the result of the previous run before counting the objects
+        result = None
+        gc.collect()
+        objects = len(gc.get_objects())
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+        gc.collect()
+        objects = len(gc.get_objects()) - objects
+    return result, {
+        'seconds': min(times),
+        'retained_objects': objects,
+        'process_peak_rss_kb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def run(models, columns, mix, select_ratio, repeat):
+    """Runs the stages of the build on a synthetic pool and returns the
+    results as a :class:`dict`
+    """
+    CONFIG.options.setdefault('data_path', '/var/lib/trytond')
+    pool, setup = measure(
+        lambda: make_pool(models, columns, mix, select_ratio), 1)
+    base_source = BaseSource.from_tryton_config('bench')
+
+    stages = []
+    model_objects, result = measure(
+        lambda: list(iter_sql_models(pool)), repeat)
+    stages.append(('iter_sql_models', result))
+    _, result = measure(
+        lambda: [get_attributes(model) for model in model_objects], repeat)
+    stages.append(('guess_type', result))
+    sources, result = measure(
+        lambda: [DataSource.from_model(model, base_source)
+            for model in model_objects], repeat)
+    stages.append(('from_model', result))
+    sources = [source for source in sources if source.sql_query]
+    _, result = measure(
+        lambda: [source.as_string() for source in sources], repeat)
+    stages.append(('as_string', result))
+
+    def write_to():
+        output = StringIO()
+        base_source.write_to(output)
+        for source in sources:
+            source.write_to(output)
+        return output.tell()
+    size, result = measure(write_to, repeat)
+    stages.append(('write_to', result))
+
+    return {
+        'python': sys.version.split()[0],
+        'models': models,
+        'columns': columns,
+        'mix': dict(mix),
+        'select_ratio': select_ratio,
+        'repeat': repeat,
+        'sources': len(sources),
+        'config_bytes': size,
+        'setup': setup,
+        'stages': [dict(measures, name=name)
+            for name, measures in stages],
+        }
+
+
+def report(results, baseline=None):
+    """Returns the results as a text table, compared with the baseline
+    results if any
+    """
+    lines = ['%d models of %d columns, %d data sources, %d bytes of config'
+        % (results['models'], results['columns'], results['sources'],
+            results['config_bytes']), '']
+    header = '%-16s %10s %16s %20s' % ('stage', 'seconds',
+        'retained objects', 'process peak rss')
+    if baseline:
+        header += ' %10s' % 'vs base'
+    lines.append(header)
+    before = dict((stage['name'], stage)
+        for stage in (baseline or {}).get('stages', []))
+    for stage in results['stages']:
+        line = '%-16s %10.4f %16d %18dKB' % (stage['name'],
+            stage['seconds'], stage['retained_objects'],
+            stage['process_peak_rss_kb'])
+        if stage['name'] in before and before[stage['name']]['seconds']:
+            line += ' %9.2fx' % (
+                stage['seconds'] / before[stage['name']]['seconds'])
+        elif baseline:
+            line += ' %10s' % '-'
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-m', '--models', dest="models", type="int",
+        default=1000, help="The number of models (Default: 1000)")
+    parser.add_option('-c', '--columns', dest="columns", type="int",
+        default=20, help="The number of columns per model (Default: 20)")
+    parser.add_option('--mix', dest="mix", default=DEFAULT_MIX,
+        help="The weights of the field types of the columns (Default: %s)"
+            % DEFAULT_MIX)
+    parser.add_option('-s', '--select-ratio', dest="select_ratio",
+        type="float", default=0.5, help="The share of the columns with "
+            "select=1 (Default: 0.5)")
+    parser.add_option('-r', '--repeat', dest="repeat", type="int",
+        default=3, help="Runs of every stage, the best time is kept "
+            "(Default: 3)")
+    parser.add_option('-o', '--output', dest="output", default=None,
+        help="Save the results as JSON in this file")
+    parser.add_option('--compare', dest="compare", default=None,
+        help="A JSON file of previous results to compare with")
+    (options, args) = parser.parse_args()
+
+    results = run(options.models, options.columns, parse_mix(options.mix),
+        options.select_ratio, options.repeat)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+    sys.stdout.write(report(results, baseline))
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_renderer
+
+    Compares the time taken to render the data sources of a large database
+    with a template compiled on every call (the previous behaviour) and with
+    the precompiled, streaming renderer.
+
+        python bench_renderer.py [number of models]
+
+    :copyright: (c) 2011 by Douglas Morato
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import time
+from StringIO import StringIO
+
+from jinja2 import Environment
+from trytond.config import CONFIG
+
+from tryton_sphinx import DataSource
+from tryton_sphinx.renderer import TEMPLATES
+
+
+def make_sources(count):
+    sources = []
+    for i in xrange(count):
+        table = 'model_%d' % i
+        attributes = dict(('field_%d' % j, 'sql_field_string')
+            for j in xrange(10))
+        sources.append(DataSource(
+            name = '%s : base_source' % table,
+            sql_query = 'SELECT "id", %s FROM "%s" '
+                'WHERE "id" >= $start AND "id" <= $end' % (
+                    ', '.join(attributes.keys()), table),
+            attributes = attributes,
+            sql_query_range = 'SELECT MIN(id),MAX(id) FROM "%s"' % table,
+            ))
+    return sources
+
+
+def compile_per_call(sources, file):
+    for source in sources:
+        template = Environment().from_string(TEMPLATES['data_source'])
+        file.write(template.render(cls=source, config=CONFIG).encode('utf-8'))
+
+
+def precompiled(sources, file):
+    for source in sources:
+        source.write_to(file)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    CONFIG.options.setdefault('data_path', '/var/lib/trytond')
+    sources = make_sources(count)
+
+    # Compile the shared template before timing, like the first source of a
+    # real run would
+    precompiled(sources[:1], StringIO())
+
+    for label, function in [
+            ('compile per call', compile_per_call),
+            ('precompiled, streamed', precompiled)]:
+        output = StringIO()
+        start = time.time()
+        function(sources, output)
+        elapsed = time.time() - start
+        sys.stdout.write("%-24s %4d sources  %8.3fs  %8.3fms/source\n" % (
+            label, count, elapsed, elapsed * 1000 / count))
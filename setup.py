@@ -19,18 +19,33 @@ setup(
     version = __version__,
 
     packages = [
-        'tryton_sphinx'
+        'tryton_sphinx',
+        'tryton_sphinx.tests',
         ],
     package_dir = {
         'tryton_sphinx': 'api',
+        'tryton_sphinx.tests': 'api/tests',
         },
-    scripts = ['bin/tryton-sphinx-buildconf.py'],
+    scripts = [
+        'bin/tryton-sphinx-buildconf.py',
+        'bin/tryton-sphinx-merge.py',
+        'bin/tryton-sphinx-rtworker.py',
+        'bin/tryton-sphinx-index.py',
+        'bin/tryton-sphinx-xmlpipe.py',
+        'bin/tryton-sphinx-querylog.py',
+        'bin/tryton-sphinx-warmup.py',
+        ],
 
     install_requires = [
         'trytond>=2.0',
         'distribute',
         'jinja2',
         ],
+    extras_require = {
+        'realtime': ['MySQL-python'],
+        'client': ['MySQL-python'],
+        },
+    test_suite = 'tryton_sphinx.tests.suite',
 
 
     # metadata for upload to PyPI